@@ -0,0 +1,1011 @@
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import platform
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from fsm import fsm
+from fsm_batch import fsm_batch
+from fsm_binary import cached_dfa, load_dfa
+from fsm_bytes import compile_byte_lexer, lex_bytes, parse_bytes
+from fsm_cache import cache_info, cached_lex_parse, new_cache
+from fsm_classes import compile_classes
+from fsm_codegen import codegen
+from fsm_compiler import compile_dfa, fsm_compiled
+from fsm_corpus import extract_corpus, find_files
+from fsm_lexer import fsm_lexer_backtrack, lex, lex_kinds, lex_spans, tokenize_ignore
+from fsm_incremental import edit_document, new_document
+from fsm_master import compile_master, lex_master
+from fsm_memo import lex_memo, memo_info, new_memo
+from fsm_minimize import minimize
+from fsm_parser import compile_parser, fsm_parser, parse, parse_kinds
+from fsm_product import lex_product, product_lexer
+from fsm_parallel import fsm_parallel, fsm_parallel_numpy
+from fsm_pipeline import lex_parse
+from fsm_reorder import reorder_transitions
+from fsm_stats import new_stats
+from fsm_regex import compile_lexer
+import pa1
+
+"""
+Benchmarks for the automata engines.
+
+The corpus benchmarks time each engine on generated text of increasing size and report
+throughput, peak memory and the scaling slope. Results can be saved as JSON and compared
+against a saved baseline, in which case regressions are printed and the exit status is 1.
+
+Run with:
+
+    python benchmarks.py
+    python benchmarks.py --sizes 1024,1048576,104857600 --output results.json
+    python benchmarks.py --baseline results.json
+    python benchmarks.py --micro
+
+Peak memory needs tracemalloc and is reported as None without it.
+"""
+
+"""
+Adversarial lexer table for backtracking.
+
+Tokens are 'a' and 'a+b'. On a long run of a's without a b, every token start scans to the end
+of the string before backtracking to a single 'a', so naive backtracking is quadratic.
+"""
+backtrack_q0 = 'A'
+
+backtrack_transitions = {
+    'A': (
+        ('a', 'A_TOKEN'),
+        ('b', 'ERROR_B'),
+    ),
+    'A_TOKEN': (
+        ('a', 'B'),
+        ('b', 'AB_TOKEN'),
+    ),
+    'B': (
+        ('a', 'B'),
+        ('b', 'AB_TOKEN'),
+    ),
+    'AB_TOKEN': (),
+    'ERROR_B': (),
+}
+
+backtrack_F = ('A_TOKEN', 'AB_TOKEN')
+
+"""
+Binary string DFA from tests.py, accepts strings that start with 1 and end with 10.
+"""
+binary_q0 = 'A'
+
+binary_transitions = {
+    'A': (
+        ('0', 'D'),
+        ('1', 'B'),
+    ),
+    'D': (
+        (r"[01]", 'D'),
+    ),
+    'B': (
+        ('0', 'C'),
+        ('1', 'B'),
+    ),
+    'C': (
+        ('0', 'C'),
+        ('1', 'B'),
+    )
+}
+
+binary_F = ('C')
+
+"""
+Returns a list of random binary strings.
+"""
+def binary_strings(count, min_length=4, max_length=16, seed=0):
+    generator = random.Random(seed)
+    return [''.join(generator.choice('01') for i in range(generator.randint(min_length, max_length)))
+        for j in range(count)]
+
+"""
+Pieces of pa1 style meeting text. Each piece is filled in with random times and numbers.
+"""
+meeting_pieces = (
+    'The meeting is at %(hour24)s. ',
+    'Please come by %(hour12)s:%(minute)s %(am_pm)s on February %(day)s. ',
+    'It will last from %(hour12)s-%(hour12_2)s %(am_pm)s. ',
+    'Lunch is from %(hour12)s to %(hour12_2)s. ',
+    'Call %(number)s-%(number)s for the room. ',
+    'The screen has a %(day)s:%(minute)s aspect ratio! ',
+    'There will be a sumptuous banquet afterward at %(hour24)s hours. ',
+    'Hello Myra, the address is %(hour24)s Sycamore Lane. ',
+)
+
+"""
+Pieces of text that end in the middle of a time, so most tokens are ERROR tokens.
+"""
+error_pieces = ('12:', '1:5', '12:3x', '2:', '123:', '99:99', '12:60', '1:')
+
+"""
+Returns pa1 style meeting text of exactly size characters.
+"""
+def meeting_text(size, seed=0):
+    generator = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = generator.choice(meeting_pieces) % {
+            'hour24': '%02d00' % generator.randint(0, 23),
+            'hour12': generator.randint(1, 12),
+            'hour12_2': generator.randint(1, 12),
+            'minute': '%02d' % generator.randint(0, 59),
+            'am_pm': generator.choice(('AM', 'PM', 'am', 'pm')),
+            'day': generator.randint(1, 28),
+            'number': generator.randint(100, 9999),
+        }
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:size]
+
+"""
+Returns adversarial text of exactly size characters where most tokens are ERROR tokens.
+"""
+def error_text(size, seed=0):
+    generator = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = generator.choice(error_pieces) + generator.choice(' .,')
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:size]
+
+"""
+Returns one random binary string of exactly size characters.
+"""
+def binary_text(size, seed=0):
+    generator = random.Random(seed)
+    return ''.join(generator.choice(('0000', '0101', '1010', '1100', '1111')) for i in range(size // 4 + 1))[:size]
+
+"""
+Helper that times a function call.
+
+Returns:
+    Tuple of (seconds, result)
+"""
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return (time.time() - start, result)
+
+"""
+Times fsm_lexer_backtrack with and without the memo on the adversarial table.
+
+Args:
+    sizes: Tuple of input lengths
+    memoize: Passed to fsm_lexer_backtrack
+
+Returns:
+    A list of (size, seconds) tuples
+"""
+def bench_backtrack(sizes, memoize=True):
+    results = []
+    for size in sizes:
+        string = 'a' * size
+        meta = {
+            'tokens': [],
+            'current_token': [],
+            'accepted_token': None,
+            'start_state': backtrack_q0
+        }
+        seconds, meta = timed(fsm_lexer_backtrack, string, backtrack_q0, backtrack_transitions,
+            backtrack_F, meta, memoize=memoize)
+        results.append((size, seconds))
+    return results
+
+"""
+Compares lex throughput on the pa1 lexer table before and after minimization.
+
+Args:
+    repeat: Number of copies of pa1.string in the input
+
+Returns:
+    A dict with the number of states and chars per second for the original and minimized table
+"""
+def bench_minimize(repeat=200):
+    string = ' '.join([pa1.string] * repeat)
+    transitions, start, final_states = minimize(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+
+    original_seconds, original_tokens = timed(lex, string, pa1.lexer_q0, pa1.lexer_transitions,
+        pa1.lexer_F, pa1.tokenize_events)
+    minimized_seconds, minimized_tokens = timed(lex, string, start, transitions,
+        final_states, pa1.tokenize_events)
+    assert original_tokens == minimized_tokens
+
+    return {
+        'original_states': len(pa1.lexer_transitions),
+        'original_patterns': sum(len(patterns) for patterns in pa1.lexer_transitions.values()),
+        'original_chars_per_second': len(string) / original_seconds,
+        'minimized_states': len(transitions),
+        'minimized_patterns': sum(len(patterns) for patterns in transitions.values()),
+        'minimized_chars_per_second': len(string) / minimized_seconds,
+    }
+
+"""
+Times compile_lexer on a rule set with many keywords plus names, numbers and spaces.
+
+Args:
+    keywords: Number of keyword rules
+
+Returns:
+    A tuple of (seconds, number of states)
+"""
+def bench_compile_lexer(keywords=300):
+    letters = 'abcdefghijklmnop'
+    rules = []
+    for number in range(keywords):
+        word = ''.join(letters[int(digit)] for digit in str(number * 7919))
+        rules.append(('KEYWORD_%d' % number, word))
+    rules.append(('NUMBER', r'\d+(\.\d+)?'))
+    rules.append(('NAME', r'[a-zA-Z_]\w*'))
+    rules.append(('SPACE', r'\s+'))
+
+    seconds, result = timed(compile_lexer, rules)
+    return (seconds, len(result[0]))
+
+"""
+Compares strings per second of fsm, fsm_compiled and fsm_batch on a batch of binary strings.
+
+fsm_batch needs numpy and is left out if it is not installed.
+
+Returns:
+    A dict of engine name to strings per second
+"""
+def bench_batch(count=100000):
+    strings = binary_strings(count)
+    dfa = compile_dfa(binary_transitions, binary_q0, binary_F)
+    sample = strings[:count // 10]
+
+    results = {}
+    seconds, expected = timed(lambda: [fsm(string, binary_q0, binary_transitions, binary_F) for string in sample])
+    results['fsm'] = len(sample) / seconds
+    seconds, accepted = timed(lambda: [fsm_compiled(string, dfa) for string in strings])
+    results['fsm_compiled'] = count / seconds
+    assert accepted[:len(sample)] == expected
+    try:
+        seconds, batch = timed(fsm_batch, strings, dfa)
+    except ImportError:
+        return results
+    results['fsm_batch'] = count / seconds
+    assert list(batch) == accepted
+    return results
+
+"""
+Compares the interpreters with the functions generated by fsm_codegen.
+
+Args:
+    repeat: Number of copies of pa1.string in the lexer and parser input
+    count: Number of binary strings for fsm
+
+Returns:
+    A dict of engine name to a tuple of (interpreter seconds, generated seconds)
+"""
+def bench_codegen(repeat=200, count=20000):
+    results = {}
+
+    strings = binary_strings(count)
+    generated = codegen(binary_transitions, binary_q0, binary_F)
+    seconds, expected = timed(lambda: [fsm(string, binary_q0, binary_transitions, binary_F) for string in strings])
+    generated_seconds, accepted = timed(lambda: [generated(string) for string in strings])
+    assert accepted == expected
+    results['fsm'] = (seconds, generated_seconds)
+
+    string = ' '.join([pa1.string] * repeat)
+    generated = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex')
+    seconds, expected = timed(lex, string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    generated_seconds, tokens = timed(generated, string, pa1.tokenize_events)
+    assert tokens == expected
+    results['lex'] = (seconds, generated_seconds)
+
+    generated = codegen(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F, 'parse')
+    seconds, expected = timed(parse, tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+    generated_seconds, stmts = timed(generated, tokens)
+    assert stmts == expected
+    results['parse'] = (seconds, generated_seconds)
+
+    return results
+
+"""
+Compares compiling the pa1 lexer from the dicts in pa1 with loading it from a binary file.
+
+Load times are measured in this process. Memory is measured in fresh child processes that
+either only import the modules, compile the table, or load the file. Each child reads its own
+VmRSS and VmHWM from /proc/self/status. getrusage is not used, because its peak RSS carries
+over from this process into the children.
+
+Args:
+    repeat: Number of times to compile and load for the timings
+
+Returns:
+    A dict with compile_seconds, load_seconds and, per child, a (VmRSS, VmHWM) tuple in
+    kilobytes as baseline_rss, compile_rss and load_rss. The tuples are None where
+    /proc/self/status is not available.
+"""
+def bench_binary(repeat=20):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'pa1_lexer.fsm')
+    try:
+        cached_dfa(path, pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+
+        compile_seconds, dfa = timed(lambda: [compile_dfa(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F,
+            first_match=True) for i in range(repeat)])
+        load_seconds, dfa = timed(lambda: [load_dfa(path) for i in range(repeat)])
+
+        imports = 'import pa1, fsm_binary, fsm_compiler; '
+        report_rss = ('; status = dict(line.split(":", 1) for line in open("/proc/self/status")); '
+            'print("%s %s" % (status["VmRSS"].split()[0], status["VmHWM"].split()[0]))')
+        commands = {
+            'baseline_rss': imports + 'dfa = None',
+            'compile_rss': imports + 'dfa = fsm_compiler.compile_dfa(pa1.lexer_transitions, pa1.lexer_q0, '
+                'pa1.lexer_F, first_match=True)',
+            'load_rss': imports + 'dfa = fsm_binary.load_dfa(%r)' % path,
+        }
+        results = {
+            'compile_seconds': compile_seconds / repeat,
+            'load_seconds': load_seconds / repeat,
+        }
+        for name, command in commands.items():
+            try:
+                output = subprocess.check_output([sys.executable, '-c', command + report_rss],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT)
+                results[name] = tuple(int(value) for value in output.split()[-2:])
+            except (subprocess.CalledProcessError, ValueError, IndexError):
+                results[name] = None
+        return results
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+"""
+Times fsm_corpus.extract_corpus on a directory of generated meeting text files with different
+numbers of worker processes.
+
+Args:
+    files: Number of files
+    size: Size of each file in characters
+    processes: Tuple of worker process counts
+
+Returns:
+    A list of (processes, seconds) tuples
+"""
+def bench_parallel(files=400, size=20000, processes=(1, 2, 4)):
+    directory = tempfile.mkdtemp()
+    try:
+        for number in range(files):
+            with io.open(os.path.join(directory, 'message_%05d.txt' % number), 'w', encoding='utf-8') as output:
+                output.write(u'' + meeting_text(size, seed=number))
+        paths = find_files(directory)
+
+        results = []
+        for count in processes:
+            seconds, extracted = timed(lambda: list(extract_corpus(paths, processes=count)))
+            assert len(extracted) == files
+            results.append((count, seconds))
+        return results
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+"""
+Compares fsm_compiled with fsm_parallel and fsm_parallel_numpy on one long binary string.
+
+fsm_parallel_numpy needs numpy and is left out if it is not installed.
+
+Args:
+    size: Length of the string
+    processes: Tuple of worker process counts for fsm_parallel
+
+Returns:
+    A dict of engine name to chars per second
+"""
+def bench_parallel_accept(size=2000000, processes=(1, 2, 4)):
+    string = '1' + binary_text(size) + '10'
+    dfa = compile_dfa(binary_transitions, binary_q0, binary_F)
+
+    results = {}
+    seconds, expected = timed(fsm_compiled, string, dfa)
+    results['fsm_compiled'] = len(string) / seconds
+    for count in processes:
+        seconds, accepted = timed(fsm_parallel, string, dfa, processes=count)
+        assert accepted == expected
+        results['fsm_parallel, %d processes' % count] = len(string) / seconds
+    try:
+        seconds, accepted = timed(fsm_parallel_numpy, string, dfa)
+    except ImportError:
+        return results
+    assert accepted == expected
+    results['fsm_parallel_numpy'] = len(string) / seconds
+    return results
+
+"""
+Times the pa1 parser matching patterns token by token against the compiled parser, with
+named tokens and with kind ids from lex_kinds.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A dict of engine name to seconds
+"""
+def bench_parser_kinds(size=500000):
+    string = meeting_text(size, seed=1)
+    tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    parser = compile_parser(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F)
+    kind_tokens = lex_kinds(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events,
+        parser['kinds'])
+    meta = {
+        'stmts': [],
+        'current_stmt': [],
+        'accepted_stmt': None,
+        'start_state': pa1.parser_q0
+    }
+
+    results = {}
+    results['fsm_parser'], expected = timed(fsm_parser, tokens, 0, pa1.parser_q0, pa1.parser_transitions,
+        pa1.parser_F, meta)
+    results['parse'], stmts = timed(parse, tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+    assert stmts == tuple(expected['stmts'])
+    results['parse_kinds'], stmts = timed(parse_kinds, kind_tokens, parser)
+    assert stmts == tuple(expected['stmts'])
+    return results
+
+"""
+Times the pa1 lexer plus a date and a phone number lexer, each run on its own and all run
+as one lazy product.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A tuple of (seconds for the separate runs, seconds for the product, product states)
+"""
+def bench_product(size=300000):
+    dates = compile_lexer([('DATE', r'\d\d?/\d\d?(/\d\d\d\d)?'), ('NUMBER', r'\d+'), ('OTHER', r'[^\d/]+'),
+        ('SLASH', '/')], {'OTHER': tokenize_ignore})
+    phones = compile_lexer([('PHONE', r'\d\d\d-\d\d\d\d'), ('WORD', r'[A-Za-z]+'), ('REST', r'[^A-Za-z]')],
+        {'REST': tokenize_ignore})
+    lexers = [pa1.lexer] + [(start, transitions, final_states, tokenize_events)
+        for transitions, start, final_states, tokenize_events in (dates, phones)]
+    string = meeting_text(size, seed=1)
+
+    start = time.time()
+    expected = tuple(lex(string, *lexer) for lexer in lexers)
+    seconds = time.time() - start
+    product = product_lexer(lexers)
+    product_seconds, tokens = timed(lex_product, string, product)
+    assert tokens == expected
+    return seconds, product_seconds, len(product['states'])
+
+"""
+Compares a DFA with one column per character against one with character classes.
+
+The table counts table columns for the pa1 lexer. The timing runs a small acceptor for
+numbers in text over meeting text written with Cyrillic letters, which are outside the
+alphabet of compile_dfa and fall back to re.match there.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A dict with the pa1 lexer column counts and the seconds of both acceptors
+"""
+def bench_classes(size=300000):
+    dfa = compile_dfa(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+    classes = compile_classes(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+
+    transitions = {
+        'A': ((r'[0-9]', 'B'), (r'[^0-9]', 'A')),
+        'B': ((r'[0-9:]', 'B'), (r'[ apAP.,\-]', 'A')),
+    }
+    string = meeting_text(size, seed=1)
+    for char, cyrillic in zip('bcdefghijkl', u'\u0430\u0431\u0432\u0433\u0434\u0435\u0436\u0437\u0438\u0439\u043a'):
+        string = string.replace(char, cyrillic)
+    seconds, expected = timed(fsm_compiled, string, compile_dfa(transitions, 'A', ('A', 'B'), first_match=True))
+    class_seconds, accepted = timed(fsm_compiled, string, compile_classes(transitions, 'A', ('A', 'B'), first_match=True))
+    assert accepted == expected
+
+    return {
+        'columns': len(dfa['table'][0]),
+        'class_columns': len(classes['table'][0]),
+        'seconds': seconds,
+        'class_seconds': class_seconds,
+    }
+
+"""
+Times the pa1 lexer with re.match per step against a lazy transition memo on meeting text
+written with Cyrillic letters, with the default memo size and with one small enough to evict.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A dict with the seconds of lex and of lex_memo per memo size, and the memo counters of
+    the small memo
+"""
+def bench_memo(size=300000):
+    string = meeting_text(size, seed=1)
+    for char, cyrillic in zip('bcdefghijkl', u'\u0430\u0431\u0432\u0433\u0434\u0435\u0436\u0437\u0438\u0439\u043a'):
+        string = string.replace(char, cyrillic)
+    lexer = (pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+
+    seconds, expected = timed(lex, string, *lexer)
+    memo_seconds, tokens = timed(lex_memo, string, *(lexer + (new_memo(pa1.lexer_transitions),)))
+    assert tokens == expected
+    small = new_memo(pa1.lexer_transitions, max_chars=8)
+    small_seconds, tokens = timed(lex_memo, string, *(lexer + (small,)))
+    assert tokens == expected
+
+    info = memo_info(small)
+    return {
+        'lex': seconds,
+        'lex_memo': memo_seconds,
+        'lex_memo_small': small_seconds,
+        'misses': info['misses'],
+        'evictions': info['evictions'],
+    }
+
+"""
+Times decoding UTF-8 and lexing it with lex_spans against lexing the bytes with lex_bytes.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A dict with the seconds of both and of parse_bytes on the byte spans
+"""
+def bench_bytes(size=500000):
+    string = meeting_text(size, seed=1)
+    data = string if isinstance(string, bytes) else string.encode('utf-8')
+    dfa = compile_byte_lexer(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+
+    start = time.time()
+    spans = lex_spans(data.decode('utf-8'), pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    seconds = time.time() - start
+    byte_seconds, byte_spans = timed(lex_bytes, data, dfa, pa1.tokenize_events)
+    assert [byte_spans['kinds'][kind] for kind in byte_spans['kind']] == [spans['kinds'][kind] for kind in spans['kind']]
+    parse_seconds, stmts = timed(parse_bytes, byte_spans, pa1.parser)
+    assert tuple(stmt.decode('utf-8') for stmt in stmts) == lex_parse(data.decode('utf-8'), pa1.lexer, pa1.parser)
+
+    return {
+        'lex_spans': seconds,
+        'lex_bytes': byte_seconds,
+        'parse_bytes': parse_seconds,
+    }
+
+"""
+Times lex_parse of a stream of documents where most repeat, with and without a result cache.
+
+Args:
+    size: Size of each document in characters
+    documents: Number of documents in the stream
+    distinct: Number of distinct documents among them
+
+Returns:
+    A tuple of (seconds without the cache, seconds with the cache, cache_info of the cache)
+"""
+def bench_cache(size=2000, documents=500, distinct=20):
+    texts = [meeting_text(size, seed=seed) for seed in range(distinct)]
+    stream = [texts[i % distinct] for i in range(documents)]
+
+    start = time.time()
+    results = [lex_parse(string, pa1.lexer, pa1.parser) for string in stream]
+    seconds = time.time() - start
+
+    cache = new_cache()
+    start = time.time()
+    cached_results = [cached_lex_parse(string, pa1.lexer, pa1.parser, cache) for string in stream]
+    cached_seconds = time.time() - start
+    assert cached_results == results
+
+    return seconds, cached_seconds, cache_info(cache)
+
+"""
+Times single character insertions into a document against lexing and parsing it again.
+
+Args:
+    size: Size of the document in characters
+    edits: Number of insertions at random positions
+
+Returns:
+    A tuple of (full lex and parse seconds, mean seconds per edit)
+"""
+def bench_incremental(size=200000, edits=20):
+    document = new_document(meeting_text(size, seed=1), pa1.lexer, pa1.parser)
+    positions = random.Random(1)
+    start = time.time()
+    for edit in range(edits):
+        position = positions.randint(0, len(document['string']))
+        document = edit_document(document, position, position, '3')
+    edit_seconds = (time.time() - start) / edits
+
+    start = time.time()
+    tokens = lex(document['string'], pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    stmts = parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+    seconds = time.time() - start
+    assert stmts == tuple(document['stmts'])
+    return seconds, edit_seconds
+
+"""
+Times the pa1 lexer against the same table compiled into a master regex.
+
+Args:
+    size: Size of the text in characters
+
+Returns:
+    A tuple of (lex seconds, lex_master seconds, compile_master seconds)
+"""
+def bench_master(size=500000):
+    string = meeting_text(size, seed=1)
+    compile_seconds, master = timed(compile_master, pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+    seconds, expected = timed(lex, string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    master_seconds, tokens = timed(lex_master, string, master, pa1.tokenize_events)
+    assert tokens == expected
+    return seconds, master_seconds, compile_seconds
+
+"""
+Parses tokens with the pa1 parser through fsm_parser, which tries the patterns of a state in
+order with re.match instead of using a compiled parser.
+"""
+def parse_regex_pa1(tokens, transitions):
+    meta = {
+        'stmts': [],
+        'current_stmt': [],
+        'accepted_stmt': None,
+        'start_state': pa1.parser_q0
+    }
+    return tuple(fsm_parser(tokens, 0, pa1.parser_q0, transitions, pa1.parser_F, meta)['stmts'])
+
+"""
+Reorders the pa1 lexer and parser tables with hit counts from a sample and compares regex
+attempts and time on a different text of the same kind.
+
+Pattern order only matters to the engines that try patterns one by one with re.match: lex,
+iter_lex and fsm_parser. parse and iter_parse go through a compiled parser, where every
+column is filled in ahead of time, so a reordered table runs just as fast there and is not
+timed. The parser rows time fsm_parser instead.
+
+Both tables are timed in turn and the fastest of repeat runs is kept, since a single run of
+each was mostly showing which one ran first.
+
+Args:
+    size: Size of the sample and of the measured text in characters
+    repeat: Number of timed runs per table
+
+Returns:
+    A dict of stage name to a tuple of (original attempts per symbol, reordered attempts
+    per symbol, original seconds, reordered seconds)
+"""
+def bench_reorder(size=200000, repeat=5):
+    stats = new_stats()
+    tokens = lex(meeting_text(size, seed=1), pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F,
+        pa1.tokenize_events, stats=stats)
+    parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F, stats=stats)
+    names = set(name for patterns in pa1.parser_transitions.values() for pattern, target in patterns
+        for name in pattern.split('|'))
+    lexer_transitions = reorder_transitions(pa1.lexer_transitions, stats['lexer']['transitions'])
+    parser_transitions = reorder_transitions(pa1.parser_transitions, stats['parser']['transitions'], names)
+
+    string = meeting_text(size, seed=2)
+    tables = (('original', pa1.lexer_transitions, pa1.parser_transitions),
+        ('reordered', lexer_transitions, parser_transitions))
+    results = {}
+    for label, lexer_table, parser_table in tables:
+        stats = new_stats()
+        tokens = lex(string, pa1.lexer_q0, lexer_table, pa1.lexer_F, pa1.tokenize_events, stats=stats)
+        parse(tokens, pa1.parser_q0, parser_table, pa1.parser_F, stats=stats)
+        results[label] = {
+            'lexer': [stats['lexer']['regex_attempts'] / float(len(string)), float('inf')],
+            'parser': [stats['parser']['regex_attempts'] / float(len(tokens)), float('inf')],
+            'tokens': tokens,
+        }
+
+    for i in range(repeat):
+        for label, lexer_table, parser_table in tables:
+            result = results[label]
+            seconds, tokens = timed(lex, string, pa1.lexer_q0, lexer_table, pa1.lexer_F, pa1.tokenize_events)
+            result['lexer'][1] = min(result['lexer'][1], seconds)
+            seconds, stmts = timed(parse_regex_pa1, tokens, parser_table)
+            result['parser'][1] = min(result['parser'][1], seconds)
+            result['stmts'] = stmts
+    assert results['original']['tokens'] == results['reordered']['tokens']
+    assert results['original']['stmts'] == results['reordered']['stmts']
+
+    original = results['original']
+    reordered = results['reordered']
+    return {
+        'lexer': (original['lexer'][0], reordered['lexer'][0], original['lexer'][1], reordered['lexer'][1]),
+        'parser': (original['parser'][0], reordered['parser'][0], original['parser'][1], reordered['parser'][1]),
+    }
+
+"""
+Lexes a string with the pa1 lexer.
+"""
+def lex_pa1(string):
+    return lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+
+"""
+Runs fsm with the binary string DFA. Produces no tokens, so returns None.
+"""
+def accept_binary(string):
+    fsm(string, binary_q0, binary_transitions, binary_F)
+
+"""
+Engines measured by the corpus benchmarks.
+
+Each engine is a tuple of (corpus, prepare, run). prepare turns the corpus text into the
+argument for run and is not timed. run returns the number of tokens or statements it produced,
+or None if it does not produce any.
+"""
+engines = {
+    'fsm': (binary_text, None, accept_binary),
+    'fsm_lexer': (meeting_text, None, lambda string: len(lex_pa1(string))),
+    'fsm_lexer_errors': (error_text, None, lambda string: len(lex_pa1(string))),
+    'fsm_parser': (meeting_text, lex_pa1,
+        lambda tokens: len(parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F))),
+    'pa1_pipeline': (meeting_text, None, lambda string: len(lex_parse(string, pa1.lexer, pa1.parser))),
+}
+
+"""
+Runs one engine on one corpus size.
+
+Small sizes are timed a few times and the fastest run is kept. Peak memory is measured on a
+separate run, since tracing allocations slows the engines down.
+
+Returns:
+    A dict with the size, seconds, chars_per_second, tokens_per_second and peak_memory in bytes
+"""
+def measure(engine, size):
+    corpus, prepare, run = engines[engine]
+    text = corpus(size)
+    argument = prepare(text) if prepare else text
+
+    timings = [timed(run, argument) for i in range(max(1, min(5, 262144 // max(size, 1))))]
+    seconds, count = min(timings, key=lambda timing: timing[0])
+    seconds = max(seconds, 1e-9)
+
+    peak_memory = None
+    if tracemalloc:
+        tracemalloc.start()
+        run(argument)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'size': size,
+        'seconds': seconds,
+        'chars_per_second': size / seconds,
+        'tokens_per_second': None if count is None else count / seconds,
+        'peak_memory': peak_memory,
+    }
+
+"""
+Returns the slope of log(seconds) against log(size). 1.0 means linear scaling.
+"""
+def scaling_slope(measurements):
+    points = [(math.log(m['size']), math.log(m['seconds'])) for m in measurements]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, y in points) / len(points)
+    mean_y = sum(y for x, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+"""
+Runs the corpus benchmarks.
+
+Args:
+    sizes: Corpus sizes in characters
+    names: Engine names to run. Defaults to all engines.
+
+Returns:
+    A dict that can be saved as JSON with the python version and, per engine, the
+    measurements and the scaling slope
+"""
+def bench_corpus(sizes, names=None):
+    results = {
+        'python': platform.python_version(),
+        'engines': {},
+    }
+    for engine in sorted(names or engines):
+        measurements = [measure(engine, size) for size in sizes]
+        results['engines'][engine] = {
+            'measurements': measurements,
+            'slope': scaling_slope(measurements),
+        }
+    return results
+
+"""
+Compares corpus results against a baseline.
+
+A measurement is a regression if its throughput dropped by more than tolerance compared to the
+baseline measurement of the same size. An engine is a regression if its scaling slope grew by
+more than slope_tolerance.
+
+Returns:
+    A list of messages, one per regression
+"""
+def compare_results(results, baseline, tolerance=0.25, slope_tolerance=0.2):
+    regressions = []
+    for engine, result in sorted(results['engines'].items()):
+        if engine not in baseline['engines']:
+            continue
+        expected = baseline['engines'][engine]
+        baseline_sizes = dict((m['size'], m) for m in expected['measurements'])
+        for measurement in result['measurements']:
+            before = baseline_sizes.get(measurement['size'])
+            if before and measurement['chars_per_second'] < before['chars_per_second'] * (1 - tolerance):
+                regressions.append('%s at %d chars: %.0f chars/s, baseline %.0f chars/s' % (engine,
+                    measurement['size'], measurement['chars_per_second'], before['chars_per_second']))
+        if result['slope'] is not None and expected['slope'] is not None and \
+                result['slope'] > expected['slope'] + slope_tolerance:
+            regressions.append('%s scaling slope %.2f, baseline %.2f' % (engine, result['slope'], expected['slope']))
+    return regressions
+
+"""
+Prints the corpus results.
+"""
+def report_corpus(results):
+    print('corpus benchmarks, python %s' % results['python'])
+    for engine, result in sorted(results['engines'].items()):
+        slope = result['slope']
+        print('  %s, slope %s' % (engine, 'n/a' if slope is None else '%.2f' % slope))
+        for m in result['measurements']:
+            print('    %10d chars  %8.4fs  %12.0f chars/s  %12s tokens/s  %12s bytes peak' % (m['size'],
+                m['seconds'], m['chars_per_second'],
+                'n/a' if m['tokens_per_second'] is None else '%.0f' % m['tokens_per_second'],
+                'n/a' if m['peak_memory'] is None else m['peak_memory']))
+
+"""
+Prints a table of (size, seconds) results along with the ratio to the previous size.
+"""
+def report(title, results):
+    print(title)
+    previous = None
+    for size, seconds in results:
+        if previous:
+            print('  %10d  %8.4fs  x%.1f' % (size, seconds, seconds / max(previous, 1e-9)))
+        else:
+            print('  %10d  %8.4fs' % (size, seconds))
+        previous = seconds
+
+"""
+Runs the older micro benchmarks.
+"""
+def micro():
+    report('backtracking lexer, memoized', bench_backtrack((1000, 2000, 4000, 8000, 16000, 32000)))
+    report('backtracking lexer, naive', bench_backtrack((500, 1000, 2000), memoize=False))
+
+    result = bench_minimize()
+    print('minimized pa1 lexer')
+    print('  original   %3d states %3d patterns %10.0f chars/s' % (result['original_states'],
+        result['original_patterns'], result['original_chars_per_second']))
+    print('  minimized  %3d states %3d patterns %10.0f chars/s' % (result['minimized_states'],
+        result['minimized_patterns'], result['minimized_chars_per_second']))
+
+    print('batch acceptance of binary strings')
+    for engine, strings_per_second in sorted(bench_batch().items()):
+        print('  %-14s %12.0f strings/s' % (engine, strings_per_second))
+
+    seconds, states = bench_compile_lexer()
+    print('compile_lexer with 300 keywords')
+    print('  %8.4fs  %d states' % (seconds, states))
+
+    print('generated code')
+    for engine, (seconds, generated_seconds) in sorted(bench_codegen().items()):
+        print('  %-6s %8.4fs  %8.4fs  x%.1f' % (engine, seconds, generated_seconds, seconds / max(generated_seconds, 1e-9)))
+
+    result = bench_binary()
+    print('pa1 lexer from dicts and from a binary file')
+    print('  compile  %8.5fs  load  %8.5fs  x%.1f' % (result['compile_seconds'], result['load_seconds'],
+        result['compile_seconds'] / max(result['load_seconds'], 1e-9)))
+    if None in (result['baseline_rss'], result['compile_rss'], result['load_rss']):
+        print('  RSS not measured, /proc/self/status is not available')
+    else:
+        baseline_rss, baseline_hwm = result['baseline_rss']
+        print('  RSS of a new process: imports only %d KB (peak %d KB)' % (baseline_rss, baseline_hwm))
+        for name in ('compile', 'load'):
+            rss, hwm = result[name + '_rss']
+            print('  %-8s +%d KB (peak +%d KB) over imports only' % (name, rss - baseline_rss, hwm - baseline_hwm))
+
+    print('corpus extraction with worker processes, %d CPUs' % multiprocessing.cpu_count())
+    results = bench_parallel()
+    for processes, seconds in results:
+        print('  %2d processes  %8.4fs  x%.2f' % (processes, seconds, results[0][1] / max(seconds, 1e-9)))
+
+    print('acceptance of one long binary string')
+    for engine, chars_per_second in sorted(bench_parallel_accept().items()):
+        print('  %-28s %12.0f chars/s' % (engine, chars_per_second))
+
+    seconds, master_seconds, compile_seconds = bench_master()
+    print('pa1 lexer as a master regex')
+    print('  lex %8.4fs  lex_master %8.4fs  x%.1f  compile %8.4fs' % (seconds, master_seconds,
+        seconds / max(master_seconds, 1e-9), compile_seconds))
+
+    print('pa1 parser, regex patterns against compiled kinds')
+    for engine, seconds in sorted(bench_parser_kinds().items()):
+        print('  %-12s %8.4fs' % (engine, seconds))
+
+    result = bench_classes()
+    print('character classes')
+    print('  pa1 lexer columns %d -> %d' % (result['columns'], result['class_columns']))
+    print('  non-ASCII text %8.4fs -> %8.4fs' % (result['seconds'], result['class_seconds']))
+
+    result = bench_memo()
+    print('pa1 lexer with a lazy transition memo')
+    print('  lex %8.4fs  lex_memo %8.4fs  x%.1f  8 chars per state %8.4fs  %d misses %d evictions' % (
+        result['lex'], result['lex_memo'], result['lex'] / max(result['lex_memo'], 1e-9),
+        result['lex_memo_small'], result['misses'], result['evictions']))
+
+    print('pa1 lexer on UTF-8 bytes')
+    for engine, seconds in sorted(bench_bytes().items()):
+        print('  %-12s %8.4fs' % (engine, seconds))
+
+    seconds, product_seconds, states = bench_product()
+    print('three lexers, separately and as one product')
+    print('  separate %8.4fs  product %8.4fs  x%.1f  %d product states' % (seconds, product_seconds,
+        seconds / max(product_seconds, 1e-9), states))
+
+    seconds, cached_seconds, info = bench_cache()
+    print('repeated documents, lex_parse with and without a result cache')
+    print('  uncached %8.4fs  cached %8.4fs  x%.1f  %d hits %d misses' % (seconds, cached_seconds,
+        seconds / max(cached_seconds, 1e-9), info['hits'], info['misses']))
+
+    seconds, edit_seconds = bench_incremental()
+    print('incremental lexing and parsing, one character inserted')
+    print('  full %8.4fs  edit %8.4fs  x%.1f' % (seconds, edit_seconds, seconds / max(edit_seconds, 1e-9)))
+
+    print('profile guided pattern order, regex attempts per symbol and seconds, lex and fsm_parser')
+    for stage, (attempts, reordered_attempts, seconds, reordered_seconds) in sorted(bench_reorder().items()):
+        print('  %-6s %6.2f -> %6.2f  %8.4fs -> %8.4fs' % (stage, attempts, reordered_attempts, seconds, reordered_seconds))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the automata engines.')
+    parser.add_argument('--sizes', default='1024,16384,262144,1048576',
+        help='Comma separated corpus sizes in characters')
+    parser.add_argument('--engines', help='Comma separated engine names, defaults to all of them')
+    parser.add_argument('--output', help='Save the corpus results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare the corpus results against this JSON file')
+    parser.add_argument('--micro', action='store_true', help='Also run the micro benchmarks')
+    args = parser.parse_args()
+
+    if args.micro:
+        micro()
+
+    results = bench_corpus([int(size) for size in args.sizes.split(',')],
+        args.engines.split(',') if args.engines else None)
+    report_corpus(results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare_results(results, json.load(baseline))
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            sys.exit(1)
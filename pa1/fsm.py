@@ -1,4 +1,5 @@
 import re
+import time
 
 """
 Finite state machine implementation for DFA's.
@@ -12,6 +13,7 @@ Args:
     state: The starting state for the given DFA
     transitions: See examples for transitions structure
     final_states: A tuple of accepting states
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in
 
 Returns:
     True if the string is a valid for the given DFA.
@@ -43,18 +45,54 @@ Example Usage:
 
     final_states = ('C')
 """
-def fsm(string, state, transitions, final_states):  
-    if len(string) == 0:
-        return state in final_states
+def fsm(string, state, transitions, final_states, stats=None):
+    if stats is not None:
+        return fsm_instrumented(string, state, transitions, final_states, stats['fsm'])
 
-    state_transitions = transitions[state]
-    next_state = None
+    for char in string:
+        state_transitions = transitions[state]
+        next_state = None
 
-    for state_transition in state_transitions:
-        if re.match(state_transition[0], string[0]):
-            next_state = state_transition[1]
+        for state_transition in state_transitions:
+            if re.match(state_transition[0], char):
+                next_state = state_transition[1]
 
-    if next_state:
-        return fsm(string[1:], next_state, transitions, final_states)
-    else:
-        return False
\ No newline at end of file
+        if next_state:
+            state = next_state
+        else:
+            return False
+
+    return state in final_states
+
+"""
+Same as fsm, but counts state visits, transitions and regex attempts in a stats section.
+See fsm_stats.
+"""
+def fsm_instrumented(string, state, transitions, final_states, stats):
+    start = time.time()
+    stats['calls'] += 1
+    states = stats['states']
+    taken = stats['transitions']
+    accepted = True
+
+    for char in string:
+        stats['symbols'] += 1
+        states[state] = states.get(state, 0) + 1
+        state_transitions = transitions[state]
+        next_state = None
+
+        for state_transition in state_transitions:
+            stats['regex_attempts'] += 1
+            if re.match(state_transition[0], char):
+                next_state = state_transition[1]
+                pattern = state_transition[0]
+
+        if next_state:
+            taken[(state, pattern)] = taken.get((state, pattern), 0) + 1
+            state = next_state
+        else:
+            accepted = False
+            break
+
+    stats['time'] += time.time() - start
+    return accepted and state in final_states
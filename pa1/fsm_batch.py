@@ -0,0 +1,128 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from fsm_compiler import fsm_compiled
+
+"""
+Vectorized acceptance for large batches of short strings using NumPy.
+
+The batch is encoded as a padded matrix of table columns with one row per character position.
+All strings are stepped at once, one position at a time, by fancy indexing into the compiled
+transition table. The padding uses an extra column that keeps every state where it is, so
+shorter strings need no masking.
+
+Strings with characters that are not in the alphabet of the compiled DFA fall back to
+fsm_compiled, so the results are always the same as fsm.
+
+Requires numpy.
+
+Args:
+    strings: A sequence of strings
+    dfa: A compiled DFA from fsm_compiler.compile_dfa over a character alphabet
+
+Returns:
+    A numpy array of booleans, True where the string is valid for the DFA
+
+Example Usage:
+    dfa = compile_dfa(transitions, 'A', ('C'))
+    accepted = fsm_batch(['00111', '110'], dfa)
+"""
+def fsm_batch(strings, dfa):
+    if numpy is None:
+        raise ImportError("fsm_batch requires numpy")
+
+    tables = batch_tables(dfa)
+    count = len(strings)
+    result = numpy.zeros(count, dtype=bool)
+    if count == 0:
+        return result
+
+    lengths = numpy.fromiter(map(len, strings), dtype=numpy.int64, count=count)
+    codes = encode_strings(strings)
+
+    # The last entry of column_of is -1 and stands in for every character past the alphabet
+    column_of = tables['column_of']
+    if len(codes) and int(codes.max()) >= len(column_of):
+        codes = numpy.minimum(codes, len(column_of) - 1)
+    columns = column_of[codes]
+
+    # Strings with characters outside the alphabet need the regex fallback
+    unknown = numpy.zeros(count, dtype=bool)
+    bad = numpy.flatnonzero(columns < 0)
+    if len(bad):
+        offsets = numpy.cumsum(lengths) - lengths
+        unknown[numpy.searchsorted(offsets, bad, side='right') - 1] = True
+        columns[bad] = 0
+
+    # Padded matrix with one row per position and one column per string. The padding column
+    # keeps every state where it is.
+    table = tables['table']
+    max_length = int(lengths.max())
+    padded = numpy.full((count, max_length), tables['padding'], dtype=numpy.min_scalar_type(tables['padding']))
+    padded[numpy.arange(max_length)[numpy.newaxis, :] < lengths[:, numpy.newaxis]] = columns
+    padded = numpy.ascontiguousarray(padded.T)
+
+    state = numpy.full(count, tables['start'] * tables['width'], dtype=table.dtype)
+    for position in range(max_length):
+        state = table[state + padded[position]]
+
+    result[:] = tables['final'][state // tables['width']]
+
+    for index in numpy.flatnonzero(unknown):
+        result[index] = fsm_compiled(strings[index], dfa)
+
+    return result
+
+"""
+Builds the NumPy arrays for a compiled DFA.
+
+The implicit error state is made explicit as the last state, with every column pointing back
+to itself, so the batch never has to check for it. An extra padding column points every state
+to itself. The table is flattened and stores each next state premultiplied by the width, so a
+step is a single add and lookup.
+
+Returns:
+    A dict with the following keys: table, width, padding, final, start, column_of
+"""
+def batch_tables(dfa):
+    states = len(dfa['states'])
+    padding = len(dfa['table'][0])
+    width = padding + 1
+    rows = [list(row) + [state] for state, row in enumerate(dfa['table'])]
+    rows.append([states] * width)
+    table = numpy.array(rows, dtype=numpy.int64)
+    table[table < 0] = states
+    table = (table * width).ravel()
+    if table.max() < 2 ** 31:
+        table = table.astype(numpy.int32)
+
+    final = numpy.array(list(dfa['final']) + [False], dtype=bool)
+
+    codes = [ord(symbol) for symbol in dfa['columns'] if len(symbol) == 1]
+    column_of = numpy.full(max(codes) + 2 if codes else 1, -1, dtype=numpy.int16 if width < 2 ** 15 else numpy.int32)
+    for symbol, column in dfa['columns'].items():
+        if len(symbol) == 1:
+            column_of[ord(symbol)] = column
+
+    return {
+        'table': table,
+        'width': width,
+        'padding': padding,
+        'final': final,
+        'start': dfa['start'],
+        'column_of': column_of,
+    }
+
+"""
+Returns the code points of all strings joined together as a numpy array.
+"""
+def encode_strings(strings):
+    text = ''.join(strings) if strings and isinstance(strings[0], bytes) else u''.join(strings)
+    if isinstance(text, bytes):
+        return numpy.frombuffer(text, dtype=numpy.uint8)
+    try:
+        return numpy.frombuffer(text.encode('latin-1'), dtype=numpy.uint8)
+    except UnicodeEncodeError:
+        return numpy.frombuffer(text.encode('utf-32-le'), dtype='<u4')
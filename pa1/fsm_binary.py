@@ -0,0 +1,259 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+from fsm_compiler import compile_dfa
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+"""
+Binary file format for DFAs compiled with fsm_compiler.compile_dfa.
+
+The file is loaded with mmap. The transition table is used straight from the mapped pages as
+int32 memoryview rows, so loading does not copy or parse it and processes that load the same
+file share the same pages.
+
+Layout, all numbers in native byte order:
+
+    header: See HEADER. Magic, version, byte order, flags, number of states and columns,
+        start state, content hash of the source table, and the offsets and sizes of the
+        sections below.
+    table: states x columns int32 next states, -1 for a missing transition
+    final: One byte per state, 1 for accepting states
+    symbols: int32 (code point, column) pairs for the symbols that are single characters
+    class_of: For DFAs from fsm_classes.compile_classes, the class of each code point, one
+        byte each or int32 if FLAG_WIDE_CLASSES is set. Empty otherwise.
+    meta: UTF-8 JSON with the state names, the columns of symbols that are not single
+        characters, like the token names of a parser, the patterns of each state and the
+        class ranges
+
+Sections start at multiples of 8 bytes. The table and class_of are used from the mapped
+pages. The symbols are read into the columns dict, with str keys for the first 256
+characters like compile_dfa uses on Python 2 as well. Only meta is parsed as JSON. It holds
+the parts that become Python objects anyway: the state names, the patterns, which are
+compiled on load since they are only needed for symbols outside the alphabet, and the class
+ranges.
+
+Python 2 has no memoryview.cast, so there the table and class_of are copied into arrays on
+load.
+
+Example Usage:
+    dfa = cached_dfa('pa1_lexer.fsm', pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+    fsm_compiled(string, dfa)
+"""
+
+MAGIC = b'FSMD'
+VERSION = 3
+HEADER = struct.Struct('=4sIBBIII20sIIIIIIIIII')
+FLAG_FIRST_MATCH = 1
+FLAG_WIDE_CLASSES = 2
+BYTE_ORDERS = {'little': 0, 'big': 1}
+
+"""
+Compiles a table and caches it in a binary file.
+
+If the file exists and was written for the same source table it is loaded. Otherwise the
+table is compiled and the file is written, replacing a stale file.
+
+Args:
+    path: File name
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    alphabet: See compile_dfa
+    first_match: See compile_dfa
+
+Returns:
+    A compiled DFA dict like compile_dfa, loaded from the file
+"""
+def cached_dfa(path, transitions, start, final_states, alphabet=None, first_match=False):
+    if alphabet is not None:
+        alphabet = list(alphabet)
+    key = source_key(transitions, start, final_states, alphabet, first_match)
+
+    if os.path.exists(path):
+        try:
+            return load_dfa(path, key)
+        except ValueError:
+            pass
+
+    write_dfa(path, compile_dfa(transitions, start, final_states, alphabet, first_match), key)
+    return load_dfa(path, key)
+
+"""
+Returns the content hash of a source table as 20 bytes.
+"""
+def source_key(transitions, start, final_states, alphabet=None, first_match=False):
+    key = repr((sorted(transitions.items()), start, final_states, alphabet, first_match))
+    return hashlib.sha1(key.encode('utf-8')).digest()
+
+"""
+Writes a compiled DFA to a binary file.
+
+The file is written under a temporary name and renamed, so processes that load it never see
+a partial file.
+
+Args:
+    path: File name
+    dfa: A compiled DFA from compile_dfa
+    key: Content hash of the source table from source_key
+"""
+def write_dfa(path, dfa, key):
+    states = len(dfa['states'])
+    columns = len(dfa['table'][0])
+
+    table = array('i')
+    for row in dfa['table']:
+        table.extend(row)
+    if table.itemsize != 4:
+        raise ValueError("The binary format needs 4 byte ints")
+
+    # Single characters go in the binary symbols section, other symbols like token names in meta
+    symbols = array('i')
+    named_columns = []
+    for symbol, column in sorted(dfa['columns'].items(), key=lambda item: item[1]):
+        if isinstance(symbol, bytes):
+            symbol = symbol.decode('latin-1')
+        if len(symbol) == 1:
+            symbols.extend((ord(symbol), column))
+        else:
+            named_columns.append([symbol, column])
+
+    flags = FLAG_FIRST_MATCH if dfa['first_match'] else 0
+    final = bytearray(1 if accepting else 0 for accepting in dfa['final'])
+    meta = {
+        'states': list(dfa['states']),
+        'columns': named_columns,
+        'patterns': [[[pattern.pattern, target] for pattern, target in patterns] for patterns in dfa['patterns']],
+    }
+    class_of = array('B')
+    if 'class_of' in dfa:
+        typecode = getattr(dfa['class_of'], 'typecode', None) or dfa['class_of'].format
+        class_of = array(typecode, dfa['class_of'])
+        if class_of.typecode == 'i':
+            flags |= FLAG_WIDE_CLASSES
+        meta['rest_class'] = dfa['rest_class']
+        meta['class_ranges'] = dfa['class_ranges']
+    meta = json.dumps(meta).encode('utf-8')
+
+    sections = [array_bytes(table), bytes(final), array_bytes(symbols), array_bytes(class_of), meta]
+    offsets = []
+    offset = align(HEADER.size)
+    for section in sections:
+        offsets.extend((offset, len(section)))
+        offset = align(offset + len(section))
+    header = HEADER.pack(MAGIC, VERSION, BYTE_ORDERS[sys.byteorder], flags, states, columns,
+        dfa['start'], key, *offsets)
+
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as output:
+        output.write(header)
+        for section, offset in zip(sections, offsets[::2]):
+            output.write(b'\0' * (offset - output.tell()))
+            output.write(section)
+    os.rename(temporary, path)
+
+"""
+Returns the machine bytes of an array.
+"""
+def array_bytes(values):
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+"""
+Returns offset rounded up to a multiple of 8.
+"""
+def align(offset):
+    return (offset + 7) // 8 * 8
+
+"""
+Loads a compiled DFA from a binary file written by write_dfa.
+
+Args:
+    path: File name
+    key: Optional content hash from source_key. If given and the file was written for a
+        different source table a ValueError is raised.
+
+Returns:
+    A compiled DFA dict like compile_dfa with one more key, mmap, that holds the mapping
+"""
+def load_dfa(path, key=None):
+    with open(path, 'rb') as source:
+        data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(data) < HEADER.size:
+        raise ValueError("%s is not a compiled DFA file" % path)
+    (magic, version, byte_order, flags, states, columns, start, file_key, table_offset, table_size,
+        final_offset, final_size, symbols_offset, symbols_size, class_offset, class_size,
+        meta_offset, meta_size) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("%s is not a compiled DFA file" % path)
+    if byte_order != BYTE_ORDERS[sys.byteorder]:
+        raise ValueError("%s was written on a machine with a different byte order" % path)
+    if key is not None and file_key != key:
+        raise ValueError("%s is stale, it was written for a different table" % path)
+
+    flat = mapped_array(data, 'i', table_offset, table_size)
+    table = [flat[state * columns:(state + 1) * columns] for state in range(states)]
+
+    final = tuple(bool(accepting) for accepting in bytearray(data[final_offset:final_offset + final_size]))
+    symbols = array('i', data[symbols_offset:symbols_offset + symbols_size])
+    meta = json.loads(data[meta_offset:meta_offset + meta_size].decode('utf-8'))
+    names = tuple(meta['states'])
+
+    column_map = dict(zip([symbol_char(code) for code in symbols[0::2]], symbols[1::2]))
+    column_map.update((native_symbol(symbol), column) for symbol, column in meta['columns'])
+
+    dfa = {
+        'states': names,
+        'index': dict((state, i) for i, state in enumerate(names)),
+        'start': start,
+        'final': final,
+        'columns': column_map,
+        'table': table,
+        'patterns': [tuple((re.compile(pattern), target) for pattern, target in patterns) for patterns in meta['patterns']],
+        'first_match': bool(flags & FLAG_FIRST_MATCH),
+        'mmap': data,
+    }
+    if 'class_ranges' in meta:
+        dfa['class_of'] = mapped_array(data, 'i' if flags & FLAG_WIDE_CLASSES else 'B', class_offset, class_size)
+        dfa['rest_class'] = meta['rest_class']
+        dfa['class_ranges'] = [[tuple(interval) for interval in intervals] for intervals in meta['class_ranges']]
+    return dfa
+
+"""
+Returns a section of a mapped file as a flat sequence of numbers of an array typecode. This
+is a memoryview of the mapped pages, or an array copy on Python 2.
+"""
+def mapped_array(data, typecode, offset, size):
+    if hasattr(memoryview, 'cast'):
+        return memoryview(data)[offset:offset + size].cast(typecode)
+    return array(typecode, data[offset:offset + size])
+
+"""
+Returns the symbol for a code point with the same type as the keys of compile_dfa, which are
+str for the first 256 characters on Python 2 as well.
+"""
+def symbol_char(code):
+    if code < 256:
+        return chr(code)
+    return unichr(code)
+
+"""
+Returns a symbol from meta as str where it is plain ASCII, so token names have the type of the
+transitions on Python 2.
+"""
+def native_symbol(symbol):
+    try:
+        return str(symbol)
+    except UnicodeEncodeError:
+        return symbol
@@ -0,0 +1,203 @@
+from array import array
+
+from fsm_classes import class_lookup, compile_classes
+from fsm_lexer import tokenize_ignore
+from fsm_parser import cached_parser, fsm_parser_compiled
+
+"""
+Lexing and parsing of raw bytes without decoding them.
+
+Tables are compiled with fsm_classes.compile_classes and every byte value gets the class of
+the character with the same code, so bytes are matched as Latin-1 characters. For UTF-8 text
+the results are the same as for the decoded text as long as the table treats non-ASCII
+characters alike and only loops on them, like the NOT_TOKEN state of pa1.
+
+Input can be bytes, bytearray, memoryview or mmap. It is read through a memoryview, so
+nothing is copied while lexing and tokens are offsets into the input. Python 2 has no
+memoryview.cast and cannot view an mmap, so there the input is copied into a bytearray once.
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    first_match: See fsm_compiler.compile_dfa. The default matches fsm. Use
+        compile_byte_lexer for lexer tables.
+
+Returns:
+    A DFA dict from compile_classes with one more key, byte_classes, a list with the class
+    of each byte value
+
+Example Usage:
+    dfa = compile_byte_lexer(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+    with open('meetings.log', 'rb') as log:
+        data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+    spans = lex_bytes(data, dfa, pa1.tokenize_events)
+    stmts = parse_bytes(spans, pa1.parser)
+"""
+def compile_bytes(transitions, start, final_states, first_match=False):
+    dfa = compile_classes(transitions, start, final_states, first_match)
+    dfa['byte_classes'] = [class_lookup(dfa, code) for code in range(256)]
+    return dfa
+
+"""
+Same as compile_bytes for lexer tables, where the first matching pattern wins like in
+fsm_lexer. The result is the DFA that lex_bytes needs.
+"""
+def compile_byte_lexer(transitions, start, final_states):
+    return compile_bytes(transitions, start, final_states, first_match=True)
+
+"""
+Returns a memoryview of the input and an iterable of its byte values as ints.
+"""
+def byte_view(data):
+    try:
+        view = memoryview(data)
+    except TypeError:
+        values = bytearray(data[:])
+        return memoryview(values), values
+    if not hasattr(view, 'cast'):
+        return view, bytearray(view.tobytes())
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view, view
+
+"""
+Same as fsm_compiler.fsm_compiled for bytes input.
+
+Args:
+    data: bytes, bytearray, memoryview or mmap
+    dfa: A DFA from compile_bytes
+
+Returns:
+    True if the bytes are valid for the DFA
+"""
+def fsm_bytes(data, dfa):
+    table = dfa['table']
+    byte_classes = dfa['byte_classes']
+    state = dfa['start']
+
+    for byte in byte_view(data)[1]:
+        state = table[state][byte_classes[byte]]
+        if state < 0:
+            return False
+
+    return dfa['final'][state]
+
+"""
+Same as fsm_lexer.lex_spans for bytes input.
+
+Tokens whose tokenize event is tokenize_ignore are dropped. span_value returns a memoryview
+slice of the input. Use byte_tokens instead of fsm_lexer.span_tokens to get the tokens, since
+tokenize events are written for text values.
+
+Args:
+    data: bytes, bytearray, memoryview or mmap
+    dfa: A lexer DFA from compile_byte_lexer. A ValueError is raised for last match DFAs.
+    tokenize_events: A dict of functions for specialized handling of a token
+
+Returns:
+    A spans dict like lex_spans, where string is a memoryview of the input
+"""
+def lex_bytes(data, dfa, tokenize_events):
+    if not dfa['first_match']:
+        raise ValueError("lex_bytes needs a first match DFA, see compile_byte_lexer")
+    view, values = byte_view(data)
+    spans = {
+        'string': view,
+        'kinds': [],
+        'kind_ids': {},
+        'kind': array('i'),
+        'start': array('i'),
+        'end': array('i'),
+        'tokenize_events': tokenize_events,
+    }
+    table = dfa['table']
+    byte_classes = dfa['byte_classes']
+    start_state = dfa['start']
+    final = dfa['final']
+    names = dfa['states']
+    kind_ids = spans['kind_ids']
+    ignored = set(name for name, event in tokenize_events.items() if event is tokenize_ignore)
+
+    # The name of the token that ends in each state, None if it is ignored
+    state_kinds = []
+    for state, name in enumerate(names):
+        name = name if final[state] else "ERROR"
+        if name in ignored:
+            state_kinds.append(None)
+        else:
+            if name not in kind_ids:
+                kind_ids[name] = len(spans['kinds'])
+                spans['kinds'].append(name)
+            state_kinds.append(kind_ids[name])
+
+    state = start_state
+    token_start = 0
+    index = 0
+    for byte in values:
+        next_state = table[state][byte_classes[byte]]
+        if next_state < 0:
+            if state == start_state:
+                raise ValueError("No transition from start state %s for %r" % (names[start_state],
+                    view[index:index + 1].tobytes()))
+            if state_kinds[state] is not None:
+                spans['kind'].append(state_kinds[state])
+                spans['start'].append(token_start)
+                spans['end'].append(index)
+            token_start = index
+            next_state = table[start_state][byte_classes[byte]]
+            if next_state < 0:
+                raise ValueError("No transition from start state %s for %r" % (names[start_state],
+                    view[index:index + 1].tobytes()))
+        state = next_state
+        index += 1
+
+    if state_kinds[state] is not None:
+        spans['kind'].append(state_kinds[state])
+        spans['start'].append(token_start)
+        spans['end'].append(index)
+    return spans
+
+"""
+Yields the (name, value) tokens of a spans dict from lex_bytes with the tokenize events
+applied, like fsm_lexer.span_tokens does for lex_spans. Values are bytes.
+
+Tokenize events are written for text, so they are called with the value decoded as Latin-1,
+the same way lex_bytes reads it, and the value they return is encoded back. Events that only
+add or remove ASCII, like the ones of pa1, give the UTF-8 encoding of what they give on the
+decoded text.
+"""
+def byte_tokens(spans):
+    view = spans['string']
+    kinds = spans['kinds']
+    tokenize_events = spans['tokenize_events']
+    for kind, start, end in zip(spans['kind'], spans['start'], spans['end']):
+        token = (kinds[kind], view[start:end].tobytes())
+        if token[0] in tokenize_events:
+            token = tokenize_events[token[0]]((token[0], token[1].decode('latin-1')))
+            if token:
+                yield (token[0], token[1].encode('latin-1'))
+        else:
+            yield token
+
+"""
+Parses the spans from lex_bytes with fsm_parser.
+
+The tokens are the ones from byte_tokens, so for UTF-8 input the statements are the UTF-8
+encoding of the ones parse gives on the decoded text.
+
+Args:
+    spans: A spans dict from lex_bytes
+    parser: A tuple of (start state, transitions, final states) for fsm_parser
+
+Returns:
+    A tuple of bytes, one per statement
+
+Example Usage:
+    stmts = parse_bytes(lex_bytes(data, dfa, pa1.tokenize_events), pa1.parser)
+    times = tuple(stmt.decode('utf-8') for stmt in stmts)
+"""
+def parse_bytes(spans, parser):
+    parser_state, parser_transitions, parser_final_states = parser
+    compiled = cached_parser(parser_transitions, parser_state, parser_final_states)
+    return tuple(fsm_parser_compiled(byte_tokens(spans), compiled, True, b''))
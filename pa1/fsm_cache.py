@@ -0,0 +1,142 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+from fsm_pipeline import lex_parse
+
+"""
+Content addressed cache of lex and parse results for documents that repeat exactly.
+
+The key is a hash of the text plus the identity of the lexer and parser tables, so the
+text itself is not kept. Entries are evicted least recently used first once there are more
+than max_entries of them or their estimated size passes max_bytes.
+
+The cache is safe to share between threads. Lookups and updates hold a lock, but the text is
+hashed and a missing result is computed without it, so threads only wait on each other for
+the dict operations. Two threads that miss on the same text at the same time both compute it.
+
+Args:
+    max_entries: Largest number of results to keep
+    max_bytes: Largest estimated size of the kept results in bytes
+
+Returns:
+    A cache dict with the following keys:
+        entries: OrderedDict of key to (result, size), least recently used first
+        tables: Dict of table identity to a list of [lexer, parser, number of entries]. This
+            keeps the tables alive while they have entries, so their ids stay unique.
+        bytes: Estimated size of the kept results
+        hits, misses, evictions: Counters
+        max_entries, max_bytes: The arguments
+        lock: The lock
+
+Example Usage:
+    cache = new_cache(max_entries=10000)
+    times = cached_lex_parse(message, pa1.lexer, pa1.parser, cache)
+    print(cache_info(cache))
+"""
+def new_cache(max_entries=1024, max_bytes=64 * 1024 * 1024):
+    return {
+        'entries': OrderedDict(),
+        'tables': {},
+        'bytes': 0,
+        'hits': 0,
+        'misses': 0,
+        'evictions': 0,
+        'max_entries': max_entries,
+        'max_bytes': max_bytes,
+        'lock': threading.Lock(),
+    }
+
+"""
+Same as fsm_pipeline.lex_parse for a string, with results kept in a cache.
+
+Args:
+    string: The text
+    lexer: A tuple of (start state, transitions, final states, tokenize events) for fsm_lexer
+    parser: A tuple of (start state, transitions, final states) for fsm_parser
+    cache: A cache dict from new_cache
+
+Returns:
+    A tuple of statements, the same as lex_parse
+"""
+def cached_lex_parse(string, lexer, parser, cache):
+    tables = tuple(id(part) for part in tuple(lexer) + tuple(parser))
+    key = (tables, text_digest(string))
+
+    lock = cache['lock']
+    with lock:
+        entry = cache['entries'].get(key)
+        if entry is not None:
+            cache['hits'] += 1
+            # Python 2 has no move_to_end
+            del cache['entries'][key]
+            cache['entries'][key] = entry
+            return entry[0]
+        cache['misses'] += 1
+
+    result = lex_parse(string, lexer, parser)
+    size = result_size(result)
+
+    with lock:
+        if size > cache['max_bytes']:
+            return result
+        if key in cache['entries']:
+            cache['bytes'] -= cache['entries'].pop(key)[1]
+        else:
+            cache['tables'].setdefault(tables, [lexer, parser, 0])[2] += 1
+        cache['entries'][key] = (result, size)
+        cache['bytes'] += size
+        entries = cache['entries']
+        while len(entries) > cache['max_entries'] or cache['bytes'] > cache['max_bytes']:
+            evicted, (evicted_result, evicted_size) = entries.popitem(last=False)
+            cache['bytes'] -= evicted_size
+            cache['evictions'] += 1
+            table = cache['tables'][evicted[0]]
+            table[2] -= 1
+            if not table[2]:
+                del cache['tables'][evicted[0]]
+    return result
+
+"""
+Returns a 16 byte digest of a text. Uses BLAKE2 where hashlib has it and SHA-1 otherwise.
+
+Lone surrogates are encoded as they are, since lex and parse accept them.
+"""
+def text_digest(string):
+    if not isinstance(string, bytes):
+        string = string.encode('utf-8', 'surrogatepass')
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(string, digest_size=16).digest()
+    return hashlib.sha1(string).digest()[:16]
+
+"""
+Returns the estimated size in bytes of a tuple of statements.
+"""
+def result_size(result):
+    return sys.getsizeof(result) + sum(sys.getsizeof(stmt) for stmt in result)
+
+"""
+Returns the counters and sizes of a cache as a dict.
+"""
+def cache_info(cache):
+    with cache['lock']:
+        return {
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'evictions': cache['evictions'],
+            'entries': len(cache['entries']),
+            'tables': len(cache['tables']),
+            'bytes': cache['bytes'],
+            'max_entries': cache['max_entries'],
+            'max_bytes': cache['max_bytes'],
+        }
+
+"""
+Removes every entry of a cache. The counters are kept.
+"""
+def clear_cache(cache):
+    with cache['lock']:
+        cache['entries'].clear()
+        cache['tables'].clear()
+        cache['bytes'] = 0
@@ -0,0 +1,99 @@
+import sys
+from array import array
+
+from fsm_compiler import compile_dfa
+from fsm_reorder import pattern_symbols
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+"""
+Compiles a table over characters into a DFA whose columns are character classes.
+
+compile_dfa gives every symbol of the alphabet its own column, but most characters behave
+the same in every state. In pa1 the digits 6 to 9 always do, and so do most letters. Here the
+code points are split at every edge of the character sets of the patterns, see
+fsm_reorder.pattern_symbols, and ranges whose columns are equal in every state are merged
+into one class.
+
+Input is mapped to classes through one lookup array indexed by code point, so any character,
+including ones outside the first 256, costs one array and one table lookup. Code points at or
+above the end of the array are all in one class, rest_class.
+
+The result works with fsm_compiled and next_state like a DFA from compile_dfa. columns maps
+the first 256 characters to their class, so engines that read columns directly stay correct
+and fall back to the patterns for other characters.
+
+A ValueError is raised if a pattern cannot be split into character sets exactly, for
+example one with anchors or inline flags like (?i:a).
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    first_match: See compile_dfa
+
+Returns:
+    A dict with the same keys as compile_dfa plus:
+        class_of: array of the class of each code point below len(class_of)
+        rest_class: The class of the code points from len(class_of) on
+        class_ranges: List of the (low, high) code point ranges of each class
+
+Example Usage:
+    dfa = compile_classes(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+    fsm_compiled(u'caf\u00e9 at 5pm', dfa)
+"""
+def compile_classes(transitions, start, final_states, first_match=False):
+    edges = set([0])
+    for state, state_transitions in transitions.items():
+        for state_transition in state_transitions:
+            intervals = pattern_symbols(state_transition[0], None)
+            if intervals is None:
+                raise ValueError("Pattern %r of state %s cannot be split into character classes" %
+                    (state_transition[0], state))
+            for low, high in intervals:
+                edges.add(low)
+                edges.add(high + 1)
+    edges = sorted(edge for edge in edges if edge <= sys.maxunicode)
+
+    # One column per range between two edges, named after its first character
+    dfa = compile_dfa(transitions, start, final_states, [unichr(edge) for edge in edges], first_match)
+    classes = {}
+    range_classes = []
+    for column in range(len(edges)):
+        key = tuple(row[column] for row in dfa['table'])
+        if key not in classes:
+            classes[key] = len(classes)
+        range_classes.append(classes[key])
+
+    table = []
+    for row in dfa['table']:
+        class_row = array('i', [-1] * len(classes))
+        for column, class_id in enumerate(range_classes):
+            class_row[class_id] = row[column]
+        table.append(class_row)
+
+    class_of = array('B' if len(classes) <= 256 else 'i')
+    class_ranges = [[] for class_id in classes]
+    for i, edge in enumerate(edges):
+        end = edges[i + 1] if i + 1 < len(edges) else sys.maxunicode + 1
+        class_ranges[range_classes[i]].append((edge, end - 1))
+        if i + 1 < len(edges):
+            class_of.extend([range_classes[i]] * (end - edge))
+
+    dfa['table'] = table
+    dfa['class_of'] = class_of
+    dfa['rest_class'] = range_classes[-1]
+    dfa['class_ranges'] = class_ranges
+    dfa['columns'] = dict((chr(code), class_lookup(dfa, code)) for code in range(256))
+    return dfa
+
+"""
+Returns the class of a code point in a DFA from compile_classes.
+"""
+def class_lookup(dfa, code):
+    if code < len(dfa['class_of']):
+        return dfa['class_of'][code]
+    return dfa['rest_class']
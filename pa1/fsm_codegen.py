@@ -0,0 +1,280 @@
+import hashlib
+import os
+import tempfile
+
+from fsm_compiler import compile_dfa
+
+"""
+Code generation backend that turns a transition table into a specialized Python function.
+
+The table is compiled with compile_dfa and written out as Python source with integer states,
+one branch per state, and frozenset membership checks for each group of characters that go
+to the same state. States that loop back to themselves get a tight inner loop. Characters
+outside the compiled alphabet fall back to the precompiled patterns, so the results are
+always the same as the interpreters.
+
+Three kinds of functions can be generated:
+
+    fsm: fsm(string) returns the same as fsm.fsm(string, start, transitions, final_states)
+    lex: lex(string, tokenize_events) returns the same as fsm_lexer.lex
+    parse: parse(tokens) returns the same as fsm_parser.parse
+
+The generated source is self contained. If cache_dir is given the source is written there,
+named after a hash of the kind, the table and GENERATOR_VERSION, and later calls load it
+instead of generating it. The file is written under a temporary name and renamed into place,
+so processes that share cache_dir never load a half written module.
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    kind: One of 'fsm', 'lex' or 'parse'
+    cache_dir: Optional directory to cache the generated source in
+
+Returns:
+    The generated function
+
+Example Usage:
+    lex_pa1 = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex')
+    tokens = lex_pa1(string, pa1.tokenize_events)
+"""
+def codegen(transitions, start, final_states, kind='fsm', cache_dir=None):
+    filename, source = codegen_source(transitions, start, final_states, kind, cache_dir)
+    return load_source(filename, source, kind)
+
+"""
+Returns the file name and source that codegen loads, generating the source and writing it
+to cache_dir if it is not cached yet. See codegen.
+
+Returns:
+    A tuple of (file name, source)
+"""
+def codegen_source(transitions, start, final_states, kind='fsm', cache_dir=None):
+    if not cache_dir:
+        return '<codegen %s>' % kind, generate_source(transitions, start, final_states, kind)
+
+    filename = os.path.join(cache_dir, 'fsm_%s_%s.py' % (kind, table_hash(transitions, start, final_states, kind)))
+    if os.path.exists(filename):
+        with open(filename) as cached:
+            return filename, cached.read()
+
+    source = generate_source(transitions, start, final_states, kind)
+    write_source(filename, source)
+    return filename, source
+
+"""
+Executes source from codegen_source and returns the generated function of the given kind.
+"""
+def load_source(filename, source, kind):
+    namespace = {}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace[kind]
+
+"""
+Version of the generated code. Change it whenever generate_source changes, so sources cached
+by an older version are not loaded.
+"""
+GENERATOR_VERSION = 2
+
+"""
+Writes generated source to a temporary file next to filename and renames it into place.
+"""
+def write_source(filename, source):
+    handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(handle, 'w') as cached:
+            cached.write(source)
+        os.rename(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+"""
+Returns a hex digest that changes whenever the table, the kind of function or the generator
+version changes.
+"""
+def table_hash(transitions, start, final_states, kind):
+    key = repr((GENERATOR_VERSION, kind, sorted(transitions.items()), start, final_states))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+"""
+Generates the Python source for a function of the given kind. See codegen.
+"""
+def generate_source(transitions, start, final_states, kind):
+    if kind == 'fsm':
+        dfa = compile_dfa(transitions, start, final_states, first_match=False)
+    elif kind == 'lex':
+        dfa = compile_dfa(transitions, start, final_states, first_match=True)
+    elif kind == 'parse':
+        dfa = compile_dfa(transitions, start, final_states, alphabet=(), first_match=True)
+    else:
+        raise ValueError("Unknown kind %r" % kind)
+
+    lines = [
+        '# Generated by fsm_codegen. Do not edit.',
+        'import re',
+        '',
+        'STATES = %r' % (dfa['states'],),
+        'FINAL = %r' % (dfa['final'],),
+        'NAMES = %r' % (tuple(state if final else 'ERROR' for state, final in zip(dfa['states'], dfa['final'])),),
+        'PATTERNS = %r' % (tuple(tuple(state_transition[0] for state_transition in transitions.get(state, ()))
+            for state in dfa['states']),),
+        'TARGETS = %r' % (tuple(tuple(target for pattern, target in patterns) for patterns in dfa['patterns']),),
+        'PATTERNS = [tuple(zip([re.compile(pattern) for pattern in patterns], targets)) for patterns, targets in zip(PATTERNS, TARGETS)]',
+        '',
+        'def fallback(state, symbol):',
+        '    next_state = -1',
+        '    for pattern, target in PATTERNS[state]:',
+        '        if pattern.match(symbol):',
+        '            next_state = target',
+    ]
+    if dfa['first_match']:
+        lines.append('            break')
+    lines.append('    return next_state')
+    lines.append('')
+
+    if kind == 'parse':
+        lines.extend(parse_source(dfa))
+    else:
+        lines.extend(char_source(dfa, kind))
+
+    return '\n'.join(lines) + '\n'
+
+"""
+Generates the constants and function for the fsm and lex kinds.
+"""
+def char_source(dfa, kind):
+    symbols = sorted(dfa['columns'], key=dfa['columns'].get)
+    lines = ['ALPHABET = frozenset(%r)' % ''.join(symbols)]
+    body = []
+
+    for state, row in enumerate(dfa['table']):
+        targets = {}
+        for column, target in enumerate(row):
+            if target >= 0:
+                targets.setdefault(target, []).append(symbols[column])
+
+        body.append('        %sif state == %d:' % ('' if state == 0 else 'el', state))
+
+        if state in targets:
+            name = 'SELF_%d' % state
+            lines.append('%s = frozenset(%r)' % (name, ''.join(targets.pop(state))))
+            body.extend([
+                '            if c in %s:' % name,
+                '                i += 1',
+                '                while i < n and string[i] in %s:' % name,
+                '                    i += 1',
+                '                continue',
+            ])
+
+        branch = 'if'
+        for target in sorted(targets, key=lambda target: dfa['columns'][targets[target][0]]):
+            name = 'SET_%d_%d' % (state, target)
+            lines.append('%s = frozenset(%r)' % (name, ''.join(targets[target])))
+            body.extend([
+                '            %s c in %s:' % (branch, name),
+                '                state = %d' % target,
+            ])
+            branch = 'elif'
+
+        if kind == 'fsm':
+            dead = ['return False']
+        elif state == dfa['start']:
+            dead = ['raise ValueError("No transition from start state %%s for %%r" %% (STATES[%d], c))' % state]
+        else:
+            dead = [
+                'append((NAMES[%d], string[token_start:i]))' % state,
+                'token_start = i',
+                'state = %d' % dfa['start'],
+                'continue',
+            ]
+
+        body.append('            %s c in ALPHABET:' % branch)
+        body.extend('                ' + line for line in dead)
+        body.extend([
+            '            else:',
+            '                next_state = fallback(%d, c)' % state,
+            '                if next_state < 0:',
+        ])
+        body.extend('                    ' + line for line in dead)
+        body.append('                state = next_state')
+
+    if kind == 'fsm':
+        lines.extend([
+            '',
+            'def fsm(string):',
+            '    n = len(string)',
+            '    i = 0',
+            '    state = %d' % dfa['start'],
+            '    while i < n:',
+            '        c = string[i]',
+        ])
+        lines.extend(body)
+        lines.extend([
+            '        i += 1',
+            '    return FINAL[state]',
+        ])
+    else:
+        lines.extend([
+            '',
+            'from fsm_lexer import tokenize',
+            '',
+            'def lex(string, tokenize_events):',
+            '    tokens = []',
+            '    append = tokens.append',
+            '    n = len(string)',
+            '    i = 0',
+            '    token_start = 0',
+            '    state = %d' % dfa['start'],
+            '    while i < n:',
+            '        c = string[i]',
+        ])
+        lines.extend(body)
+        lines.extend([
+            '        i += 1',
+            '    append((NAMES[state], string[token_start:]))',
+            '    return tokenize(tokens, tokenize_events)',
+        ])
+
+    return lines
+
+"""
+Generates the function for the parse kind.
+
+Token names are not known ahead of time, so each state keeps a dict of token name to next
+state that is filled in by the patterns the first time a name is seen.
+"""
+def parse_source(dfa):
+    start = dfa['start']
+    return [
+        'ROWS = [{} for state in STATES]',
+        '',
+        'def parse(tokens):',
+        '    stmts = []',
+        '    current = []',
+        '    accepted = None',
+        '    state = %d' % start,
+        '    for token in tokens:',
+        '        while True:',
+        '            if FINAL[state]:',
+        "                accepted = ''.join(current)",
+        '            next_state = ROWS[state].get(token[0])',
+        '            if next_state is None:',
+        '                next_state = ROWS[state][token[0]] = fallback(state, token[0])',
+        '            if next_state >= 0:',
+        '                current.append(token[1])',
+        '                state = next_state',
+        '                break',
+        '            elif state == %d and not current:' % start,
+        '                raise ValueError("No transition from start state %%s for %%r" %% (STATES[%d], token[0]))' % start,
+        '            if accepted:',
+        '                stmts.append(accepted)',
+        '            accepted = None',
+        '            current = []',
+        '            state = %d' % start,
+        '    if FINAL[state]:',
+        "        accepted = ''.join(current)",
+        '    if accepted:',
+        '        stmts.append(accepted)',
+        '    return tuple(stmts)',
+    ]
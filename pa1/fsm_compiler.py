@@ -0,0 +1,171 @@
+import re
+from array import array
+
+"""
+Compiles the dict-of-tuples transition tables used by fsm, fsm_lexer and fsm_parser
+into a dense table indexed by integer states.
+
+Each regex pattern is expanded over the alphabet once at compile time, so running the
+compiled DFA costs one table lookup per character instead of a re.match per pattern.
+
+Symbols that are not part of the alphabet fall back to matching the precompiled
+patterns of the current state.
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    alphabet: Iterable of symbols to expand the patterns over. Defaults to the first 256 characters.
+    first_match: If True the first matching pattern wins like in fsm_lexer and fsm_parser.
+        Otherwise the last matching pattern wins like in fsm.
+
+Returns:
+    A dict with the following keys:
+        states: Tuple of state names. The position of a name is its integer state.
+        index: Dict of state name to integer state
+        start: Integer start state
+        final: Tuple of booleans. True if the integer state is accepting.
+        columns: Dict of symbol to column in the table
+        table: List of array('i') rows, one per state. -1 is the implicit error state.
+        patterns: List of ((compiled pattern, integer state), ...) per state for fallback matching
+        first_match: The first_match argument
+
+Example Usage:
+
+    dfa = compile_dfa(transitions, 'A', ('C'))
+    fsm_compiled('00111', dfa)
+"""
+def compile_dfa(transitions, start, final_states, alphabet=None, first_match=False):
+    if alphabet is None:
+        alphabet = [chr(code) for code in range(256)]
+
+    states = [start]
+    for state in sorted(transitions):
+        if state != start:
+            states.append(state)
+    for state in list(states):
+        for state_transition in transitions.get(state, ()):
+            if state_transition[1] not in states:
+                states.append(state_transition[1])
+
+    index = dict((state, i) for i, state in enumerate(states))
+
+    columns = {}
+    for symbol in alphabet:
+        if symbol not in columns:
+            columns[symbol] = len(columns)
+    symbols = sorted(columns, key=columns.get)
+
+    table = []
+    patterns = []
+    for state in states:
+        state_patterns = tuple(
+            (re.compile(state_transition[0]), index[state_transition[1]])
+            for state_transition in transitions.get(state, ()))
+        row = array('i', [-1] * len(symbols))
+        for column, symbol in enumerate(symbols):
+            row[column] = match_patterns(state_patterns, symbol, first_match)
+        table.append(row)
+        patterns.append(state_patterns)
+
+    return {
+        'states': tuple(states),
+        'index': index,
+        'start': index[start],
+        'final': tuple(state in final_states for state in states),
+        'columns': columns,
+        'table': table,
+        'patterns': patterns,
+        'first_match': first_match,
+    }
+
+"""
+Finds the next integer state for a symbol by matching precompiled patterns.
+
+Args:
+    state_patterns: Tuple of (compiled pattern, integer state) pairs
+    symbol: The symbol to match
+    first_match: If True stop at the first matching pattern
+
+Returns:
+    The integer state or -1 if no pattern matched.
+"""
+def match_patterns(state_patterns, symbol, first_match):
+    next_state = -1
+    for pattern, target in state_patterns:
+        if pattern.match(symbol):
+            next_state = target
+            if first_match:
+                break
+    return next_state
+
+"""
+Returns the next integer state for a symbol using the table of a compiled DFA.
+
+Symbols outside the alphabet fall back to the precompiled patterns. DFAs from
+fsm_classes.compile_classes look characters up in their class array instead.
+"""
+def next_state(dfa, state, symbol):
+    column = dfa['columns'].get(symbol)
+    if column is None and 'class_of' in dfa:
+        code = ord(symbol)
+        class_of = dfa['class_of']
+        column = class_of[code] if code < len(class_of) else dfa['rest_class']
+    if column is None:
+        return match_patterns(dfa['patterns'][state], symbol, dfa['first_match'])
+    return dfa['table'][state][column]
+
+"""
+Finite state machine that runs a DFA compiled with compile_dfa.
+
+Gives the same results as fsm, but only does one table lookup per character.
+
+Args:
+    string: A string to check as valid for a given DFA
+    dfa: A compiled DFA from compile_dfa or fsm_classes.compile_classes
+
+Returns:
+    True if the string is a valid for the given DFA.
+    False if the string is invalid.
+"""
+def fsm_compiled(string, dfa):
+    if 'class_of' in dfa:
+        return fsm_compiled_classes(string, dfa)
+
+    table = dfa['table']
+    columns = dfa['columns']
+    state = dfa['start']
+
+    for char in string:
+        column = columns.get(char)
+        if column is None:
+            state = match_patterns(dfa['patterns'][state], char, dfa['first_match'])
+        else:
+            state = table[state][column]
+        if state < 0:
+            return False
+
+    return dfa['final'][state]
+
+"""
+Version of fsm_compiled for DFAs from fsm_classes.compile_classes. The first 256 characters
+are found in columns and the others in the class array.
+"""
+def fsm_compiled_classes(string, dfa):
+    table = dfa['table']
+    columns = dfa['columns']
+    class_of = dfa['class_of']
+    size = len(class_of)
+    rest_class = dfa['rest_class']
+    state = dfa['start']
+
+    for char in string:
+        column = columns.get(char)
+        if column is None:
+            code = ord(char)
+            column = class_of[code] if code < size else rest_class
+        state = table[state][column]
+        if state < 0:
+            return False
+
+    return dfa['final'][state]
@@ -0,0 +1,161 @@
+import argparse
+import fnmatch
+import io
+import json
+import multiprocessing
+import os
+
+from fsm_codegen import codegen_source, load_source
+import pa1
+
+"""
+Runs the pa1 time extraction over many files with a pool of worker processes.
+
+The lexer and parser source is generated with fsm_codegen once, in this process, before the
+workers start, or loaded from cache_dir. Each worker only executes that source when it starts
+and reuses the functions for every file. Files are sent to the workers in batches of chunk_size paths
+so the cost of passing work between processes is paid once per batch instead of once per
+file.
+
+Results are dicts with the path and either the extracted times or the error for files that
+could not be read or lexed. They are yielded in the order of paths, or as soon as each batch
+is done if ordered is False.
+
+Args:
+    paths: Iterable of file names
+    processes: Number of worker processes. Defaults to the number of CPUs. With 1 the files
+        are processed in this process.
+    chunk_size: Number of files per batch
+    ordered: If False results are yielded as batches complete
+    encoding: Encoding of the files
+    cache_dir: Optional directory for fsm_codegen to cache the generated source in
+
+Yields:
+    Dicts like {'path': path, 'times': [...]} or {'path': path, 'error': message}
+
+Example Usage:
+    results = extract_corpus(find_files('messages'), processes=8)
+    write_jsonl(results, 'times.jsonl')
+"""
+def extract_corpus(paths, processes=None, chunk_size=64, ordered=True, encoding='utf-8', cache_dir=None):
+    sources = {
+        'lex': codegen_source(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex', cache_dir),
+        'parse': codegen_source(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F, 'parse', cache_dir),
+    }
+    if processes == 1:
+        init_worker(encoding, sources)
+        for path in paths:
+            yield extract_file(path)
+        return
+
+    pool = multiprocessing.Pool(processes, init_worker, (encoding, sources))
+    try:
+        batches = iter_batches(paths, chunk_size)
+        if ordered:
+            results = pool.imap(extract_batch, batches)
+        else:
+            results = pool.imap_unordered(extract_batch, batches)
+        for batch in results:
+            for result in batch:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+"""
+Per process state of a worker, set up by init_worker.
+"""
+worker = {}
+
+"""
+Loads the pa1 lexer and parser functions for this process from a dict of kind to the
+(file name, source) from fsm_codegen.codegen_source.
+"""
+def init_worker(encoding, sources):
+    worker['encoding'] = encoding
+    for kind, (filename, source) in sources.items():
+        worker[kind] = load_source(filename, source, kind)
+
+"""
+Extracts the times of every file in a batch.
+"""
+def extract_batch(paths):
+    return [extract_file(path) for path in paths]
+
+"""
+Extracts the times of one file with the functions from init_worker.
+"""
+def extract_file(path):
+    try:
+        with io.open(path, encoding=worker['encoding']) as source:
+            string = source.read()
+        tokens = worker['lex'](string, pa1.tokenize_events)
+        return {'path': path, 'times': list(worker['parse'](tokens))}
+    except (IOError, OSError, UnicodeDecodeError, ValueError) as error:
+        return {'path': path, 'error': str(error)}
+
+"""
+Splits an iterable of paths into lists of at most chunk_size paths.
+"""
+def iter_batches(paths, chunk_size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+"""
+Returns the sorted paths of all files under a directory whose names match a glob pattern.
+"""
+def find_files(directory, pattern='*'):
+    paths = []
+    for root, directories, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if fnmatch.fnmatch(name, pattern))
+    return sorted(paths)
+
+"""
+Writes results as JSON lines.
+
+Lines are collected and written buffer_lines at a time into a file opened with a large
+buffer, so output does not cost a system call per result.
+
+Args:
+    results: Iterable of JSON serializable results
+    path: Output file name
+    buffer_lines: Number of lines to collect before writing
+
+Returns:
+    The number of results written
+"""
+def write_jsonl(results, path, buffer_lines=1000):
+    count = 0
+    lines = []
+    with io.open(path, 'w', encoding='utf-8', buffering=1 << 20) as output:
+        for result in results:
+            lines.append(json.dumps(result, ensure_ascii=False))
+            count += 1
+            if len(lines) == buffer_lines:
+                output.write(u'\n'.join(lines) + u'\n')
+                lines = []
+        if lines:
+            output.write(u'\n'.join(lines) + u'\n')
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extracts pa1 times from a directory of files.')
+    parser.add_argument('directory', help='Directory to search for files')
+    parser.add_argument('output', help='JSON lines output file')
+    parser.add_argument('--pattern', default='*', help='Glob pattern for file names')
+    parser.add_argument('--processes', type=int, help='Number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=64, help='Number of files per batch')
+    parser.add_argument('--unordered', action='store_true', help='Write results as they complete')
+    parser.add_argument('--cache-dir', help='Directory to cache generated code in')
+    args = parser.parse_args()
+
+    results = extract_corpus(find_files(args.directory, args.pattern), args.processes, args.chunk_size,
+        not args.unordered, cache_dir=args.cache_dir)
+    print('%d files' % write_jsonl(results, args.output))
@@ -0,0 +1,241 @@
+from bisect import bisect_left
+from itertools import islice
+
+from fsm_lexer import fsm_lexer_chunks
+from fsm_parser import cached_parser, fsm_parser_compiled
+
+"""
+Incremental lexing and parsing of a document that is edited in place.
+
+fsm_lexer starts every token in the start state, so a token only depends on the characters
+from its start up to the character that ended it. After an edit only the tokens that end at
+or after the start of the edit are lexed again. Lexing stops as soon as a new token starts
+where an old token started, shifted by the edit, past the end of the edit. From there the
+old tokens are reused.
+
+fsm_parser does the same with statements. Every reset of the parser starts a segment of
+tokens that is parsed from the start state, and a segment only depends on its tokens and
+the token that ended it. Parsing restarts at the last segment that ended before the first
+changed token and stops when a new segment starts where an old one started.
+
+A document keeps every raw token with its start offset, the tokens after tokenize events
+and the parser segments. Edits return a new document and leave the old one as it was, so
+a failed edit, for example one that raises a ValueError in the lexer, changes nothing.
+
+The offsets after an edit are shifted with one pass over the lists, so an edit still costs
+time linear in the number of tokens, but only with a small constant. Lexing and parsing
+cost time in the size of the changed region only.
+
+Args:
+    string: The text of the document
+    lexer: A tuple of (start state, transitions, final states, tokenize events) for fsm_lexer
+    parser: A tuple of (start state, transitions, final states) for fsm_parser
+
+Returns:
+    A document dict with the following keys:
+        string: The text
+        lexer: The lexer argument
+        parser: The parser argument
+        raw: List of (name, value) tokens before tokenize events
+        starts: List of the start offsets of the raw tokens
+        firsts: List of the position in tokens of the first token after each raw token
+        tokens: List of (name, value) tokens after tokenize events, the same as lex
+        segments: List of the positions in tokens where parser segments start
+        segment_stmts: List of the statement of each segment, None for segments without one
+        stmts: List of statements, the same as parse
+        relexed: Number of raw tokens lexed for this document
+        reparsed: Number of tokens parsed for this document
+
+Example Usage:
+    document = new_document(string, pa1.lexer, pa1.parser)
+    document = edit_document(document, 10, 12, '3pm')
+    print(document['stmts'])
+"""
+def new_document(string, lexer, parser):
+    return build_document(string, lexer, parser, {
+        'raw': [],
+        'starts': [],
+        'firsts': [],
+        'tokens': [],
+        'segments': [],
+        'segment_stmts': [],
+        'stmts': [],
+    }, 0, 0, '')
+
+"""
+Replaces string[start:end] of a document with new_text.
+
+Args:
+    document: A document dict from new_document or edit_document
+    start: Start offset of the replaced text in the old string
+    end: End offset of the replaced text in the old string
+    new_text: The replacement
+
+Returns:
+    A new document dict, see new_document
+"""
+def edit_document(document, start, end, new_text):
+    string = document['string']
+    if not 0 <= start <= end <= len(string):
+        raise ValueError("Edit %d:%d is outside of a document of length %d" % (start, end, len(string)))
+    return build_document(string[:start] + new_text + string[end:], document['lexer'], document['parser'],
+        document, start, end, new_text)
+
+"""
+Lexes and parses the changed region of a document. See new_document.
+
+Args:
+    string: The new text
+    lexer: See new_document
+    parser: See new_document
+    old: The old document. Only the lists are read.
+    start: Start offset of the edit in the old string
+    end: End offset of the edit in the old string
+    new_text: The replacement
+"""
+def build_document(string, lexer, parser, old, start, end, new_text):
+    lexer_state, lexer_transitions, lexer_final_states, tokenize_events = lexer
+    old_starts = old['starts']
+    old_firsts = old['firsts']
+    old_tokens = old['tokens']
+    shift = len(new_text) - (end - start)
+    edit_end = start + len(new_text)
+
+    # The last raw token that starts before the edit is the first one that can change
+    first = max(bisect_left(old_starts, start) - 1, 0)
+    position = old_starts[first] if old_starts else 0
+    first_token = old_firsts[first] if old_firsts else 0
+
+    raw = []
+    starts = []
+    firsts = []
+    tokens = []
+    resync = len(old_starts)
+    for token in lex_from(string, position, lexer_state, lexer_transitions, lexer_final_states):
+        raw.append(token)
+        starts.append(position)
+        firsts.append(first_token + len(tokens))
+        if token[0] in tokenize_events:
+            token = tokenize_events[token[0]](token)
+        if token:
+            tokens.append(token)
+
+        position += len(raw[-1][1])
+        if position >= edit_end and position < len(string):
+            old_index = bisect_left(old_starts, position - shift)
+            if old_index < len(old_starts) and old_starts[old_index] == position - shift:
+                resync = old_index
+                break
+
+    relexed = len(raw)
+    changed_end = first_token + len(tokens)
+    if resync < len(old_starts):
+        token_shift = first_token + len(tokens) - old_firsts[resync]
+        raw = old['raw'][:first] + raw + old['raw'][resync:]
+        starts = old_starts[:first] + starts + [offset + shift for offset in old_starts[resync:]]
+        firsts = old_firsts[:first] + firsts + [index + token_shift for index in old_firsts[resync:]]
+        tokens = old_tokens[:first_token] + tokens + old_tokens[old_firsts[resync]:]
+    else:
+        token_shift = None
+        raw = old['raw'][:first] + raw
+        starts = old_starts[:first] + starts
+        firsts = old_firsts[:first] + firsts
+        tokens = old_tokens[:first_token] + tokens
+
+    document = {
+        'string': string,
+        'lexer': lexer,
+        'parser': parser,
+        'raw': raw,
+        'starts': starts,
+        'firsts': firsts,
+        'tokens': tokens,
+        'relexed': relexed,
+    }
+    patch_segments(document, old, first_token, changed_end, token_shift)
+    return document
+
+"""
+Reparses the tokens of a document from the last segment that ended before first_token.
+
+Args:
+    document: The new document with its tokens set
+    old: The old document
+    first_token: Position of the first changed token
+    changed_end: Position in the new tokens after the last changed token
+    token_shift: Change in the number of tokens, or None if the old tokens after the edit
+        are not reused
+"""
+def patch_segments(document, old, first_token, changed_end, token_shift):
+    parser_state, parser_transitions, parser_final_states = document['parser']
+    parser = cached_parser(parser_transitions, parser_state, parser_final_states)
+    tokens = document['tokens']
+    old_segments = old['segments']
+    old_segment_stmts = old['segment_stmts']
+
+    # A segment is kept if the token that ended it is before the first changed token
+    first = max(bisect_left(old_segments, first_token) - 1, 0)
+    begin = old_segments[first] if old_segments else 0
+
+    segments = []
+    segment_stmts = []
+    resync = len(old_segments)
+    parsed = parse_from(tokens, begin, parser)
+    for segment_start, stmt, reset in parsed:
+        segments.append(segment_start)
+        segment_stmts.append(stmt)
+        if token_shift is not None and reset is not None and reset >= changed_end:
+            old_index = bisect_left(old_segments, reset - token_shift)
+            if old_index < len(old_segments) and old_segments[old_index] == reset - token_shift:
+                resync = old_index
+                break
+
+    document['reparsed'] = (reset if reset is not None else len(tokens)) - begin
+    kept = old_segment_stmts[:first]
+    stmts = old['stmts'][:len(kept) - kept.count(None)]
+    stmts.extend(stmt for stmt in segment_stmts if stmt)
+    if resync < len(old_segments):
+        reused = old_segment_stmts[:resync]
+        stmts.extend(old['stmts'][len(reused) - reused.count(None):])
+        segments = old_segments[:first] + segments + [index + token_shift for index in old_segments[resync:]]
+        segment_stmts = kept + segment_stmts + old_segment_stmts[resync:]
+    else:
+        segments = old_segments[:first] + segments
+        segment_stmts = kept + segment_stmts
+
+    document['segments'] = segments
+    document['segment_stmts'] = segment_stmts
+    document['stmts'] = stmts
+
+"""
+Yields the raw tokens of string from position on, starting in the start state.
+
+The string is read in slices of chunk_size characters, so stopping early does not copy the
+rest of the string.
+"""
+def lex_from(string, position, state, transitions, final_states, chunk_size=4096):
+    meta = {
+        'tokens': [],
+        'current_token': [],
+        'accepted_token': None,
+        'start_state': state
+    }
+    chunks = (string[index:index + chunk_size] for index in range(position, len(string), chunk_size))
+    return fsm_lexer_chunks(chunks, state, transitions, final_states, meta)
+
+"""
+Parses tokens[begin:] like fsm_parser_tokens, starting in the start state.
+
+Args:
+    tokens: List of (name, value) tokens
+    begin: Position to start at
+    parser: A compiled parser from fsm_parser.compile_parser
+
+Yields:
+    (segment start, statement, reset) for every segment. The statement is None if the
+    segment has none. reset is the position where the next segment starts, or None for the
+    last segment.
+"""
+def parse_from(tokens, begin, parser):
+    for segment_start, stmt, reset in fsm_parser_compiled(islice(tokens, begin, None), parser, True, segments=True):
+        yield (begin + segment_start, stmt, None if reset is None else begin + reset)
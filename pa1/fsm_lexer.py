@@ -1,4 +1,12 @@
 import re
+import threading
+import time
+from array import array
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 """
 Very simple lexer that breaks string into named tokens using a "DFA"
@@ -12,12 +20,13 @@ the start state. Think of these as delimiters.
 Any substring that ends in a non-accepting state is in an error state and will be stored as a 
 token called "ERROR."
 
-There is no backtracking implemented.
+By default there is no backtracking. Set backtrack to True to fall back to the last accepting
+position instead, see fsm_lexer_backtrack.
 
 Uses maximal munch rule, so longest substring will be tokenized.
 
-Note: Make sure that the start state of the DFA has transitions for all letters. If not there
-will be an infinite loop.
+Note: Make sure that the start state of the DFA has transitions for all letters. If not a
+ValueError is raised.
 
 Args:
     string: String to be broken into tokens
@@ -25,6 +34,8 @@ Args:
     transitions: See example transitions structure
     final_states: Accepting states
     tokenize_events: A dict of functions for specialized handling of a token
+    backtrack: If True use fsm_lexer_backtrack instead of fsm_lexer
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in
 
 Returns:
     A tuple of tuples. Inner tuples contain two values. The name of the token and the value.
@@ -81,17 +92,247 @@ Example Usage:
     final_states = ('B', 'E')
     tokens = lex(string, start_state, dfa, final_states, tokenize_events)
 """
-def lex(string, state, transitions, final_states, tokenize_events):
+def lex(string, state, transitions, final_states, tokenize_events, backtrack=False, stats=None):
+    if stats is not None:
+        return lex_instrumented(string, state, transitions, final_states, tokenize_events, backtrack, stats['lexer'])
+
     meta = {
         'tokens': [],
         'current_token': [],
         'accepted_token': None,
         'start_state': state
     }
-    result = fsm_lexer(string, state, transitions, final_states, meta)
+    if backtrack:
+        result = fsm_lexer_backtrack(string, state, transitions, final_states, meta)
+    else:
+        result = fsm_lexer(string, state, transitions, final_states, meta)
 
     return tokenize(result['tokens'], tokenize_events)
 
+"""
+Same as lex, but counts into a stats section. See fsm_stats.
+"""
+def lex_instrumented(string, state, transitions, final_states, tokenize_events, backtrack, stats):
+    start = time.time()
+    stats['calls'] += 1
+    meta = {
+        'tokens': [],
+        'current_token': [],
+        'accepted_token': None,
+        'start_state': state
+    }
+    if backtrack:
+        fsm_lexer_backtrack(string, state, transitions, final_states, meta)
+        stats['symbols'] += len(string)
+        stats['tokens'] += len(meta['tokens'])
+        stats['error_tokens'] += sum(1 for token in meta['tokens'] if token[0] == 'ERROR')
+    else:
+        meta['tokens'].extend(fsm_lexer_chunks_instrumented((string,), state, transitions, final_states, meta, stats))
+
+    tokens = tokenize(meta['tokens'], tokenize_events)
+    stats['time'] += time.time() - start
+    return tokens
+
+"""
+Reads a file-like object chunk by chunk until read returns an empty chunk. Raises TypeError
+if a chunk is not a string, like the bytes of a binary reader on Python 3.
+"""
+def read_chunks(source, chunk_size):
+    while True:
+        chunk = source.read(chunk_size)
+        if not isinstance(chunk, string_types):
+            raise TypeError("Expected a text reader, read returned %s" % type(chunk).__name__)
+        if not chunk:
+            return
+        yield chunk
+
+"""
+Streaming version of lex.
+
+Reads from a text file object, a string, or any iterable of string chunks and yields
+tokens as soon as they are finished, with tokenize_events applied to each token.
+The results are the same as calling lex on the whole document.
+
+Args:
+    source: File-like object with a read method, a string, or an iterable of strings. Readers
+        must give text, binary readers raise TypeError on Python 3.
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    tokenize_events: A dict of functions for specialized handling of a token
+    chunk_size: Number of characters to read at a time from file-like objects
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in. Time is not measured.
+
+Yields:
+    (name, value) tokens
+
+Example Usage:
+    with open('meetings.log') as log:
+        for token in iter_lex(log, start_state, transitions, final_states, tokenize_events):
+            print(token)
+"""
+def iter_lex(source, state, transitions, final_states, tokenize_events, chunk_size=65536, stats=None):
+    if hasattr(source, 'read'):
+        chunks = read_chunks(source, chunk_size)
+    elif isinstance(source, string_types):
+        chunks = (source,)
+    else:
+        chunks = source
+
+    meta = {
+        'tokens': [],
+        'current_token': [],
+        'accepted_token': None,
+        'start_state': state
+    }
+
+    if stats is None:
+        tokens = fsm_lexer_chunks(chunks, state, transitions, final_states, meta)
+    else:
+        stats['lexer']['calls'] += 1
+        tokens = fsm_lexer_chunks_instrumented(chunks, state, transitions, final_states, meta, stats['lexer'])
+
+    for token in tokens:
+        if token[0] in tokenize_events:
+            token = tokenize_events[token[0]](token)
+            if token:
+                yield token
+        else:
+            yield token
+
+"""
+Compact version of lex that stores tokens as spans into the original string.
+
+Each token is three ints in parallel arrays: a kind id, a start offset and an end offset.
+Token values are not copied out of the string until span_value or span_tokens asks for them.
+
+Tokens whose tokenize event is tokenize_ignore are dropped while lexing. The other tokenize
+events change values, so they are applied later by span_tokens.
+
+Args:
+    string: String to be broken into tokens
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    tokenize_events: A dict of functions for specialized handling of a token
+
+Returns:
+    A dict with the following keys:
+        string: The string
+        kinds: List of token names. The position of a name is its kind id.
+        kind_ids: Dict of token name to kind id
+        kind: array('i') of kind ids
+        start: array('i') of start offsets
+        end: array('i') of end offsets
+        tokenize_events: The tokenize_events argument
+
+Example Usage:
+    spans = lex_spans(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    print(span_value(spans, 0))
+    tokens = tuple(span_tokens(spans))
+"""
+def lex_spans(string, state, transitions, final_states, tokenize_events):
+    spans = {
+        'string': string,
+        'kinds': [],
+        'kind_ids': {},
+        'kind': array('i'),
+        'start': array('i'),
+        'end': array('i'),
+        'tokenize_events': tokenize_events,
+    }
+    return fsm_lexer_spans(string, state, transitions, final_states, spans)
+
+"""
+Returns the value of the token at index in a spans dict from lex_spans, without tokenize events.
+"""
+def span_value(spans, index):
+    return spans['string'][spans['start'][index]:spans['end'][index]]
+
+"""
+Yields the (name, value) tokens of a spans dict from lex_spans with the tokenize events applied.
+
+The results are the same as lex.
+"""
+def span_tokens(spans):
+    string = spans['string']
+    kinds = spans['kinds']
+    tokenize_events = spans['tokenize_events']
+    for kind, start, end in zip(spans['kind'], spans['start'], spans['end']):
+        token = (kinds[kind], string[start:end])
+        if token[0] in tokenize_events:
+            token = tokenize_events[token[0]](token)
+            if token:
+                yield token
+        else:
+            yield token
+
+"""
+Same as lex, but token names are interned into integer kind ids.
+
+A compiled parser from fsm_parser.compile_parser has its own kinds registry. Passing it here
+gives tokens that fsm_parser.parse_kinds can look up in its table without any string
+comparisons.
+
+Args:
+    string: String to be broken into tokens
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    tokenize_events: A dict of functions for specialized handling of a token
+    kinds: A kinds registry from new_kinds. New names are added to it.
+
+Returns:
+    A tuple of (kind id, value) tuples. The names are the ones after tokenize events.
+
+Example Usage:
+    parser = compile_parser(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F)
+    tokens = lex_kinds(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, parser['kinds'])
+    stmts = parse_kinds(tokens, parser)
+"""
+def lex_kinds(string, state, transitions, final_states, tokenize_events, kinds):
+    kind_ids = kinds['kind_ids']
+    tokens = []
+    for name, value in lex(string, state, transitions, final_states, tokenize_events):
+        kind = kind_ids.get(name)
+        if kind is None:
+            kind = intern_kind(kinds, name)
+        tokens.append((kind, value))
+    return tuple(tokens)
+
+"""
+Returns an empty registry of token kinds, shared between a lexer and a parser.
+
+Returns:
+    A dict with the following keys:
+        kinds: List of token names. The position of a name is its kind id.
+        kind_ids: Dict of token name to kind id
+"""
+def new_kinds():
+    return {
+        'kinds': [],
+        'kind_ids': {},
+    }
+
+"""
+Lock for adding names to kinds registries, so threads that share one never give two names
+the same kind id.
+"""
+kinds_lock = threading.Lock()
+
+"""
+Returns the kind id of a token name, adding the name to the registry if it is new.
+"""
+def intern_kind(kinds, name):
+    kind = kinds['kind_ids'].get(name)
+    if kind is None:
+        with kinds_lock:
+            kind = kinds['kind_ids'].get(name)
+            if kind is None:
+                kinds['kinds'].append(name)
+                kind = kinds['kind_ids'][name] = len(kinds['kinds']) - 1
+    return kind
+
 """
 Helper for post processing of tokens.
 
@@ -126,8 +367,11 @@ def tokenize_ignore(token):
 """
 A modified finite state machine that can parse substring tokens from a string.
 
-Note: Make sure that the start state of the DFA has transitions for all letters. If not there
-will be an infinite loop.
+The string is walked by index instead of by recursion, so long strings do not hit the
+recursion limit and no substrings are copied until a token is finished.
+
+Note: Make sure that the start state of the DFA has transitions for all letters. If not a
+ValueError is raised since the lexer could never move past that letter.
 
 Args:
     string: String to be broken into tokens
@@ -139,31 +383,264 @@ Args:
 Return:
     List of (name, value) tokens
 """
-def fsm_lexer(string, state, transitions, final_states, meta):  
+def fsm_lexer(string, state, transitions, final_states, meta):
+    meta['tokens'].extend(fsm_lexer_chunks((string,), state, transitions, final_states, meta))
+    return meta
 
-    if state in final_states:
-        meta['accepted_token'] = (state, ''.join(meta['current_token']))
-    else:
-        meta['accepted_token'] = ("ERROR", ''.join(meta['current_token']))
+"""
+Generator version of fsm_lexer that reads the input from an iterable of string chunks.
+
+Tokens are yielded as soon as they are finished. Tokens may cross chunk boundaries. Only the
+current token is buffered, so memory use depends on the longest token and not on the input size.
+
+The last token is always yielded once the chunks run out, even if it is empty. This matches
+fsm_lexer on the joined string.
+
+Args:
+    chunks: Iterable of strings
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    meta: Dict with the same keys as in fsm_lexer. The tokens list is not used.
+
+Yields:
+    (name, value) tokens
+"""
+def fsm_lexer_chunks(chunks, state, transitions, final_states, meta):
+    start_state = meta['start_state']
+    pending = [''.join(meta['current_token'])]
+
+    for chunk in chunks:
+        token_start = 0
+        index = 0
+        length = len(chunk)
+
+        while index < length:
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                if re.match(state_transition[0], chunk[index]):
+                    next_state = state_transition[1]
+                    break
+
+            if next_state:
+                state = next_state
+                index += 1
+            elif state == start_state:
+                raise ValueError("No transition from start state %s for %r" % (start_state, chunk[index]))
+            else:
+                pending.append(chunk[token_start:index])
+                yield accept_token(state, ''.join(pending), final_states)
+                pending = []
+                token_start = index
+                state = start_state
+
+        pending.append(chunk[token_start:])
+
+    meta['current_token'] = list(''.join(pending))
+    meta['accepted_token'] = accept_token(state, ''.join(pending), final_states)
+    yield meta['accepted_token']
+
+"""
+Same as fsm_lexer_chunks, but counts state visits, transitions, regex attempts and tokens in
+a stats section. See fsm_stats.
+"""
+def fsm_lexer_chunks_instrumented(chunks, state, transitions, final_states, meta, stats):
+    start_state = meta['start_state']
+    pending = [''.join(meta['current_token'])]
+    states = stats['states']
+    taken = stats['transitions']
+
+    for chunk in chunks:
+        token_start = 0
+        index = 0
+        length = len(chunk)
+        stats['symbols'] += length
+
+        while index < length:
+            states[state] = states.get(state, 0) + 1
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                stats['regex_attempts'] += 1
+                if re.match(state_transition[0], chunk[index]):
+                    next_state = state_transition[1]
+                    key = (state, state_transition[0])
+                    taken[key] = taken.get(key, 0) + 1
+                    break
+
+            if next_state:
+                state = next_state
+                index += 1
+            elif state == start_state:
+                raise ValueError("No transition from start state %s for %r" % (start_state, chunk[index]))
+            else:
+                pending.append(chunk[token_start:index])
+                token = accept_token(state, ''.join(pending), final_states)
+                stats['tokens'] += 1
+                if token[0] == 'ERROR':
+                    stats['error_tokens'] += 1
+                yield token
+                pending = []
+                token_start = index
+                state = start_state
+
+        pending.append(chunk[token_start:])
+
+    meta['current_token'] = list(''.join(pending))
+    meta['accepted_token'] = accept_token(state, ''.join(pending), final_states)
+    stats['tokens'] += 1
+    if meta['accepted_token'][0] == 'ERROR':
+        stats['error_tokens'] += 1
+    yield meta['accepted_token']
+
+"""
+Maximal munch version of fsm_lexer that backtracks to the last accepting position.
+
+From the start of each token the DFA runs until it has no transition or the string ends.
+The token ends at the last position where the DFA was in an accepting state and the lexer
+resumes from the start state right after it. If no accepting state was reached the whole
+substring up to the dead end becomes an ERROR token, just like in fsm_lexer.
+
+Backtracking naively rescans the same characters over and over, which is quadratic for
+tables like ('a', 'a*b') on a long run of a's. To stay linear the (state, position) pairs
+that are known to reach the dead end without passing another accepting state are memoized
+together with their dead end position. Each pair is scanned at most once. See Reps,
+"Maximal-munch tokenization in linear time", TOPLAS 1998.
 
-    if len(string) == 0:
-        if meta['accepted_token']:
-            meta['tokens'].append(meta['accepted_token'])
-        return meta
+Empty tokens are never produced, so unlike fsm_lexer an empty string gives no tokens.
 
-    state_transitions = transitions[state]
-    next_state = None
+Args:
+    string: String to be broken into tokens
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    meta: Dict that keeps track of found tokens, start state, current substring, and current accepted_token
+    memoize: Set to False to disable the memo. Only useful for benchmarks.
+
+Return:
+    Same meta dict as fsm_lexer
+"""
+def fsm_lexer_backtrack(string, state, transitions, final_states, meta, memoize=True):
+    tokens = meta['tokens']
+    start_state = meta['start_state']
+    failed = {}
+    token_start = 0
+    length = len(string)
+
+    while token_start < length:
+        index = token_start
+        accepted = None
+        visited = []
+
+        while True:
+            if index > token_start and state in final_states:
+                accepted = (state, index)
+                visited = []
+            elif (state, index) in failed:
+                dead_end = failed[(state, index)]
+                break
+            else:
+                visited.append((state, index))
+
+            if index == length:
+                dead_end = index
+                break
+
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                if re.match(state_transition[0], string[index]):
+                    next_state = state_transition[1]
+                    break
+
+            if not next_state:
+                dead_end = index
+                break
+
+            state = next_state
+            index += 1
+
+        if memoize:
+            for key in visited:
+                failed[key] = dead_end
+
+        if accepted:
+            meta['accepted_token'] = (accepted[0], string[token_start:accepted[1]])
+            token_start = accepted[1]
+        elif dead_end == token_start:
+            raise ValueError("No transition from start state %s for %r" % (start_state, string[token_start]))
+        else:
+            meta['accepted_token'] = ("ERROR", string[token_start:dead_end])
+            token_start = dead_end
 
-    for state_transition in state_transitions:
-        if re.match(state_transition[0], string[0]):
-            next_state = state_transition[1]
-            break
+        tokens.append(meta['accepted_token'])
+        state = start_state
 
-    if next_state:
-        meta['current_token'].append(string[0])
-        return fsm_lexer(string[1:], next_state, transitions, final_states, meta)
+    if meta['accepted_token']:
+        meta['current_token'] = list(meta['accepted_token'][1])
+    return meta
+
+"""
+Version of fsm_lexer that appends spans instead of (name, value) tokens. Used by lex_spans.
+
+Args:
+    string: String to be broken into tokens
+    state: State state
+    transitions: See example transitions structure
+    final_states: Accepting states
+    spans: Dict from lex_spans
+
+Return:
+    The spans dict
+"""
+def fsm_lexer_spans(string, state, transitions, final_states, spans):
+    start_state = state
+    kind_ids = spans['kind_ids']
+    ignored = set(name for name, event in spans['tokenize_events'].items() if event is tokenize_ignore)
+    token_start = 0
+    index = 0
+    length = len(string)
+
+    while True:
+        if index < length:
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                if re.match(state_transition[0], string[index]):
+                    next_state = state_transition[1]
+                    break
+
+            if next_state:
+                state = next_state
+                index += 1
+                continue
+            elif state == start_state:
+                raise ValueError("No transition from start state %s for %r" % (start_state, string[index]))
+
+        name = state if state in final_states else "ERROR"
+        if name not in ignored:
+            if name not in kind_ids:
+                kind_ids[name] = len(spans['kinds'])
+                spans['kinds'].append(name)
+            spans['kind'].append(kind_ids[name])
+            spans['start'].append(token_start)
+            spans['end'].append(index)
+
+        if index == length:
+            return spans
+        token_start = index
+        state = start_state
+
+"""
+Helper that names a finished token after its state, or ERROR if the state is not accepting.
+"""
+def accept_token(state, value, final_states):
+    if state in final_states:
+        return (state, value)
     else:
-        if meta['accepted_token']:
-            meta['tokens'].append(meta['accepted_token'])
-        meta['current_token'] = []
-        return fsm_lexer(string, meta['start_state'], transitions, final_states, meta)
+        return ("ERROR", value)
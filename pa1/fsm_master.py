@@ -0,0 +1,238 @@
+import re
+
+from fsm_lexer import accept_token, lex, tokenize
+from fsm_regex import complement_intervals, intervals_pattern, merge_intervals
+from fsm_reorder import pattern_symbols
+
+"""
+Compiles a lexer table into one master regex so tokens are scanned by the C regex engine.
+
+fsm_lexer follows transitions from the start state until the next character has none, then
+emits a token named after the state it stopped in, or ERROR if that state is not accepting.
+The master regex does the same walk. Starting from the start state, every state becomes
+
+    [self loop characters]* (?: [characters to T1] <T1> | [characters to T2] <T2> | ... | marker)
+
+where the marker is a negative lookahead for every character the state has a transition for.
+The character classes of a state are disjoint, so the regex never backtracks.
+
+Scanning uses findall on a copy of the regex without groups, so the token values are cut out
+in C. The walk is deterministic, so the name of a token only depends on its value. Names are
+looked up in a cache and only new values are matched again with the named copy of the regex,
+where every marker is an empty named group and match.lastgroup names the state the token
+ended in.
+
+The first matching pattern wins, like in fsm_lexer. Each pattern must match single
+characters only, see fsm_reorder.pattern_symbols.
+
+Tables that cannot be written this way are still lexed, with fsm_lexer.lex, and the reason
+is kept in the result. That is the case if:
+
+    - A pattern cannot be analyzed
+    - A state can be reached again through other states. Self loops are fine.
+    - The expanded regex would have more than max_states states, since a state reached
+      along several paths is written out once per path
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state
+    final_states: A tuple of accepting states
+    max_states: Largest number of states to write out
+    cache_size: Number of token values to keep names for before the cache is cleared
+
+Returns:
+    A dict with the following keys:
+        scan: The compiled master regex without groups, or None
+        regex: The compiled master regex with marker groups, or None
+        reason: Why the table could not be compiled, or None
+        names: Dict of marker group name to token name, None for the start state
+        kinds: Cache of token value to token name
+        cache_size: The cache_size argument
+        start: The start state
+        transitions: The transitions argument
+        final_states: The final_states argument
+
+Example Usage:
+    master = compile_master(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+    tokens = lex_master(string, master, pa1.tokenize_events)
+"""
+def compile_master(transitions, start, final_states, max_states=2000, cache_size=100000):
+    master = {
+        'scan': None,
+        'regex': None,
+        'reason': None,
+        'names': {},
+        'kinds': {},
+        'cache_size': cache_size,
+        'start': start,
+        'transitions': transitions,
+        'final_states': final_states,
+    }
+    try:
+        classes = dict((state, state_classes(state, transitions)) for state in transitions)
+        markers = []
+        master['regex'] = re.compile(expand_state(start, classes, markers, [], max_states, True))
+        master['scan'] = re.compile(expand_state(start, classes, [], [], max_states, False))
+    except (ValueError, re.error, AssertionError) as error:
+        # Python 2 raises an AssertionError for more than 100 named groups
+        master['regex'] = None
+        master['reason'] = str(error) or 'The regex has too many groups'
+        return master
+
+    for number, state in enumerate(markers):
+        if state == start:
+            master['names']['s%d' % number] = None
+        elif state in final_states:
+            master['names']['s%d' % number] = state
+        else:
+            master['names']['s%d' % number] = 'ERROR'
+    return master
+
+"""
+Returns the first match character sets of a state as a list of (intervals, target), with
+the self loop, if any, first. Raises a ValueError if a pattern cannot be analyzed.
+"""
+def state_classes(state, transitions):
+    covered = []
+    targets = {}
+    order = []
+    for state_transition in transitions.get(state, ()):
+        pattern, target = state_transition[0], state_transition[1]
+        intervals = pattern_symbols(pattern, None)
+        if intervals is None:
+            raise ValueError("Pattern %r of state %s is not a single character pattern" % (pattern, state))
+        intervals = intersect_intervals(intervals, complement_intervals(covered))
+        covered = merge_intervals(covered + intervals)
+        if not intervals or not target:
+            continue
+        if target not in targets:
+            targets[target] = []
+            order.append(target)
+        targets[target] = merge_intervals(targets[target] + intervals)
+
+    order.sort(key=lambda target: target != state)
+    return [(targets[target], target) for target in order]
+
+"""
+Returns the intersection of two lists of merged intervals.
+"""
+def intersect_intervals(first, second):
+    result = []
+    i = 0
+    j = 0
+    while i < len(first) and j < len(second):
+        low = max(first[i][0], second[j][0])
+        high = min(first[i][1], second[j][1])
+        if low <= high:
+            result.append((low, high))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+"""
+Writes the regex for the walk from a state. See compile_master.
+
+Args:
+    state: The state
+    classes: Dict of state to the result of state_classes
+    markers: List of the states of the marker groups written so far
+    path: States on the way from the start state to this one
+    max_states: See compile_master
+    named: If True each marker is an empty named group
+"""
+def expand_state(state, classes, markers, path, max_states, named):
+    if state in path:
+        raise ValueError("State %s can be reached again through %s" % (state, ', '.join(path[path.index(state) + 1:])))
+
+    state_classes = classes.get(state, [])
+    parts = []
+    loop = ''
+    branches = []
+    for intervals, target in state_classes:
+        if target == state:
+            loop = '%s*' % intervals_pattern(intervals)
+        else:
+            branches.append((intervals, target))
+
+    for intervals, target in branches:
+        parts.append(intervals_pattern(intervals) + expand_state(target, classes, markers, path + [state],
+            max_states, named))
+
+    marker = '(?P<s%d>)' % len(markers) if named else ''
+    markers.append(state)
+    if len(markers) > max_states:
+        raise ValueError("The table expands to more than %d states" % max_states)
+    outgoing = merge_intervals([interval for intervals, target in state_classes for interval in intervals])
+    if outgoing:
+        marker += '(?!%s)' % intervals_pattern(outgoing)
+    parts.append(marker)
+
+    return '%s(?:%s)' % (loop, '|'.join(parts))
+
+"""
+Same as fsm_lexer.lex, but scans with a master regex from compile_master.
+
+Falls back to fsm_lexer.lex if the table could not be compiled, see master['reason'].
+
+Args:
+    string: String to be broken into tokens
+    master: Dict from compile_master
+    tokenize_events: A dict of functions for specialized handling of a token
+
+Returns:
+    A tuple of (name, value) tokens, the same as lex
+"""
+def lex_master(string, master, tokenize_events):
+    if master['regex'] is None:
+        return lex(string, master['start'], master['transitions'], master['final_states'], tokenize_events)
+
+    if not string:
+        return tokenize([accept_token(master['start'], string, master['final_states'])], tokenize_events)
+
+    values = master['scan'].findall(string)
+    if values and not values[-1]:
+        values.pop()
+    # An empty value or a gap means the start state had no transition somewhere
+    if '' in values or sum(map(len, values)) != len(string):
+        return lex_master_exact(string, master, tokenize_events)
+
+    kinds = master['kinds']
+    if len(kinds) > master['cache_size']:
+        kinds.clear()
+    tokens = []
+    append = tokens.append
+    for value in values:
+        name = kinds.get(value)
+        if name is None:
+            name = master['names'][master['regex'].match(value).lastgroup]
+            if name is None:
+                return lex_master_exact(string, master, tokenize_events)
+            kinds[value] = name
+        append((name, value))
+
+    return tokenize(tokens, tokenize_events)
+
+"""
+Token by token version of lex_master for inputs where the start state has no transition for
+a character, or where the last token ends in the start state.
+"""
+def lex_master_exact(string, master, tokenize_events):
+    match = master['regex'].match
+    names = master['names']
+    tokens = []
+    position = 0
+    length = len(string)
+    while position < length:
+        found = match(string, position)
+        name = names[found.lastgroup]
+        end = found.end()
+        if name is None:
+            if end < length:
+                raise ValueError("No transition from start state %s for %r" % (master['start'], string[end]))
+            name = accept_token(master['start'], '', master['final_states'])[0]
+        tokens.append((name, string[position:end]))
+        position = end
+
+    return tokenize(tokens, tokenize_events)
@@ -0,0 +1,133 @@
+import re
+from collections import OrderedDict
+
+from fsm_lexer import accept_token, tokenize
+
+"""
+Lazy transition memo for tables whose patterns cannot be expanded ahead of time.
+
+compile_dfa and compile_classes need to know every character, or every edge of every
+character set, before the input is read. Patterns like r'[^\\-\\.\\?!,; ]' match almost all of
+Unicode, and some patterns cannot be split into character sets at all. Here nothing is
+expanded up front. The first time a state sees a character, its patterns are matched once
+with precompiled regexes and the target is kept in a memo for that state, including when no
+pattern matches. Later steps for the same pair are one dict lookup.
+
+Every state keeps at most max_chars characters. When a memo is full the character that was
+added first is dropped, so memory stays bounded on arbitrary Unicode input while the
+characters that keep coming back are added again on their next miss.
+
+Tables must not be changed after they have been used with a memo.
+
+Args:
+    transitions: See fsm module for transitions structure
+    max_chars: Largest number of characters memoized per state
+
+Returns:
+    A memo dict with the following keys:
+        transitions: The transitions argument
+        patterns: Dict of state to a tuple of (compiled pattern match, target) pairs
+        rows: Dict of state to an OrderedDict of character to target, None if no pattern matches
+        max_chars: The argument
+        misses: Number of characters whose patterns were matched
+        evictions: Number of characters dropped from full memos
+
+Example Usage:
+    memo = new_memo(pa1.lexer_transitions)
+    for message in messages:
+        tokens = lex_memo(message, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F,
+            pa1.tokenize_events, memo)
+"""
+def new_memo(transitions, max_chars=1024):
+    if max_chars < 1:
+        raise ValueError("max_chars must be at least 1, got %r" % (max_chars,))
+
+    return {
+        'transitions': transitions,
+        'patterns': dict((state, tuple((re.compile(state_transition[0]).match, state_transition[1])
+            for state_transition in state_transitions)) for state, state_transitions in transitions.items()),
+        'rows': dict((state, OrderedDict()) for state in transitions),
+        'max_chars': max_chars,
+        'misses': 0,
+        'evictions': 0,
+    }
+
+"""
+Matches the patterns of a state against a character and memoizes the target.
+
+Returns:
+    The target of the first matching pattern, or None if no pattern matches
+"""
+def memo_step(memo, state, char):
+    next_state = None
+    for match, target in memo['patterns'][state]:
+        if match(char):
+            next_state = target
+            break
+
+    row = memo['rows'][state]
+    if len(row) >= memo['max_chars']:
+        row.popitem(last=False)
+        memo['evictions'] += 1
+    row[char] = next_state
+    memo['misses'] += 1
+    return next_state
+
+"""
+Returns the number of memoized characters per state and the counters of a memo as a dict.
+"""
+def memo_info(memo):
+    return {
+        'chars': dict((state, len(row)) for state, row in memo['rows'].items()),
+        'misses': memo['misses'],
+        'evictions': memo['evictions'],
+        'max_chars': memo['max_chars'],
+    }
+
+"""
+Same as fsm_lexer.lex, with transitions resolved through a memo.
+
+Args:
+    string: String to be broken into tokens
+    state: Start state
+    transitions: See fsm module for transitions structure
+    final_states: Accepting states
+    tokenize_events: A dict of functions for specialized handling of a token
+    memo: A memo from new_memo for the same transitions. A new one is made if None. Pass the
+        same memo across calls to keep it warm.
+
+Returns:
+    A tuple of (name, value) tokens, the same as lex
+"""
+def lex_memo(string, state, transitions, final_states, tokenize_events, memo=None):
+    if memo is None:
+        memo = new_memo(transitions)
+    elif memo['transitions'] is not transitions:
+        raise ValueError("Memo was made for other transitions")
+
+    rows = memo['rows']
+    start_state = state
+    tokens = []
+    token_start = 0
+    index = 0
+    length = len(string)
+    missing = object()
+
+    while index < length:
+        char = string[index]
+        next_state = rows[state].get(char, missing)
+        if next_state is missing:
+            next_state = memo_step(memo, state, char)
+
+        if next_state:
+            state = next_state
+            index += 1
+        elif state == start_state:
+            raise ValueError("No transition from start state %s for %r" % (start_state, char))
+        else:
+            tokens.append(accept_token(state, string[token_start:index], final_states))
+            token_start = index
+            state = start_state
+
+    tokens.append(accept_token(state, string[token_start:], final_states))
+    return tokenize(tokens, tokenize_events)
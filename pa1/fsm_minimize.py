@@ -0,0 +1,224 @@
+import re
+
+from fsm_compiler import compile_dfa
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+"""
+Minimizes a DFA transition table with Hopcroft's partition refinement algorithm.
+
+The input table is expanded over the alphabet with compile_dfa, equivalent states are merged,
+and the result is written back out as a transition table with one character class per target.
+
+Missing transitions are kept distinct from transitions into a non-accepting state, since the
+lexer and parser treat a missing transition as the end of a token.
+
+Accepting states are only merged if they have the same name, so the token names produced by
+fsm_lexer do not change. Set merge_final_states to True to merge any equivalent accepting
+states, which is fine for fsm and fsm_parser where the name of an accepting state does not matter.
+
+Non-accepting blocks are named after their first state, with the start state first.
+
+For tables over characters every character outside the alphabet is assumed to behave like the
+first character after the alphabet. For tables over token names, like the ones for fsm_parser,
+the alphabet must list every token name and the patterns only match those names.
+
+Args:
+    transitions: See fsm module for transitions structure
+    start: The starting state for the given DFA
+    final_states: A tuple of accepting states
+    alphabet: Iterable of symbols. Defaults to the first 256 characters.
+    first_match: If True the first matching pattern wins like in fsm_lexer and fsm_parser.
+        Otherwise the last matching pattern wins like in fsm.
+    merge_final_states: If True equivalent accepting states with different names are merged.
+
+Returns:
+    A tuple of (transitions, start, final_states)
+
+Example Usage:
+    transitions, start, final_states = minimize(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+    tokens = lex(string, start, transitions, final_states, pa1.tokenize_events)
+"""
+def minimize(transitions, start, final_states, alphabet=None, first_match=True, merge_final_states=False):
+    if alphabet is None:
+        alphabet = [chr(code) for code in range(256)]
+    alphabet = list(alphabet)
+
+    other = None
+    if all(len(symbol) == 1 for symbol in alphabet):
+        other = unichr(max(ord(symbol) for symbol in alphabet) + 1)
+        alphabet.append(other)
+
+    dfa = compile_dfa(transitions, start, final_states, alphabet, first_match)
+    states = dfa['states']
+    table = dfa['table']
+    columns = dfa['columns']
+    symbols = sorted(columns, key=columns.get)
+
+    # State len(states) is the explicit dead state for missing transitions
+    dead = len(states)
+    delta = [list(row) for row in table]
+    delta.append([dead] * len(symbols))
+    for row in delta:
+        for column, target in enumerate(row):
+            if target < 0:
+                row[column] = dead
+
+    reachable = find_reachable(delta, dfa['start'])
+
+    def label(state):
+        if state == dead:
+            return ('dead',)
+        if dfa['final'][state]:
+            return ('final',) if merge_final_states else ('final', states[state])
+        return ('other',)
+
+    blocks = {}
+    for state in sorted(reachable):
+        blocks.setdefault(label(state), set()).add(state)
+    partition = hopcroft(delta, reachable, list(blocks.values()), len(symbols))
+
+    block_of = {}
+    for number, block in enumerate(partition):
+        for state in block:
+            block_of[state] = number
+
+    names = {}
+    for number, block in enumerate(partition):
+        if dead not in block:
+            names[number] = states[min(block)]
+
+    new_transitions = {}
+    for number, block in enumerate(partition):
+        if dead in block:
+            continue
+        row = delta[min(block)]
+        targets = {}
+        for column, target in enumerate(row):
+            if block_of[target] in names:
+                targets.setdefault(block_of[target], []).append(column)
+        new_transitions[names[number]] = tuple(
+            (symbols_pattern(targets[target], symbols, other is not None), names[target])
+            for target in sorted(targets, key=lambda target: targets[target][0]))
+
+    new_final_states = tuple(names[number] for number in sorted(names) if dfa['final'][min(partition[number])])
+
+    return (new_transitions, names[block_of[dfa['start']]], new_final_states)
+
+"""
+Returns the set of states reachable from the start state in a dense transition table.
+"""
+def find_reachable(delta, start):
+    reachable = set([start])
+    stack = [start]
+    while stack:
+        state = stack.pop()
+        for target in delta[state]:
+            if target not in reachable:
+                reachable.add(target)
+                stack.append(target)
+    return reachable
+
+"""
+Hopcroft's algorithm over a dense transition table.
+
+Args:
+    delta: List of rows. Each row is a list of target states per column.
+    states: The states to partition
+    blocks: Initial partition as a list of sets of states
+    width: Number of columns
+
+Returns:
+    A list of sets of equivalent states
+"""
+def hopcroft(delta, states, blocks, width):
+    inverse = [{} for column in range(width)]
+    for state in states:
+        for column in range(width):
+            inverse[column].setdefault(delta[state][column], []).append(state)
+
+    partition = [set(block) for block in blocks if block]
+    block_of = {}
+    for number, block in enumerate(partition):
+        for state in block:
+            block_of[state] = number
+    waiting = set(range(len(partition)))
+
+    while waiting:
+        splitter = list(partition[waiting.pop()])
+        for column in range(width):
+            touched = {}
+            for target in splitter:
+                for state in inverse[column].get(target, ()):
+                    touched.setdefault(block_of[state], set()).add(state)
+
+            for number, inside in touched.items():
+                block = partition[number]
+                if len(inside) == len(block):
+                    continue
+                block -= inside
+                new_number = len(partition)
+                partition.append(inside)
+                for state in inside:
+                    block_of[state] = new_number
+                if number in waiting or len(inside) <= len(block):
+                    waiting.add(new_number)
+                else:
+                    waiting.add(number)
+
+    return sorted(partition, key=min)
+
+"""
+Builds a regex that matches exactly the symbols in the given columns.
+
+Character alphabets get a character class. The last column of a character alphabet stands in
+for everything outside the alphabet. If it is one of the columns, a negated class of the other
+characters is used. Token name alphabets get an anchored alternation.
+"""
+def symbols_pattern(columns, symbols, chars):
+    if not chars:
+        return '(?:%s)$' % '|'.join(re.escape(symbols[column]) for column in columns)
+
+    other = len(symbols) - 1
+    if other in columns:
+        excluded = sorted(set(range(other)) - set(columns))
+        if not excluded:
+            return r'[\s\S]'
+        return '[^%s]' % char_ranges(sorted((symbols[column] for column in excluded), key=ord))
+
+    if len(columns) == 1:
+        return escape_char(symbols[columns[0]])
+    return '[%s]' % char_ranges(sorted((symbols[column] for column in columns), key=ord))
+
+"""
+Writes sorted characters as the inside of a character class, collapsing runs into ranges.
+"""
+def char_ranges(chars):
+    parts = []
+    start = 0
+    while start < len(chars):
+        end = start
+        while end + 1 < len(chars) and ord(chars[end + 1]) == ord(chars[end]) + 1:
+            end += 1
+        if end - start >= 2:
+            parts.append('%s-%s' % (escape_char(chars[start]), escape_char(chars[end])))
+        else:
+            parts.extend(escape_char(char) for char in chars[start:end + 1])
+        start = end + 1
+    return ''.join(parts)
+
+"""
+Escapes a single character so it can be used inside or outside a character class.
+"""
+def escape_char(char):
+    code = ord(char)
+    if char.isalnum() and code < 128:
+        return char
+    if 32 <= code < 127:
+        return '\\' + char
+    if code < 256:
+        return '\\x%02x' % code
+    return char
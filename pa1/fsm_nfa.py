@@ -0,0 +1,195 @@
+import re
+from collections import OrderedDict
+
+"""
+NFA support using a lazily built DFA.
+
+The NFA transitions use the same structure as the DFA transitions in the fsm module with
+two additions:
+
+    - A target can be a tuple of states to move to all of them.
+    - A pattern of None is an epsilon move that does not consume a character.
+
+Unlike fsm, all matching patterns are followed, so overlapping patterns are never silently
+dropped.
+
+DFA states are sets of NFA states and are only built the first time the run needs them
+(subset construction on demand). They are cached so long inputs run at DFA speed. When the
+cache holds cache_size DFA states it is flushed and rebuilt from the current state, which
+keeps memory bounded for NFAs whose full DFA would be exponentially large. Each DFA state
+also keeps at most row_size characters in its row, dropping the one added first when it is
+full, so open ended patterns over Unicode do not grow a row without bound either.
+
+This is an acceptor only: fsm_lazy answers whether the whole string is accepted, like fsm. It
+does not name tokens or stop at the end of a token. To lex with an NFA, write the tokens as
+rules for fsm_regex.compile_lexer, which builds the DFA up front and keeps the rule order.
+
+Example Usage:
+
+    Strings over 0 and 1 where the third to last character is a 1.
+
+    transitions = {
+        'A': (
+            (r'[01]', 'A'),
+            ('1', 'B'),
+        ),
+        'B': (
+            (r'[01]', 'C'),
+        ),
+        'C': (
+            (r'[01]', 'D'),
+        ),
+        'D': (),
+    }
+
+    dfa = lazy_dfa(transitions, 'A', ('D'))
+    fsm_lazy('0100', dfa)
+"""
+
+"""
+Builds an empty lazy DFA for an NFA.
+
+Args:
+    transitions: NFA transitions, see the module docstring
+    start: The starting state of the NFA
+    final_states: A tuple of accepting states
+    cache_size: Maximum number of DFA states to keep before the cache is flushed
+    row_size: Maximum number of characters to keep in the row of each DFA state
+
+Returns:
+    A dict with the following keys:
+        patterns: Dict of NFA state to ((compiled pattern, targets), ...)
+        epsilon: Dict of NFA state to tuple of epsilon targets
+        final_states: The final_states argument
+        start: Frozenset of NFA states for the start state
+        cache_size: The cache_size argument
+        row_size: The row_size argument
+        ids: Dict of frozenset to integer DFA state
+        sets: List of frozensets. The position is the integer DFA state.
+        final: List of booleans per integer DFA state
+        rows: List of OrderedDicts of character to integer DFA state
+        flushes: Number of times the cache was flushed
+        evictions: Number of characters dropped from full rows
+"""
+def lazy_dfa(transitions, start, final_states, cache_size=10000, row_size=1024):
+    patterns = {}
+    epsilon = {}
+    for state, state_transitions in transitions.items():
+        patterns[state] = []
+        epsilon[state] = []
+        for pattern, targets in state_transitions:
+            if not isinstance(targets, tuple):
+                targets = (targets,)
+            if pattern is None:
+                epsilon[state].extend(targets)
+            else:
+                patterns[state].append((re.compile(pattern), targets))
+
+    dfa = {
+        'patterns': patterns,
+        'epsilon': epsilon,
+        'final_states': final_states,
+        'cache_size': max(cache_size, 2),
+        'row_size': max(row_size, 1),
+        'ids': {},
+        'sets': [],
+        'final': [],
+        'rows': [],
+        'flushes': 0,
+        'evictions': 0,
+    }
+    dfa['start'] = epsilon_closure((start,), epsilon)
+    return dfa
+
+"""
+Returns the frozenset of states reachable from the given states using only epsilon moves.
+"""
+def epsilon_closure(states, epsilon):
+    closure = set(states)
+    stack = list(states)
+    while stack:
+        state = stack.pop()
+        for target in epsilon.get(state, ()):
+            if target not in closure:
+                closure.add(target)
+                stack.append(target)
+    return frozenset(closure)
+
+"""
+Returns the integer DFA state for a set of NFA states, adding it to the cache if needed.
+"""
+def intern_state(dfa, states):
+    state = dfa['ids'].get(states)
+    if state is None:
+        state = len(dfa['sets'])
+        dfa['ids'][states] = state
+        dfa['sets'].append(states)
+        dfa['final'].append(any(nfa_state in dfa['final_states'] for nfa_state in states))
+        dfa['rows'].append(OrderedDict())
+    return state
+
+"""
+Empties the cache in place so lists held by a running loop stay valid.
+"""
+def flush(dfa):
+    dfa['ids'].clear()
+    del dfa['sets'][:]
+    del dfa['final'][:]
+    del dfa['rows'][:]
+    dfa['flushes'] += 1
+
+"""
+Builds the DFA transition for a state and character by subset construction.
+
+If the new DFA state does not fit in the cache, the cache is flushed first. If the row of the
+state is full, the character added to it first is dropped.
+
+Returns:
+    The next integer DFA state. Integer states from before a flush are no longer valid.
+"""
+def lazy_next(dfa, state, char):
+    current = dfa['sets'][state]
+    targets = []
+    for nfa_state in current:
+        for pattern, pattern_targets in dfa['patterns'].get(nfa_state, ()):
+            if pattern.match(char):
+                targets.extend(pattern_targets)
+    states = epsilon_closure(targets, dfa['epsilon'])
+
+    if states not in dfa['ids'] and len(dfa['sets']) >= dfa['cache_size']:
+        flush(dfa)
+        state = intern_state(dfa, current)
+
+    next_state = intern_state(dfa, states)
+    row = dfa['rows'][state]
+    if len(row) >= dfa['row_size']:
+        row.popitem(last=False)
+        dfa['evictions'] += 1
+    row[char] = next_state
+    return next_state
+
+"""
+Finite state machine for NFAs that runs on a lazy DFA from lazy_dfa.
+
+Args:
+    string: A string to check as valid for the given NFA
+    dfa: A lazy DFA from lazy_dfa. The cache is kept between calls.
+
+Returns:
+    True if the string is a valid for the given NFA.
+    False if the string is invalid.
+"""
+def fsm_lazy(string, dfa):
+    rows = dfa['rows']
+    sets = dfa['sets']
+    state = intern_state(dfa, dfa['start'])
+
+    for char in string:
+        next_state = rows[state].get(char)
+        if next_state is None:
+            next_state = lazy_next(dfa, state, char)
+        if not sets[next_state]:
+            return False
+        state = next_state
+
+    return dfa['final'][state]
@@ -0,0 +1,194 @@
+import multiprocessing
+
+from fsm_compiler import match_patterns
+import fsm_batch
+
+"""
+Data parallel acceptance of one long string.
+
+The string is split into chunks and each chunk is run from every state of the DFA at once,
+which gives a mapping from the state the chunk starts in to the state it ends in. The chunks
+do not depend on each other, so they can run on a pool of processes. The mappings are then
+composed from the start state to get the final state.
+
+Running a chunk from every state sounds expensive, but the runs of a DFA merge quickly, so
+only the distinct live states are stepped, and the few that are left after a short prefix
+finish the chunk with the same loop as fsm_compiled.
+
+Args:
+    string: A string to check as valid for the DFA
+    dfa: A compiled DFA from fsm_compiler.compile_dfa
+    processes: Number of worker processes. Defaults to the number of CPUs. With 1 the chunks
+        are run in this process.
+    chunk_count: Number of chunks. Defaults to 4 per process.
+
+Returns:
+    True if the string is valid for the DFA, the same as fsm_compiled
+
+Example Usage:
+    dfa = compile_dfa(transitions, 'A', ('C'))
+    accepted = fsm_parallel(huge_string, dfa, processes=8)
+"""
+def fsm_parallel(string, dfa, processes=None, chunk_count=None):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunk_count is None:
+        chunk_count = processes * 4
+    bounds = chunk_bounds(len(string), chunk_count)
+
+    if processes == 1:
+        mappings = [chunk_mapping(dfa, string, begin, end) for begin, end in bounds]
+    else:
+        # The string and DFA go through the initializer, so a forked worker shares them
+        # instead of receiving a pickled copy of every chunk.
+        pool = multiprocessing.Pool(processes, init_worker, (string, dfa))
+        try:
+            mappings = pool.map(worker_mapping, bounds)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    state = compose_mappings(mappings, dfa['start'])
+    return state >= 0 and dfa['final'][state]
+
+"""
+Per process state of a worker, set up by init_worker.
+"""
+worker = {}
+
+"""
+Keeps the string and DFA for worker_mapping.
+"""
+def init_worker(string, dfa):
+    worker['string'] = string
+    worker['dfa'] = dfa
+
+"""
+Runs chunk_mapping on a (begin, end) slice of the string given to init_worker.
+"""
+def worker_mapping(bounds):
+    return chunk_mapping(worker['dfa'], worker['string'], bounds[0], bounds[1])
+
+"""
+Returns up to chunk_count (begin, end) bounds that split length characters evenly.
+"""
+def chunk_bounds(length, chunk_count):
+    if not length:
+        return [(0, 0)]
+    size = -(-length // max(1, min(chunk_count, length)))
+    return [(begin, min(begin + size, length)) for begin in range(0, length, size)]
+
+"""
+Runs string[begin:end] from every state of a compiled DFA.
+
+The live states are stepped together for the first merge_steps characters, where most runs
+merge. Each state that is still live after that finishes the chunk on its own.
+
+Returns:
+    A list with the end state for each start state, -1 where the run hits a missing transition
+"""
+def chunk_mapping(dfa, string, begin, end, merge_steps=32):
+    table = dfa['table']
+    columns = dfa['columns']
+    patterns = dfa['patterns']
+    first_match = dfa['first_match']
+    count = len(dfa['states'])
+
+    # Current state to the start states that lead to it
+    live = dict((state, [state]) for state in range(count))
+    index = begin
+    while index < end and len(live) > 1 and index - begin < merge_steps:
+        char = string[index]
+        column = columns.get(char)
+        stepped = {}
+        for state, origins in live.items():
+            if column is None:
+                next_state = match_patterns(patterns[state], char, first_match)
+            else:
+                next_state = table[state][column]
+            if next_state >= 0:
+                if next_state in stepped:
+                    stepped[next_state].extend(origins)
+                else:
+                    stepped[next_state] = origins
+        live = stepped
+        index += 1
+
+    mapping = [-1] * count
+    rest = string[index:end]
+    for state, origins in live.items():
+        for char in rest:
+            column = columns.get(char)
+            if column is None:
+                state = match_patterns(patterns[state], char, first_match)
+            else:
+                state = table[state][column]
+            if state < 0:
+                break
+        for origin in origins:
+            mapping[origin] = state
+    return mapping
+
+"""
+Follows the start state through a list of chunk mappings.
+
+Returns:
+    The final state, or -1 if the run hits a missing transition
+"""
+def compose_mappings(mappings, state):
+    for mapping in mappings:
+        state = mapping[state]
+        if state < 0:
+            return -1
+    return state
+
+"""
+NumPy version of fsm_parallel.
+
+Every (chunk, start state) pair is one lane and all lanes are stepped together, one position
+at a time, with the tables from fsm_batch. Strings with characters outside the alphabet of
+the DFA fall back to fsm_parallel in this process.
+
+Requires numpy.
+
+Args:
+    string: A string to check as valid for the DFA
+    dfa: A compiled DFA from fsm_compiler.compile_dfa over a character alphabet
+    chunk_count: Number of chunks
+
+Returns:
+    True if the string is valid for the DFA, the same as fsm_compiled
+"""
+def fsm_parallel_numpy(string, dfa, chunk_count=1024):
+    numpy = fsm_batch.numpy
+    if numpy is None:
+        raise ImportError("fsm_parallel_numpy requires numpy")
+    if not string:
+        return dfa['final'][dfa['start']]
+
+    tables = fsm_batch.batch_tables(dfa)
+    column_of = tables['column_of']
+    codes = fsm_batch.encode_strings([string])
+    if int(codes.max()) >= len(column_of) - 1 or (column_of[codes] < 0).any():
+        return fsm_parallel(string, dfa, processes=1)
+
+    # One row per chunk, padded at the end with the column that keeps every state
+    bounds = chunk_bounds(len(string), chunk_count)
+    size = bounds[0][1] - bounds[0][0]
+    padded = numpy.full(len(bounds) * size, tables['padding'], dtype=column_of.dtype)
+    padded[:len(string)] = column_of[codes]
+    padded = numpy.ascontiguousarray(padded.reshape(len(bounds), size).T)
+
+    width = tables['width']
+    count = len(dfa['states'])
+    table = tables['table']
+    state = numpy.tile(numpy.arange(count, dtype=table.dtype) * width, (len(bounds), 1))
+    for position in range(size):
+        state = table[state + padded[position][:, numpy.newaxis]]
+
+    # The explicit dead state of batch_tables is state count
+    mappings = state // width
+    mappings[mappings == count] = -1
+    final_state = compose_mappings(mappings.tolist(), dfa['start'])
+    return final_state >= 0 and dfa['final'][final_state]
@@ -1,15 +1,29 @@
 import re
+import threading
+import time
+from array import array
+from itertools import islice
+
+from fsm_compiler import compile_dfa, match_patterns
+from fsm_lexer import intern_kind, new_kinds
 
 """
 Simple parser that uses a DFA.
 
 This method only works for very simple grammars.
 
+The table is compiled once with compile_parser and kept, see cached_parser, so each token
+costs a dict and a table lookup instead of a re.match per pattern. A table is compiled again
+when a state of transitions is added, removed or replaced, but a state whose transitions are
+a list must not be changed in place after it has been used. With stats the patterns are
+matched one by one so regex attempts can be counted.
+
 Args:
     tokens: A tuple of (name, value) tuples that you would get from using my fsm_lexer module
     state: Start state
     transitions: See example for transition structure
     final_states: A tuple of accepting states
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in
 
 Return:
     A tuple of strings
@@ -40,17 +54,231 @@ Example:
 
     result = parse(tokens, start_state, transitions, final_states)
 """
-def parse(tokens, state, transitions, final_states):
-    token_index = 0
+def parse(tokens, state, transitions, final_states, stats=None):
+    if stats is not None:
+        start = time.time()
+        stats['parser']['calls'] += 1
+        meta = {
+            'stmts': [],
+            'current_stmt': [],
+            'accepted_stmt': None,
+            'start_state': state
+        }
+        stmts = tuple(fsm_parser_tokens_instrumented(tokens, state, transitions, final_states, meta, stats['parser']))
+        stats['parser']['time'] += time.time() - start
+        return stmts
+
+    return tuple(fsm_parser_compiled(tokens, cached_parser(transitions, state, final_states), True))
+
+"""
+Streaming version of parse.
+
+Accepts any iterable of tokens, such as the generator from fsm_lexer.iter_lex, and yields
+statements as soon as they are known to be complete. No token collection is built, so a
+lexer and parser can be chained into a single pass over the input.
+
+Args:
+    tokens: An iterable of (name, value) tuples
+    state: Start state
+    transitions: See example for transition structure
+    final_states: A tuple of accepting states
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in. Time is not measured.
+
+Yields:
+    Strings, the same ones parse would return
+"""
+def iter_parse(tokens, state, transitions, final_states, stats=None):
     meta = {
         'stmts': [],
         'current_stmt': [],
         'accepted_stmt': None,
         'start_state': state
     }
-    result = fsm_parser(tokens, token_index, state, transitions, final_states, meta)
-    return tuple(result['stmts'])
+    if stats is not None:
+        stats['parser']['calls'] += 1
+        return fsm_parser_tokens_instrumented(tokens, state, transitions, final_states, meta, stats['parser'])
+    return fsm_parser_compiled(tokens, cached_parser(transitions, state, final_states), True)
+
+"""
+Compiles a parser table into a table indexed by integer states and token kinds.
+
+Token names are interned into kind ids, see fsm_lexer.new_kinds. Every name a pattern spells
+out is interned up front, so alternations like r'NOT_TOKEN|TO|DASH' are expanded into one
+column per name. The next state for each kind is still found with re.match on the name, so
+the results are the same as matching the patterns token by token. Names that are first seen
+while parsing get their columns then, see extend_parser.
 
+Args:
+    transitions: See example for transition structure
+    start: Start state
+    final_states: A tuple of accepting states
+    kinds: Optional kinds registry to share with a lexer. Defaults to a new one.
+
+Returns:
+    A compiled DFA dict like fsm_compiler.compile_dfa, where the column of a token name is
+    its kind id, with one more key, kinds, that holds the registry
+
+Example Usage:
+    parser = compile_parser(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F)
+    tokens = lex_kinds(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, parser['kinds'])
+    stmts = parse_kinds(tokens, parser)
+"""
+def compile_parser(transitions, start, final_states, kinds=None):
+    if kinds is None:
+        kinds = new_kinds()
+    for state_transitions in transitions.values():
+        for state_transition in state_transitions:
+            for name in pattern_names(state_transition[0]):
+                intern_kind(kinds, name)
+
+    parser = compile_dfa(transitions, start, final_states, kinds['kinds'], first_match=True)
+    parser['kinds'] = kinds
+    return parser
+
+"""
+Returns the token names a pattern spells out, or an empty list if it is not a plain
+alternation of names.
+"""
+def pattern_names(pattern):
+    if re.match(r'^\w+(\|\w+)*$', pattern):
+        return pattern.split('|')
+    return []
+
+"""
+Lock for extending compiled parsers, see extend_parser.
+"""
+parsers_lock = threading.Lock()
+
+"""
+Adds table columns for kinds that were interned after a parser was compiled.
+
+Compiled parsers are shared between threads through cached_parser, so the rows are never
+changed in place. A wider copy of the table and columns is built under a lock and swapped in,
+and threads that are still parsing with the old table keep a consistent view of it.
+
+Returns:
+    The new table. Its rows have a column for every interned kind.
+"""
+def extend_parser(parser):
+    with parsers_lock:
+        names = parser['kinds']['kinds'][:]
+        table = parser['table']
+        width = len(table[parser['start']])
+        if width < len(names):
+            columns = dict(parser['columns'])
+            for kind in range(width, len(names)):
+                columns[names[kind]] = kind
+            table = [array('i', row) for row in table]
+            for row, state_patterns in zip(table, parser['patterns']):
+                row.extend(match_patterns(state_patterns, name, True) for name in names[width:])
+            parser['table'] = table
+            parser['columns'] = columns
+        return table
+
+"""
+Parses (kind id, value) tokens, like the ones from fsm_lexer.lex_kinds, with a compiled parser.
+
+Args:
+    tokens: An iterable of (kind id, value) tuples
+    parser: A compiled parser from compile_parser
+
+Returns:
+    A tuple of strings, the same ones parse would return for the named tokens
+"""
+def parse_kinds(tokens, parser):
+    return tuple(fsm_parser_compiled(tokens, parser, False))
+
+"""
+Compiled parsers of the tables used with parse and iter_parse, by id of the transitions dict.
+"""
+compiled_parsers = {}
+
+"""
+Returns the compiled parser for a table, compiling it on first use.
+
+The parser is compiled again if a state of transitions was added, removed or replaced since.
+Only the state tuples are compared, so states given as lists must not be changed in place.
+"""
+def cached_parser(transitions, start, final_states):
+    key = (start, final_states, tuple(transitions.items()))
+    cached = compiled_parsers.get(id(transitions))
+    if cached is None or cached[0] is not transitions or cached[1] != key:
+        if len(compiled_parsers) >= 64:
+            compiled_parsers.clear()
+        cached = (transitions, key, compile_parser(transitions, start, final_states))
+        compiled_parsers[id(transitions)] = cached
+    return cached[2]
+
+"""
+Generator version of fsm_parser that runs a compiled parser.
+
+Args:
+    tokens: An iterable of (name, value) or (kind id, value) tuples
+    parser: A compiled parser from compile_parser
+    named: If True tokens carry names, which are looked up in the kinds registry
+    empty: Empty value of the token values, '' for strings or b'' for bytes. Statements are
+        joined with it.
+    segments: If True every segment is yielded, including the ones without a statement. A
+        segment ends where the parser goes back to the start state.
+
+Yields:
+    Statements, strings or bytes like empty. With segments, (segment start, statement,
+    reset) tuples instead, with positions counted in tokens. The statement is None if the
+    segment has none. reset is the position where the next segment starts, or None for the
+    last segment.
+"""
+def fsm_parser_compiled(tokens, parser, named, empty='', segments=False):
+    table = parser['table']
+    final = parser['final']
+    start_state = parser['start']
+    kinds = parser['kinds']
+    kind_ids = kinds['kind_ids']
+    width = len(table[start_state])
+    state = start_state
+    segment_start = 0
+    current_stmt = []
+    accepted_stmt = None
+
+    for token in tokens:
+        if named:
+            kind = kind_ids.get(token[0])
+            if kind is None:
+                kind = intern_kind(kinds, token[0])
+        else:
+            kind = token[0]
+        if kind >= width:
+            table = extend_parser(parser)
+            width = len(table[start_state])
+
+        while True:
+            if final[state]:
+                accepted_stmt = empty.join(current_stmt)
+
+            next_state = table[state][kind]
+            if next_state >= 0:
+                current_stmt.append(token[1])
+                state = next_state
+                break
+            elif state == start_state and not current_stmt:
+                raise ValueError("No transition from start state %s for %r" % (parser['states'][start_state],
+                    kinds['kinds'][kind]))
+            else:
+                if segments:
+                    reset = segment_start + len(current_stmt)
+                    yield (segment_start, accepted_stmt or None, reset)
+                    segment_start = reset
+                elif accepted_stmt:
+                    yield accepted_stmt
+                accepted_stmt = None
+                current_stmt = []
+                state = start_state
+
+    if final[state]:
+        accepted_stmt = empty.join(current_stmt)
+    if segments:
+        yield (segment_start, accepted_stmt or None, None)
+    elif accepted_stmt:
+        yield accepted_stmt
 
 """
 The fsm_parser is called by the parse function.
@@ -63,6 +291,9 @@ Instead of going character by character, we go token by token.
 The other big difference is that fsm_parser will backtrack to the last accepted state 
 if the parser errors out before reaching another accepted state.
 
+The tokens are walked in a loop, see fsm_parser_tokens, so long token tuples do not hit the
+recursion limit. If the start state has no transition for a token a ValueError is raised.
+
 Args:
     tokens: A tuple of (name, value) tuples that you would get from using my fsm_lexer module
     token_index: Current index position in tokens tuple
@@ -74,31 +305,103 @@ Return:
     A dictionary with the following keys: stmts, current_stmt, accepted_stmt, start_state.
     The key of interest is the stmts list.
 """
-def fsm_parser(tokens, token_index, state, transitions, final_states, meta):  
+def fsm_parser(tokens, token_index, state, transitions, final_states, meta):
+    meta['stmts'].extend(fsm_parser_tokens(islice(tokens, token_index, None), state, transitions, final_states, meta))
+    return meta
+
+"""
+Generator version of fsm_parser that reads tokens from any iterable.
+
+Statements are yielded as soon as the parser errors out or the tokens run out.
+
+Args:
+    tokens: An iterable of (name, value) tuples
+    state: Start state
+    transitions: See example for transition structure
+    final_states: A tuple of accepting states
+    meta: A dictionary with the same keys as in fsm_parser. The stmts list is not used.
+
+Yields:
+    Strings
+"""
+def fsm_parser_tokens(tokens, state, transitions, final_states, meta):
+    start_state = meta['start_state']
+
+    for token in tokens:
+        while True:
+            if state in final_states:
+                meta['accepted_stmt'] = ''.join(meta['current_stmt'])
+
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                if re.match(state_transition[0], token[0]):
+                    next_state = state_transition[1]
+                    break
+
+            if next_state:
+                meta['current_stmt'].append(token[1])
+                state = next_state
+                break
+            elif state == start_state and not meta['current_stmt']:
+                raise ValueError("No transition from start state %s for %r" % (start_state, token[0]))
+            else:
+                if meta['accepted_stmt']:
+                    yield meta['accepted_stmt']
+                meta['accepted_stmt'] = None
+                meta['current_stmt'] = []
+                state = start_state
 
     if state in final_states:
         meta['accepted_stmt'] = ''.join(meta['current_stmt'])
+    if meta['accepted_stmt']:
+        yield meta['accepted_stmt']
+
+"""
+Same as fsm_parser_tokens, but counts state visits, transitions, regex attempts, resets and
+statements in a stats section. See fsm_stats.
+"""
+def fsm_parser_tokens_instrumented(tokens, state, transitions, final_states, meta, stats):
+    start_state = meta['start_state']
+    states = stats['states']
+    taken = stats['transitions']
+
+    for token in tokens:
+        stats['symbols'] += 1
+        while True:
+            if state in final_states:
+                meta['accepted_stmt'] = ''.join(meta['current_stmt'])
 
-    if token_index >= len(tokens):
-        if meta['accepted_stmt']:
-            meta['stmts'].append(meta['accepted_stmt'])
-        return meta
-
-    state_transitions = transitions[state]
-    next_state = None
-
-    for state_transition in state_transitions:
-        if re.match(state_transition[0], tokens[token_index][0]):
-            next_state = state_transition[1]
-            break
-
-    if next_state:
-        meta['current_stmt'].append(tokens[token_index][1])
-        token_index += 1
-        return fsm_parser(tokens, token_index, next_state, transitions, final_states, meta)
-    else:
-        if meta['accepted_stmt']:
-            meta['stmts'].append(meta['accepted_stmt'])
-        meta['accepted_stmt'] = None            
-        meta['current_stmt'] = []
-        return fsm_parser(tokens, token_index, meta['start_state'], transitions, final_states, meta)
+            states[state] = states.get(state, 0) + 1
+            state_transitions = transitions[state]
+            next_state = None
+
+            for state_transition in state_transitions:
+                stats['regex_attempts'] += 1
+                if re.match(state_transition[0], token[0]):
+                    next_state = state_transition[1]
+                    key = (state, state_transition[0])
+                    taken[key] = taken.get(key, 0) + 1
+                    break
+
+            if next_state:
+                meta['current_stmt'].append(token[1])
+                state = next_state
+                break
+            elif state == start_state and not meta['current_stmt']:
+                raise ValueError("No transition from start state %s for %r" % (start_state, token[0]))
+            else:
+                if meta['accepted_stmt']:
+                    stats['stmts'] += 1
+                    yield meta['accepted_stmt']
+                stats['resets'] += 1
+                meta['accepted_stmt'] = None
+                meta['current_stmt'] = []
+                state = start_state
+
+    if state in final_states:
+        meta['accepted_stmt'] = ''.join(meta['current_stmt'])
+    if meta['accepted_stmt']:
+        stats['stmts'] += 1
+        yield meta['accepted_stmt']
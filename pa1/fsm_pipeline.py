@@ -0,0 +1,36 @@
+from fsm_lexer import iter_lex
+from fsm_parser import iter_parse
+
+"""
+Fused lexer and parser pipeline.
+
+The lexer generator feeds each token straight into the parser as soon as it is finished, with
+the tokenize events applied inline. No token tuples are built in between, so the whole
+extraction is one linear pass over the input.
+
+Args:
+    source: A string, a file-like object, or an iterable of string chunks. See fsm_lexer.iter_lex.
+    lexer: A tuple of (start state, transitions, final states, tokenize events) for fsm_lexer
+    parser: A tuple of (start state, transitions, final states) for fsm_parser
+    stats: Optional stats dict from fsm_stats.new_stats to collect counts in
+
+Yields:
+    Statements, the same ones parse(lex(...)) would return
+
+Example Usage:
+    lexer = (pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+    parser = (pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+    for stmt in iter_lex_parse(string, lexer, parser):
+        print(stmt)
+"""
+def iter_lex_parse(source, lexer, parser, stats=None):
+    lexer_state, lexer_transitions, lexer_final_states, tokenize_events = lexer
+    parser_state, parser_transitions, parser_final_states = parser
+    tokens = iter_lex(source, lexer_state, lexer_transitions, lexer_final_states, tokenize_events, stats=stats)
+    return iter_parse(tokens, parser_state, parser_transitions, parser_final_states, stats=stats)
+
+"""
+Same as iter_lex_parse, but returns a tuple of statements like parse.
+"""
+def lex_parse(source, lexer, parser, stats=None):
+    return tuple(iter_lex_parse(source, lexer, parser, stats))
@@ -0,0 +1,140 @@
+import re
+
+from fsm_lexer import accept_token, tokenize
+
+"""
+Runs several lexer tables over the same text in one pass.
+
+The tables are combined into a product DFA whose states are tuples with one state of each
+table. A step of the product steps every table like fsm_lexer does: a table without a
+transition for the character ends its token and retries the character from its start state.
+Every product transition is therefore tagged with the tokens it ends, as (table, token name)
+pairs.
+
+The product is built lazily. A product state and its transition for a character are only
+computed the first time the text reaches them, and kept in a dict per state, so combinations
+of states that never occur together are never built. After warming up a step costs one
+dict lookup per character no matter how many tables there are.
+
+Every accepting product state is tagged with the set of (table, token name) pairs of the
+tables that are in an accepting state, see product_tags.
+
+Args:
+    lexers: A list of (start state, transitions, final states, tokenize events) tuples for
+        fsm_lexer, like pa1.lexer
+
+Returns:
+    A dict with the following keys:
+        lexers: The lexers argument
+        states: List of product states, tuples of table states. The position is the integer state.
+        index: Dict of product state to integer state
+        rows: List of dicts per integer state of character to (next integer state, ended tokens)
+        tags: Dict of integer state to a frozenset of (table, token name) pairs
+
+Example Usage:
+    product = product_lexer([pa1.lexer, dates.lexer, phones.lexer])
+    times, dates, phones = lex_product(string, product)
+"""
+def product_lexer(lexers):
+    product = {
+        'lexers': lexers,
+        'states': [],
+        'index': {},
+        'rows': [],
+        'tags': {},
+    }
+    product_state(product, tuple(lexer[0] for lexer in lexers))
+    return product
+
+"""
+Returns the integer state of a product state, adding it to the product if it is new.
+"""
+def product_state(product, states):
+    state = product['index'].get(states)
+    if state is None:
+        state = len(product['states'])
+        product['index'][states] = state
+        product['states'].append(states)
+        product['rows'].append({})
+        tags = frozenset((table, states[table]) for table, lexer in enumerate(product['lexers'])
+            if states[table] in lexer[2])
+        if tags:
+            product['tags'][state] = tags
+    return state
+
+"""
+Returns the set of (table, token name) pairs of the tables that are in an accepting state in
+an integer product state. The set is empty if no table is.
+"""
+def product_tags(product, state):
+    return product['tags'].get(state, frozenset())
+
+"""
+Computes the transition of an integer product state for a character.
+
+Raises a ValueError like fsm_lexer if a table has no transition from its start state.
+
+Returns:
+    A tuple of (next integer state, ended tokens), where ended tokens is a tuple of
+    (table, token name) pairs for the tables whose token ends before the character
+"""
+def product_step(product, state, char):
+    next_states = []
+    ended = []
+    for table, current in enumerate(product['states'][state]):
+        start, transitions, final_states = product['lexers'][table][:3]
+        next_state = table_step(transitions, current, char)
+        if not next_state:
+            if current == start:
+                raise ValueError("No transition from start state %s for %r" % (start, char))
+            ended.append((table, accept_token(current, '', final_states)[0]))
+            next_state = table_step(transitions, start, char)
+            if not next_state:
+                raise ValueError("No transition from start state %s for %r" % (start, char))
+        next_states.append(next_state)
+
+    step = (product_state(product, tuple(next_states)), tuple(ended))
+    product['rows'][state][char] = step
+    return step
+
+"""
+Returns the target of the first transition of a state that matches a character, or None.
+"""
+def table_step(transitions, state, char):
+    for state_transition in transitions[state]:
+        if re.match(state_transition[0], char):
+            return state_transition[1]
+    return None
+
+"""
+Lexes a string with every table of a product in one pass.
+
+Args:
+    string: String to be broken into tokens
+    product: A product from product_lexer
+
+Returns:
+    A tuple with one tuple of (name, value) tokens per table, the same as lex with that
+    table and its tokenize events
+"""
+def lex_product(string, product):
+    lexers = product['lexers']
+    rows = product['rows']
+    tokens = [[] for lexer in lexers]
+    token_starts = [0] * len(lexers)
+    state = 0
+
+    for index, char in enumerate(string):
+        step = rows[state].get(char)
+        if step is None:
+            step = product_step(product, state, char)
+        state, ended = step
+        for table, name in ended:
+            tokens[table].append((name, string[token_starts[table]:index]))
+            token_starts[table] = index
+
+    for table, lexer in enumerate(lexers):
+        final_token = accept_token(product['states'][state][table], string[token_starts[table]:], lexer[2])
+        tokens[table].append(final_token)
+
+    return tuple(tokenize(table_tokens, lexer[3]) for table_tokens, lexer in zip(tokens, lexers))
@@ -0,0 +1,466 @@
+import re
+import sys
+from bisect import bisect_right
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from fsm_minimize import hopcroft, escape_char
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+"""
+Compiles an ordered list of (TOKEN_NAME, regex) rules into one minimized lexer DFA.
+
+The regexes are parsed with Python's own regex parser, turned into a Thompson NFA, made
+deterministic by subset construction over character classes, and minimized with Hopcroft's
+algorithm. The result is a transitions table for lex, iter_lex and compile_dfa.
+
+Like most lexer generators, the longest match wins and if two rules match the same
+substring the rule listed first wins. The longest match is only found when the lexer falls
+back to the last accepting position, so use lex(..., backtrack=True). Plain lex and iter_lex
+never go back, so with rules for r'\\d+' and r'\\d+\\.\\d+' the text '1.' is an ERROR token
+there instead of a number and a dot. Tables whose tokens never need a step back, like the
+ones in the example, give the same tokens either way.
+
+Supported syntax: literals, escapes, character classes, \\d \\s \\w and their negations, '.',
+groups, alternation, and the *, +, ? and {m,n} repeats. Anchors, lookarounds,
+backreferences and flags raise a ValueError.
+
+Only one state of the table can be named after a token. Other states that accept the same
+token are named TOKEN#2, TOKEN#3 and so on, and the returned tokenize_events rename them back.
+Non accepting states are named q0, q1 and so on. The start state is q0.
+
+Args:
+    rules: Ordered list of (TOKEN_NAME, regex) tuples
+    tokenize_events: Optional dict of functions for specialized handling of tokens. These are
+        also applied to renamed tokens.
+
+Returns:
+    A tuple of (transitions, start, final_states, tokenize_events)
+
+Example Usage:
+    rules = (
+        ('SPACE', r' +'),
+        ('INT', r'[0-9]+'),
+        ('NAME', r'[a-z]+'),
+    )
+    transitions, start, final_states, tokenize_events = compile_lexer(rules, {'SPACE': tokenize_ignore})
+    tokens = lex('abc 123', start, transitions, final_states, tokenize_events, backtrack=True)
+"""
+def compile_lexer(rules, tokenize_events=None):
+    if tokenize_events is None:
+        tokenize_events = {}
+
+    nfa = {
+        'edges': [],
+        'epsilon': [],
+        'accept': {},
+    }
+    start = new_nfa_state(nfa)
+    for priority, rule in enumerate(rules):
+        name, regex = rule
+        begin, end = build_nfa(nfa, parse_regex(regex))
+        nfa['epsilon'][start].append(begin)
+        nfa['accept'][end] = (priority, name)
+
+    classes = char_classes(nfa)
+    delta, labels = subset_construction(nfa, start, len(classes))
+
+    if labels[0] is not None:
+        raise ValueError("Rule %s matches the empty string" % labels[0])
+
+    return dfa_to_table(delta, labels, classes, tokenize_events)
+
+"""
+Parses a regex with Python's regex parser and checks the flags. Invalid regexes raise a
+ValueError too.
+"""
+def parse_regex(regex):
+    try:
+        parsed = sre_parse.parse(regex)
+    except re.error as error:
+        raise ValueError("Invalid regex %r: %s" % (regex, error))
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    unsupported = (sre_constants.SRE_FLAG_IGNORECASE | sre_constants.SRE_FLAG_DOTALL |
+        sre_constants.SRE_FLAG_MULTILINE | sre_constants.SRE_FLAG_LOCALE |
+        getattr(sre_constants, 'SRE_FLAG_ASCII', 0))
+    if state.flags & unsupported:
+        raise ValueError("Flags are not supported in %r" % regex)
+    return parsed
+
+"""
+Adds a state to the NFA and returns its number.
+"""
+def new_nfa_state(nfa):
+    nfa['edges'].append([])
+    nfa['epsilon'].append([])
+    return len(nfa['edges']) - 1
+
+"""
+Thompson construction for a parsed regex.
+
+Character edges are stored as (intervals, target) where intervals is a sorted list of
+inclusive (low, high) code point ranges.
+
+Returns:
+    A tuple of the (begin, end) NFA states of the fragment
+"""
+def build_nfa(nfa, items):
+    begin = new_nfa_state(nfa)
+    end = begin
+    for op, av in items:
+        end = build_item(nfa, end, op, av)
+    return (begin, end)
+
+"""
+Builds one parsed regex item starting from NFA state begin and returns its end state.
+"""
+def build_item(nfa, begin, op, av):
+    if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+        end = new_nfa_state(nfa)
+        nfa['edges'][begin].append((item_intervals(op, av), end))
+        return end
+
+    if op == sre_constants.SUBPATTERN:
+        # Python 3.6+ gives (group, add flags, del flags, items), older versions (group, items)
+        if len(av) == 4 and (av[1] or av[2]):
+            raise ValueError("Flags are not supported in groups")
+        sub_begin, sub_end = build_nfa(nfa, av[-1])
+        nfa['epsilon'][begin].append(sub_begin)
+        return sub_end
+
+    if op == sre_constants.BRANCH:
+        end = new_nfa_state(nfa)
+        for branch in av[1]:
+            sub_begin, sub_end = build_nfa(nfa, branch)
+            nfa['epsilon'][begin].append(sub_begin)
+            nfa['epsilon'][sub_end].append(end)
+        return end
+
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        low, high, items = av
+        end = begin
+        for i in range(low):
+            sub_begin, sub_end = build_nfa(nfa, items)
+            nfa['epsilon'][end].append(sub_begin)
+            end = sub_end
+        if high == sre_constants.MAXREPEAT:
+            sub_begin, sub_end = build_nfa(nfa, items)
+            nfa['epsilon'][end].append(sub_begin)
+            nfa['epsilon'][sub_end].append(end)
+            return end
+        last = new_nfa_state(nfa)
+        nfa['epsilon'][end].append(last)
+        for i in range(high - low):
+            sub_begin, sub_end = build_nfa(nfa, items)
+            nfa['epsilon'][end].append(sub_begin)
+            nfa['epsilon'][sub_end].append(last)
+            end = sub_end
+        return last
+
+    raise ValueError("Unsupported regex syntax: %s" % op)
+
+"""
+Returns the sorted code point intervals matched by a single character regex item.
+"""
+def item_intervals(op, av):
+    if op == sre_constants.LITERAL:
+        return [(av, av)]
+    if op == sre_constants.NOT_LITERAL:
+        return complement_intervals([(av, av)])
+    if op == sre_constants.ANY:
+        return complement_intervals([(ord('\n'), ord('\n'))])
+
+    intervals = []
+    negate = False
+    for item_op, item_av in av:
+        if item_op == sre_constants.NEGATE:
+            negate = True
+        elif item_op == sre_constants.LITERAL:
+            intervals.append((item_av, item_av))
+        elif item_op == sre_constants.RANGE:
+            intervals.append(item_av)
+        elif item_op == sre_constants.CATEGORY:
+            intervals.extend(category_intervals(item_av))
+        else:
+            raise ValueError("Unsupported character class syntax: %s" % item_op)
+
+    intervals = merge_intervals(intervals)
+    if negate:
+        return complement_intervals(intervals)
+    return intervals
+
+category_regexes = {
+    sre_constants.CATEGORY_DIGIT: r'\d+',
+    sre_constants.CATEGORY_SPACE: r'\s+',
+    sre_constants.CATEGORY_WORD: r'\w+',
+}
+
+category_complements = {
+    sre_constants.CATEGORY_NOT_DIGIT: sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_NOT_SPACE: sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_WORD: sre_constants.CATEGORY_WORD,
+}
+
+category_cache = {}
+
+"""
+Returns the code point intervals of a category like \\d, using the same matching rules as re.
+
+The first call scans every character once for all categories and caches the intervals.
+"""
+def category_intervals(category):
+    if not category_cache:
+        characters = u''.join(map(unichr, range(sys.maxunicode + 1)))
+        for name, regex in category_regexes.items():
+            intervals = [(match.start(), match.end() - 1) for match in re.finditer(regex, characters)]
+            category_cache[name] = intervals
+        for name, complement in category_complements.items():
+            category_cache[name] = complement_intervals(category_cache[complement])
+
+    if category not in category_cache:
+        raise ValueError("Unsupported category: %s" % category)
+    return category_cache[category]
+
+"""
+Sorts intervals and merges the ones that overlap or touch.
+"""
+def merge_intervals(intervals):
+    merged = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
+
+"""
+Returns the intervals of all code points not in the given merged intervals.
+"""
+def complement_intervals(intervals):
+    complement = []
+    low = 0
+    for interval in intervals:
+        if interval[0] > low:
+            complement.append((low, interval[0] - 1))
+        low = interval[1] + 1
+    if low <= sys.maxunicode:
+        complement.append((low, sys.maxunicode))
+    return complement
+
+"""
+Splits the code points into classes of characters that no NFA edge tells apart.
+
+The intervals of every edge are cut into elementary intervals at all interval boundaries.
+Elementary intervals that are covered by exactly the same edges form one class. The
+intervals of each edge are then replaced by the list of class numbers it covers.
+
+Returns:
+    A list with the merged code point intervals of each class
+"""
+def char_classes(nfa):
+    points = set([0, sys.maxunicode + 1])
+    for edges in nfa['edges']:
+        for intervals, target in edges:
+            for low, high in intervals:
+                points.add(low)
+                points.add(high + 1)
+    boundaries = sorted(points)
+
+    signatures = [[] for i in range(len(boundaries) - 1)]
+    edge_number = 0
+    for edges in nfa['edges']:
+        for intervals, target in edges:
+            for low, high in intervals:
+                for elementary in range(bisect_right(boundaries, low) - 1, bisect_right(boundaries, high)):
+                    signatures[elementary].append(edge_number)
+            edge_number += 1
+
+    class_of = {}
+    elementary_class = []
+    classes = []
+    for elementary, signature in enumerate(signatures):
+        signature = tuple(signature)
+        if signature not in class_of:
+            class_of[signature] = len(classes)
+            classes.append([])
+        elementary_class.append(class_of[signature])
+        classes[class_of[signature]].append((boundaries[elementary], boundaries[elementary + 1] - 1))
+
+    for edges in nfa['edges']:
+        for i, edge in enumerate(edges):
+            covered = set()
+            for low, high in edge[0]:
+                for elementary in range(bisect_right(boundaries, low) - 1, bisect_right(boundaries, high)):
+                    covered.add(elementary_class[elementary])
+            edges[i] = (sorted(covered), edge[1])
+
+    return [merge_intervals(intervals) for intervals in classes]
+
+"""
+Subset construction over character classes.
+
+Returns:
+    A tuple of (delta, labels). delta is a list of rows with the next DFA state per class
+    or -1. labels has the token name each DFA state accepts or None. DFA state 0 is the start.
+"""
+def subset_construction(nfa, start, width):
+    closures = {}
+
+    def closure(states):
+        key = frozenset(states)
+        if key not in closures:
+            result = set(states)
+            stack = list(states)
+            while stack:
+                state = stack.pop()
+                for target in nfa['epsilon'][state]:
+                    if target not in result:
+                        result.add(target)
+                        stack.append(target)
+            closures[key] = frozenset(result)
+        return closures[key]
+
+    ids = {}
+    sets = []
+    delta = []
+    labels = []
+
+    def intern(states):
+        if states not in ids:
+            ids[states] = len(sets)
+            sets.append(states)
+            accepts = [nfa['accept'][state] for state in states if state in nfa['accept']]
+            labels.append(min(accepts)[1] if accepts else None)
+        return ids[states]
+
+    intern(closure([start]))
+    current = 0
+    while current < len(sets):
+        moves = {}
+        for state in sets[current]:
+            for classes, target in nfa['edges'][state]:
+                for char_class in classes:
+                    moves.setdefault(char_class, set()).add(target)
+        row = [-1] * width
+        for char_class, targets in moves.items():
+            row[char_class] = intern(closure(targets))
+        delta.append(row)
+        current += 1
+
+    return (delta, labels)
+
+"""
+Minimizes the DFA and writes it out as a transitions table with renaming tokenize_events.
+"""
+def dfa_to_table(delta, labels, classes, tokenize_events):
+    width = len(classes)
+    dead = len(delta)
+    delta = [[target if target >= 0 else dead for target in row] for row in delta]
+    delta.append([dead] * width)
+
+    blocks = {}
+    for state in range(dead + 1):
+        key = ('dead',) if state == dead else ('label', labels[state])
+        blocks.setdefault(key, set()).add(state)
+    partition = hopcroft(delta, range(dead + 1), list(blocks.values()), width)
+
+    block_of = {}
+    for number, block in enumerate(partition):
+        for state in block:
+            block_of[state] = number
+
+    names = {}
+    events = dict(tokenize_events)
+    counts = {}
+    non_accepting = 0
+    for number, block in enumerate(partition):
+        if dead in block:
+            continue
+        label = labels[min(block)]
+        if label is None:
+            names[number] = 'q%d' % non_accepting
+            non_accepting += 1
+        else:
+            counts[label] = counts.get(label, 0) + 1
+            if counts[label] == 1:
+                names[number] = label
+            else:
+                names[number] = '%s#%d' % (label, counts[label])
+                events[names[number]] = tokenize_rename(label, tokenize_events.get(label))
+
+    patterns = {}
+    transitions = {}
+    for number, block in enumerate(partition):
+        if dead in block:
+            continue
+        targets = {}
+        for char_class, target in enumerate(delta[min(block)]):
+            if block_of[target] in names:
+                targets.setdefault(block_of[target], []).append(char_class)
+        for target in targets:
+            key = tuple(targets[target])
+            if key not in patterns:
+                patterns[key] = classes_pattern(key, classes)
+        transitions[names[number]] = tuple(
+            (patterns[tuple(targets[target])], names[target])
+            for target in sorted(targets, key=lambda target: targets[target][0]))
+
+    final_states = tuple(names[number] for number in sorted(names) if labels[min(partition[number])] is not None)
+
+    return (transitions, names[block_of[0]], final_states, events)
+
+"""
+Builds a tokenize event that renames a token and then applies the event of the new name.
+"""
+def tokenize_rename(name, event=None):
+    def rename(token):
+        if event:
+            return event((name, token[1]))
+        return (name, token[1])
+    return rename
+
+"""
+Builds a regex character class for a list of class numbers.
+
+Uses a negated class if that is shorter.
+"""
+def classes_pattern(char_classes, classes):
+    return intervals_pattern(merge_intervals([interval for char_class in char_classes for interval in classes[char_class]]))
+
+"""
+Builds a regex character class for merged code point intervals.
+
+Uses a negated class if that is shorter.
+"""
+def intervals_pattern(intervals):
+    complement = complement_intervals(intervals)
+
+    if not complement:
+        return r'[\s\S]'
+    if len(intervals) == 1 and intervals[0][0] == intervals[0][1]:
+        return escape_char(unichr(intervals[0][0]))
+    if len(complement) < len(intervals):
+        return '[^%s]' % interval_ranges(complement)
+    return '[%s]' % interval_ranges(intervals)
+
+"""
+Writes code point intervals as the inside of a character class.
+"""
+def interval_ranges(intervals):
+    parts = []
+    for low, high in intervals:
+        if low == high:
+            parts.append(escape_char(unichr(low)))
+        elif low + 1 == high:
+            parts.append(escape_char(unichr(low)) + escape_char(unichr(high)))
+        else:
+            parts.append('%s-%s' % (escape_char(unichr(low)), escape_char(unichr(high))))
+    return ''.join(parts)
@@ -0,0 +1,158 @@
+import re
+
+from fsm_regex import build_nfa, complement_intervals, merge_intervals, parse_regex
+
+"""
+Profile guided reordering of transition patterns for first match tables.
+
+fsm_lexer and fsm_parser try the patterns of a state in order and stop at the first match,
+so putting the patterns that match most often first cuts the number of regex attempts.
+Two patterns only swap places if no symbol can match both, which keeps the first match
+semantics the same. Patterns that overlap keep their relative order.
+
+The hit counts come from the transitions of a stats section, see fsm_stats. Run the engine
+with stats on a sample corpus first.
+
+For tables over characters the exact set of characters each pattern matches is computed
+from the regex. Patterns that cannot be analyzed, for example ones with anchors, are
+treated as overlapping every other pattern and stay where they are relative to them. For
+tables over token names, like the ones for fsm_parser, the alphabet must list every token
+name and the patterns are compared on those names only.
+
+fsm uses the last matching pattern and always tries every pattern, so reordering does not
+help it. Neither does it help fsm_parser.parse and iter_parse, or any other engine built on
+a compiled table, since those look up every column without trying patterns in turn.
+
+Args:
+    transitions: See fsm module for transitions structure
+    counts: Dict of (state, pattern) to hit count, like stats['lexer']['transitions']
+    alphabet: Optional iterable of token names for tables over token names
+
+Returns:
+    A new transitions dict
+
+Example Usage:
+    stats = new_stats()
+    lex(sample, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, stats=stats)
+    transitions = reorder_transitions(pa1.lexer_transitions, stats['lexer']['transitions'])
+    tokens = lex(string, pa1.lexer_q0, transitions, pa1.lexer_F, pa1.tokenize_events)
+"""
+def reorder_transitions(transitions, counts, alphabet=None):
+    if alphabet is not None:
+        alphabet = list(alphabet)
+
+    match_sets = {}
+    new_transitions = {}
+    for state, state_transitions in transitions.items():
+        for state_transition in state_transitions:
+            pattern = state_transition[0]
+            if pattern not in match_sets:
+                match_sets[pattern] = pattern_symbols(pattern, alphabet)
+
+        hits = [counts.get((state, state_transition[0]), 0) for state_transition in state_transitions]
+        order = reorder(hits, [match_sets[state_transition[0]] for state_transition in state_transitions])
+        new_transitions[state] = tuple(state_transitions[i] for i in order)
+
+    return new_transitions
+
+"""
+Orders the patterns of one state, hottest first, without moving a pattern past an earlier
+pattern it overlaps with.
+
+Args:
+    hits: Hit count per pattern
+    match_sets: Match set per pattern from pattern_symbols
+
+Returns:
+    A list of pattern positions in the new order
+"""
+def reorder(hits, match_sets):
+    count = len(hits)
+    before = [set(j for j in range(i) if overlaps(match_sets[i], match_sets[j])) for i in range(count)]
+
+    order = []
+    placed = set()
+    while len(order) < count:
+        ready = [i for i in range(count) if i not in placed and before[i] <= placed]
+        best = max(ready, key=lambda i: (hits[i], -i))
+        order.append(best)
+        placed.add(best)
+    return order
+
+"""
+Matches the start of an inline flag group, like (?i) or (?a:...). Escaped parentheses can
+match too, which only makes a pattern count as not analyzable.
+"""
+inline_flags = re.compile(r'\(\?[aiLmsux-]')
+
+"""
+Returns the symbols a pattern matches when it is given a single symbol.
+
+Character patterns are matched with re.match on one character, so the pattern matches a
+character if it matches that character or the empty string. Patterns with inline flags, like
+(?i:a), are never analyzed, since the character sets would not follow the flags.
+
+Returns:
+    A frozenset of token names if an alphabet is given, a list of code point intervals for
+    character patterns, or None if the pattern cannot be analyzed
+"""
+def pattern_symbols(pattern, alphabet):
+    if alphabet is not None:
+        return frozenset(symbol for symbol in alphabet if re.match(pattern, symbol))
+    if inline_flags.search(pattern):
+        return None
+
+    nfa = {
+        'edges': [],
+        'epsilon': [],
+        'accept': {},
+    }
+    try:
+        begin, end = build_nfa(nfa, parse_regex(pattern))
+    except (ValueError, re.error):
+        return None
+
+    closure = nfa_closure(nfa, (begin,))
+    if end in closure:
+        return complement_intervals([])
+
+    intervals = []
+    for state in closure:
+        for edge_intervals, target in nfa['edges'][state]:
+            if end in nfa_closure(nfa, (target,)):
+                intervals.extend(edge_intervals)
+    return merge_intervals(intervals)
+
+"""
+Returns the set of NFA states reachable from the given states using only epsilon moves.
+"""
+def nfa_closure(nfa, states):
+    closure = set(states)
+    stack = list(states)
+    while stack:
+        state = stack.pop()
+        for target in nfa['epsilon'][state]:
+            if target not in closure:
+                closure.add(target)
+                stack.append(target)
+    return closure
+
+"""
+Returns True unless two match sets from pattern_symbols are known to be disjoint.
+"""
+def overlaps(first, second):
+    if first is None or second is None:
+        return True
+    if isinstance(first, frozenset):
+        return bool(first & second)
+
+    i = 0
+    j = 0
+    while i < len(first) and j < len(second):
+        if first[i][1] < second[j][0]:
+            i += 1
+        elif second[j][1] < first[i][0]:
+            j += 1
+        else:
+            return True
+    return False
@@ -0,0 +1,105 @@
+import json
+
+"""
+Instrumentation for fsm, fsm_lexer and fsm_parser.
+
+Pass the dict from new_stats as the stats argument of fsm, lex, iter_lex, parse or iter_parse
+and the engines fill it in. Without a stats argument the engines run their normal loops, so
+instrumentation costs nothing when it is not used.
+
+The stats dict has one section per engine: fsm, lexer and parser. Each section has the
+following keys:
+
+    calls: Number of calls
+    time: Wall time in seconds. Not measured by the generators iter_lex and iter_parse.
+    symbols: Number of characters or tokens read
+    states: Dict of state to number of symbols read in that state
+    transitions: Dict of (state, pattern) to number of times the transition was taken
+    regex_attempts: Number of re.match calls
+    tokens: Number of tokens produced by the lexer, before tokenize events
+    error_tokens: Number of ERROR tokens produced by the lexer
+    resets: Number of times the parser went back to the start state
+    stmts: Number of statements produced by the parser
+
+The backtracking lexer only counts calls, time and tokens.
+
+Example Usage:
+    stats = new_stats()
+    tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, stats=stats)
+    stmts = parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F, stats=stats)
+    print(stats_report(stats))
+"""
+def new_stats():
+    return {
+        'fsm': new_section(),
+        'lexer': new_section(),
+        'parser': new_section(),
+    }
+
+"""
+Returns an empty stats section. See new_stats.
+"""
+def new_section():
+    return {
+        'calls': 0,
+        'time': 0.0,
+        'symbols': 0,
+        'states': {},
+        'transitions': {},
+        'regex_attempts': 0,
+        'tokens': 0,
+        'error_tokens': 0,
+        'resets': 0,
+        'stmts': 0,
+    }
+
+"""
+Returns a readable report of a stats dict from new_stats.
+
+Args:
+    stats: Stats dict
+    top: Number of hottest states and transitions to list per section
+
+Returns:
+    A string
+"""
+def stats_report(stats, top=10):
+    lines = []
+    for name in ('fsm', 'lexer', 'parser'):
+        section = stats[name]
+        if not section['calls']:
+            continue
+        lines.append('%s: %d calls, %.4fs, %d symbols, %d regex attempts (%.2f per symbol)' % (name,
+            section['calls'], section['time'], section['symbols'], section['regex_attempts'],
+            section['regex_attempts'] / float(max(section['symbols'], 1))))
+        if name == 'lexer':
+            lines.append('  %d tokens, %d ERROR tokens' % (section['tokens'], section['error_tokens']))
+        elif name == 'parser':
+            lines.append('  %d stmts, %d resets' % (section['stmts'], section['resets']))
+
+        lines.append('  hottest states')
+        for state, count in hottest(section['states'], top):
+            lines.append('    %10d  %s' % (count, state))
+        lines.append('  hottest transitions')
+        for (state, pattern), count in hottest(section['transitions'], top):
+            lines.append('    %10d  %s %r' % (count, state, pattern))
+    return '\n'.join(lines)
+
+"""
+Returns the top (key, count) pairs of a dict of counts, highest count first.
+"""
+def hottest(counts, top):
+    return sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:top]
+
+"""
+Writes a stats dict from new_stats to a file as JSON.
+
+Transitions are written as lists of [state, pattern, count] since JSON keys must be strings.
+"""
+def dump_stats(stats, output):
+    result = {}
+    for name, section in stats.items():
+        result[name] = dict(section)
+        result[name]['transitions'] = [[state, pattern, count]
+            for (state, pattern), count in hottest(section['transitions'], None)]
+    json.dump(result, output, indent=2, sort_keys=True)
@@ -1,5 +1,5 @@
-from fsm_lexer import lex, tokenize_ignore
-from fsm_parser import parse
+from fsm_lexer import tokenize_ignore
+from fsm_pipeline import lex_parse
 
 """
 Time Parser Automaton DFA 5-tuple
@@ -217,6 +217,18 @@ parser_transitions = {
 
 parser_F = ('C', 'H', 'I', 'J', 'L')
 
+lexer = (lexer_q0, lexer_transitions, lexer_F, tokenize_events)
+
+parser = (parser_q0, parser_transitions, parser_F)
+
+"""
+Extracts times from a string or file-like object in one pass.
+
+Returns:
+    A tuple of time strings
+"""
+def extract_times(source):
+    return lex_parse(source, lexer, parser)
+
 if __name__ == '__main__':
-    tokens = lex(string, lexer_q0, lexer_transitions, lexer_F, tokenize_events)
-    print parse(tokens, parser_q0, parser_transitions, parser_F)
+    print(extract_times(string))
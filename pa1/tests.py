@@ -1,9 +1,43 @@
-from fsm_lexer import lex, tokenize_ignore
-from fsm_parser import parse
+from fsm_lexer import lex, lex_kinds, iter_lex, lex_spans, span_tokens, span_value, tokenize_ignore
+from fsm_parser import parse, iter_parse, compile_parser, parse_kinds, fsm_parser
 from fsm import fsm
+from fsm_compiler import compile_dfa, fsm_compiled, next_state
+import fsm_batch
+from fsm_binary import cached_dfa, load_dfa, source_key, write_dfa
+from fsm_bytes import byte_tokens, compile_byte_lexer, compile_bytes, fsm_bytes, lex_bytes, parse_bytes
+from fsm_cache import new_cache, cached_lex_parse, cache_info, clear_cache
+from fsm_classes import compile_classes
+from fsm_codegen import codegen, table_hash
+import fsm_codegen
+from fsm_corpus import extract_corpus, find_files, write_jsonl
+from fsm_incremental import new_document, edit_document
+from fsm_master import compile_master, lex_master
+from fsm_memo import lex_memo, memo_info, new_memo
+from fsm_minimize import minimize
+from fsm_nfa import lazy_dfa, fsm_lazy
+from fsm_product import product_lexer, lex_product, product_tags
+from fsm_parallel import fsm_parallel, fsm_parallel_numpy
+from fsm_regex import compile_lexer
+from fsm_stats import new_stats, stats_report, dump_stats
+from fsm_reorder import reorder_transitions
+from fsm_pipeline import lex_parse
 import pa1
+import io
+import json
+import mmap
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
 
+try:
+    unichr
+except NameError:
+    unichr = chr
+
 class TestFSM(unittest.TestCase):
 
     def test_simple(self):
@@ -254,6 +288,970 @@ class TestFSM(unittest.TestCase):
         result = fsm(fail_string2, start_state, transitions, final_states)
         self.assertFalse(result)
 
+    def test_long_string(self):
+        transitions = {
+            'A': (
+                ('0', 'A'),
+                ('1', 'B'),
+            ),
+            'B': (
+                ('0', 'A'),
+                ('1', 'B'),
+            ),
+        }
+        self.assertTrue(fsm('01' * 50000, 'A', transitions, ('B')))
+        self.assertFalse(fsm('01' * 50000 + '2', 'A', transitions, ('B')))
+
+class TestCompiledFSM(unittest.TestCase):
+
+    def test_matches_fsm(self):
+        start_state = 'A'
+        transitions = {
+            'A': (
+                ('0', 'A'),
+                ('1', 'B'),
+            ),
+            'B': (
+                ('0', 'A'),
+                ('1', 'C')
+            ),
+            'C': (
+                ('0', 'D'),
+                ('1', 'C')
+            ),
+            'D': (
+                (r"[01]", 'D'),
+            ),
+        }
+        final_states = ('C')
+
+        dfa = compile_dfa(transitions, start_state, final_states)
+        for length in range(8):
+            for number in range(2 ** length):
+                string = format(number, 'b').zfill(length) if length else ''
+                self.assertEqual(fsm_compiled(string, dfa), fsm(string, start_state, transitions, final_states))
+        self.assertFalse(fsm_compiled('0012', dfa))
+
+    def test_last_match_wins(self):
+        transitions = {
+            'A': (
+                (r'[ab]', 'W'),
+                ('b', 'X'),
+            ),
+            'W': (),
+            'X': (),
+        }
+        dfa = compile_dfa(transitions, 'A', ('X'))
+        self.assertTrue(fsm_compiled('b', dfa))
+        self.assertFalse(fsm_compiled('a', dfa))
+
+    def test_fallback_outside_alphabet(self):
+        transitions = {
+            'A': ((r'[^ ]', 'A'),),
+        }
+        dfa = compile_dfa(transitions, 'A', ('A'), alphabet='ab ')
+        self.assertTrue(fsm_compiled(u'ab\u00e9c', dfa))
+        self.assertFalse(fsm_compiled('a b', dfa))
+
+    def test_character_classes(self):
+        dfa = compile_dfa(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+        classes = compile_classes(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+        self.assertLess(len(classes['table'][0]), 32)
+        self.assertEqual(classes['class_of'][ord('6')], classes['class_of'][ord('9')])
+
+        generator = random.Random(3)
+        alphabet = u'0123456789:apmAPMto .-,!\u00e9\u0435\u4e2d'
+        for i in range(2000):
+            string = u''.join(generator.choice(alphabet) for j in range(generator.randint(0, 8)))
+            self.assertEqual(fsm_compiled(string, classes), fsm_compiled(string, dfa))
+
+        state = next_state(classes, classes['start'], u'\u4e2d')
+        self.assertEqual(classes['states'][state], 'NOT_TOKEN')
+
+    def test_character_classes_errors(self):
+        with self.assertRaises(ValueError):
+            compile_classes({'A': (('a$', 'A'),)}, 'A', ('A',))
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'scoped flags need Python 3.6')
+    def test_character_classes_flags(self):
+        # (?i:a) matches A too, which the character sets of the pattern do not show
+        transitions = {'A': (('(?i:a)', 'B'),), 'B': ()}
+        self.assertTrue(fsm('A', 'A', transitions, ('B',)))
+        self.assertRaises(ValueError, compile_classes, transitions, 'A', ('B',))
+
+        master = compile_master(transitions, 'A', ('B',))
+        self.assertEqual(master['regex'], None)
+        self.assertEqual(lex_master('aA', master, {}), lex('aA', 'A', transitions, ('B',), {}))
+
+class TestBinaryDFA(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'lexer.fsm')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        expected = compile_dfa(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+        dfa = cached_dfa(self.path, pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+        self.assertEqual(dfa['states'], expected['states'])
+        self.assertEqual(dfa['final'], expected['final'])
+        self.assertEqual(dfa['start'], expected['start'])
+        self.assertTrue(dfa['first_match'])
+        self.assertEqual([list(row) for row in dfa['table']], [list(row) for row in expected['table']])
+        self.assertEqual(next_state(dfa, 0, u'\u00e9'), next_state(expected, 0, u'\u00e9'))
+        self.assertEqual(dfa['columns'], expected['columns'])
+        self.assertEqual(set(type(symbol) for symbol in dfa['columns']), set(type(symbol) for symbol in expected['columns']))
+
+        parser = compile_dfa(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F, alphabet=('AT', 'TO', u'\u4e2d'))
+        write_dfa(self.path, parser, source_key(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F))
+        self.assertEqual(load_dfa(self.path)['columns'], parser['columns'])
+
+    def test_stale_file(self):
+        cached_dfa(self.path, pa1.parser_transitions, pa1.parser_q0, pa1.parser_F)
+        key = source_key(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+        self.assertRaises(ValueError, load_dfa, self.path, key)
+
+        dfa = cached_dfa(self.path, pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+        self.assertEqual(len(dfa['states']), len(pa1.lexer_transitions))
+        self.assertEqual(load_dfa(self.path, key)['states'], dfa['states'])
+
+    def test_character_classes(self):
+        expected = compile_classes(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, first_match=True)
+        write_dfa(self.path, expected, source_key(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F))
+        dfa = load_dfa(self.path)
+        self.assertEqual([list(row) for row in dfa['table']], [list(row) for row in expected['table']])
+        self.assertEqual(list(dfa['class_of']), list(expected['class_of']))
+        self.assertEqual(dfa['class_ranges'], expected['class_ranges'])
+        self.assertEqual(dfa['columns'], expected['columns'])
+
+        # A loaded DFA can be written again
+        write_dfa(self.path + '.copy', dfa, source_key(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F))
+        self.assertEqual(list(load_dfa(self.path + '.copy')['class_of']), list(expected['class_of']))
+        for string in (u'at 5pm', u'12:30 \u4e2d', u'x'):
+            self.assertEqual(fsm_compiled(string, dfa), fsm_compiled(string, expected))
+
+@unittest.skipIf(fsm_batch.numpy is None, 'numpy is not installed')
+class TestFSMBatch(unittest.TestCase):
+
+    def test_matches_fsm(self):
+        start_state = 'A'
+        transitions = {
+            'A': (
+                ('0', 'D'),
+                ('1', 'B'),
+            ),
+            'D': (
+                (r"[01]", 'D'),
+            ),
+            'B': (
+                ('0', 'C'),
+                ('1', 'B'),
+            ),
+            'C': (
+                ('0', 'C'),
+                ('1', 'B'),
+            )
+        }
+        final_states = ('C')
+
+        strings = ['']
+        for length in range(1, 9):
+            strings.extend(format(number, 'b').zfill(length) for number in range(2 ** length))
+        strings.extend(['102', '10', u'10\u00e9', '1' * 50 + '0'])
+
+        dfa = compile_dfa(transitions, start_state, final_states)
+        result = fsm_batch.fsm_batch(strings, dfa)
+        self.assertEqual(len(result), len(strings))
+        for string, accepted in zip(strings, result):
+            self.assertEqual(bool(accepted), fsm(string, start_state, transitions, final_states))
+
+class TestCodegen(unittest.TestCase):
+
+    def test_fsm(self):
+        start_state = 'A'
+        transitions = {
+            'A': (
+                ('0', 'A'),
+                ('1', 'B'),
+            ),
+            'B': (
+                (r'[01]', 'A'),
+                ('1', 'C')
+            ),
+            'C': (
+                (r'[^0]', 'C'),
+            ),
+        }
+        final_states = ('C')
+
+        generated = codegen(transitions, start_state, final_states)
+        strings = ['', '012', u'011\u00e9']
+        for length in range(1, 8):
+            strings.extend(format(number, 'b').zfill(length) for number in range(2 ** length))
+        for string in strings:
+            self.assertEqual(generated(string), fsm(string, start_state, transitions, final_states))
+
+    def test_lex_and_parse(self):
+        lex_pa1 = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex')
+        parse_pa1 = codegen(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F, 'parse')
+        for string in (pa1.string, 'at 5:30pm-- x', '12:4'):
+            tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            self.assertEqual(lex_pa1(string, pa1.tokenize_events), tokens)
+            self.assertEqual(parse_pa1(tokens), parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F))
+
+        lex_a = codegen({'A': (('a', 'W'),), 'W': ()}, 'A', ('W',), 'lex')
+        self.assertEqual(lex_a('aa', {}), (('W', 'a'), ('W', 'a')))
+        self.assertRaises(ValueError, lex_a, 'ab', {})
+
+    def test_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            first = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex', cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            second = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex', cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(first(pa1.string, pa1.tokenize_events), second(pa1.string, pa1.tokenize_events))
+
+            version = fsm_codegen.GENERATOR_VERSION
+            key = table_hash(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex')
+            fsm_codegen.GENERATOR_VERSION = version + 1
+            try:
+                self.assertNotEqual(table_hash(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex'), key)
+            finally:
+                fsm_codegen.GENERATOR_VERSION = version
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_cache_dir_threads(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            expected = lex(pa1.string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            results = []
+
+            def work():
+                lex_pa1 = codegen(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, 'lex', cache_dir)
+                results.append(lex_pa1(pa1.string, pa1.tokenize_events))
+
+            threads = [threading.Thread(target=work) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(results, [expected] * 8)
+            self.assertEqual([name for name in os.listdir(cache_dir) if not name.endswith('.py')], [])
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestStats(unittest.TestCase):
+
+    def test_fsm(self):
+        transitions = {
+            'A': (
+                ('0', 'A'),
+                ('1', 'B'),
+            ),
+            'B': (
+                (r'[01]', 'B'),
+            ),
+        }
+        stats = new_stats()
+        self.assertTrue(fsm('0011', 'A', transitions, ('B'), stats))
+        self.assertFalse(fsm('02', 'A', transitions, ('B'), stats))
+        self.assertEqual(stats['fsm']['calls'], 2)
+        self.assertEqual(stats['fsm']['states'], {'A': 5, 'B': 1})
+        self.assertEqual(stats['fsm']['transitions'], {('A', '0'): 3, ('A', '1'): 1, ('B', r'[01]'): 1})
+        self.assertEqual(stats['fsm']['regex_attempts'], 11)
+
+    def test_lex_and_parse(self):
+        string = 'Lunch is from 12:30 to 1:5 pm, then 1800.'
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        stmts = parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+
+        stats = new_stats()
+        self.assertEqual(lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F,
+            pa1.tokenize_events, stats=stats), tokens)
+        self.assertEqual(parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F, stats), stmts)
+        self.assertEqual(stats['lexer']['symbols'], len(string))
+        # Every token but the last ends on a character that is read again from the start state
+        self.assertEqual(sum(stats['lexer']['states'].values()), len(string) + stats['lexer']['tokens'] - 1)
+        self.assertEqual(stats['lexer']['error_tokens'], 6)
+        self.assertEqual(stats['parser']['symbols'], len(tokens))
+        self.assertEqual(stats['parser']['stmts'], len(stmts))
+        self.assertTrue(stats['parser']['resets'] > 0)
+
+        pipeline_stats = new_stats()
+        self.assertEqual(lex_parse(string, pa1.lexer, pa1.parser, pipeline_stats), stmts)
+        self.assertEqual(pipeline_stats['lexer']['transitions'], stats['lexer']['transitions'])
+        self.assertEqual(pipeline_stats['parser']['transitions'], stats['parser']['transitions'])
+
+        self.assertTrue('6 ERROR tokens' in stats_report(stats))
+        output = io.StringIO() if str is not bytes else io.BytesIO()
+        dump_stats(stats, output)
+        self.assertTrue(output.getvalue())
+
+class TestReorder(unittest.TestCase):
+
+    def test_disjoint_patterns_move(self):
+        transitions = {
+            'A': (
+                (r'[a-c]', 'B'),
+                (r'\d', 'C'),
+                (r'[^x]', 'D'),
+                ('0', 'E'),
+                ('$', 'F'),
+            ),
+        }
+        counts = {('A', '0'): 50, ('A', r'\d'): 10, ('A', '[^x]'): 20}
+        new_transitions = reorder_transitions(transitions, counts)
+        # \d and [a-c] are disjoint so \d moves up. [^x] overlaps both and 0 overlaps \d and
+        # [^x], so those keep their order. $ cannot be analyzed and stays last.
+        self.assertEqual([pattern for pattern, state in new_transitions['A']],
+            [r'\d', r'[a-c]', '[^x]', '0', '$'])
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'scoped flags need Python 3.6')
+    def test_flags_overlap(self):
+        # (?i:a) also matches A, so A must not move before it
+        transitions = {
+            'S': (
+                ('(?i:a)', 'X'),
+                ('A', 'Y'),
+            ),
+            'X': (),
+            'Y': (),
+        }
+        new_transitions = reorder_transitions(transitions, {('S', 'A'): 10})
+        self.assertEqual(new_transitions['S'], transitions['S'])
+        self.assertEqual(lex('A', 'S', new_transitions, ('X', 'Y'), {}), (('X', 'A'),))
+
+    def test_pa1_tables(self):
+        stats = new_stats()
+        tokens = lex(pa1.string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, stats=stats)
+        parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F, stats)
+        names = set(token[0] for token in tokens) | set(['TO', 'DASH'])
+        lexer_transitions = reorder_transitions(pa1.lexer_transitions, stats['lexer']['transitions'])
+        parser_transitions = reorder_transitions(pa1.parser_transitions, stats['parser']['transitions'], names)
+        self.assertEqual(lexer_transitions['A'][0], (' ', 'SPACE'))
+
+        for string in (pa1.string, 'from 1-2 PM to 12:30 am, at 1800 or 9 to 5; 16:9 -.', u'caf\u00e9 at 5'):
+            tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            self.assertEqual(lex(string, pa1.lexer_q0, lexer_transitions, pa1.lexer_F, pa1.tokenize_events), tokens)
+            self.assertEqual(parse(tokens, pa1.parser_q0, parser_transitions, pa1.parser_F),
+                parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F))
+
+class TestCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        strings = (pa1.string, u'Lunch is from 12:30 to 1:30 pm.', u'Nothing here', u'At 1800 or 9 to 5')
+        for number, string in enumerate(strings * 3):
+            with io.open(os.path.join(self.directory, 'message_%02d.txt' % number), 'w', encoding='utf-8') as output:
+                output.write(u'' + string)
+        with open(os.path.join(self.directory, 'message_99.txt'), 'wb') as output:
+            output.write(b'\xff\xfe')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_extract(self):
+        paths = find_files(self.directory, '*.txt')
+        results = list(extract_corpus(paths, processes=1))
+        self.assertEqual([result['path'] for result in results], paths)
+        self.assertEqual(results[0]['times'], list(pa1.extract_times(pa1.string)))
+        self.assertTrue('error' in results[-1])
+
+        self.assertEqual(list(extract_corpus(paths, processes=2, chunk_size=5)), results)
+        unordered = extract_corpus(paths, processes=2, chunk_size=5, ordered=False)
+        self.assertEqual(sorted(unordered, key=lambda result: result['path']), results)
+
+        output = os.path.join(self.directory, 'times.jsonl')
+        self.assertEqual(write_jsonl(results, output, buffer_lines=4), len(results))
+        with io.open(output, encoding='utf-8') as lines:
+            self.assertEqual([json.loads(line) for line in lines], results)
+
+    def test_cache_dir(self):
+        paths = find_files(self.directory, '*.txt')
+        cache_dir = tempfile.mkdtemp()
+        try:
+            results = extract_corpus(paths, processes=2, chunk_size=5, cache_dir=cache_dir)
+            self.assertEqual(next(results)['times'], list(pa1.extract_times(pa1.string)))
+            self.assertEqual(sorted(name.split('_')[1] for name in os.listdir(cache_dir)), ['lex', 'parse'])
+            self.assertEqual(len(list(results)), len(paths) - 1)
+            self.assertEqual(list(extract_corpus(paths, processes=1, cache_dir=cache_dir)),
+                list(extract_corpus(paths, processes=1)))
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestFSMParallel(unittest.TestCase):
+
+    def test_matches_fsm(self):
+        transitions = {
+            'A': (
+                ('0', 'D'),
+                ('1', 'B'),
+            ),
+            'D': (
+                (r"[01]", 'D'),
+            ),
+            'B': (
+                ('0', 'C'),
+                ('1', 'B'),
+            ),
+            'C': (
+                ('0', 'C'),
+                ('1', 'B'),
+            )
+        }
+        dfa = compile_dfa(transitions, 'A', ('C'))
+
+        strings = ['', '10', '102', u'10\u00e9', '1' * 50 + '0', '0' + '1' * 50 + '0']
+        for length in range(1, 9):
+            strings.extend(format(number, 'b').zfill(length) for number in range(2 ** length))
+        for string in strings:
+            expected = fsm(string, 'A', transitions, ('C'))
+            for chunk_count in (1, 3, 16):
+                self.assertEqual(fsm_parallel(string, dfa, processes=1, chunk_count=chunk_count), expected)
+                if fsm_batch.numpy is not None:
+                    self.assertEqual(bool(fsm_parallel_numpy(string, dfa, chunk_count=chunk_count)), expected)
+
+        string = '1' * 1000 + '0' * 1000
+        self.assertTrue(fsm_parallel(string, dfa, processes=2))
+        self.assertFalse(fsm_parallel(string + '2', dfa, processes=2))
+
+class TestIncremental(unittest.TestCase):
+
+    def assertSameResults(self, document):
+        tokens = lex(document['string'], pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        self.assertEqual(tuple(document['tokens']), tokens)
+        self.assertEqual(tuple(document['stmts']), parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F))
+
+    def test_edits(self):
+        document = new_document('', pa1.lexer, pa1.parser)
+        self.assertSameResults(document)
+        edits = [
+            (0, 0, 'Meet at 10 or 11am'),
+            (8, 10, '12:30'),
+            (11, 11, 'pm'),
+            (0, 0, 'Call from 2 to 3 pm. '),
+            (21, 25, 'Dinner'),
+            (5, 20, ''),
+            (0, 7, ''),
+        ]
+        for start, end, new_text in edits:
+            document = edit_document(document, start, end, new_text)
+            self.assertSameResults(document)
+
+        document = edit_document(document, 0, len(document['string']), '')
+        self.assertEqual(document['string'], '')
+        self.assertSameResults(document)
+
+    def test_random_edits(self):
+        generator = random.Random(7)
+        alphabet = '0123456789:apmAPMt .-toTO\n,x!'
+        for trial in range(50):
+            string = ''.join(generator.choice(alphabet) for i in range(generator.randint(0, 40)))
+            document = new_document(string, pa1.lexer, pa1.parser)
+            for edit in range(10):
+                start = generator.randint(0, len(document['string']))
+                end = generator.randint(start, min(len(document['string']), start + 5))
+                new_text = ''.join(generator.choice(alphabet) for i in range(generator.randint(0, 4)))
+                document = edit_document(document, start, end, new_text)
+                self.assertSameResults(document)
+
+    def test_local_work(self):
+        string = 'Lunch at 12:15pm then a call from 2 to 3:30 PM, dinner at 7 p.m. or 8pm. ' * 100
+        document = new_document(string, pa1.lexer, pa1.parser)
+        middle = len(string) // 2
+        document = edit_document(document, middle, middle, '5pm ')
+        self.assertSameResults(document)
+        self.assertLess(document['relexed'], 10)
+        self.assertLess(document['reparsed'], 10)
+
+    def test_errors(self):
+        document = new_document('5pm', pa1.lexer, pa1.parser)
+        with self.assertRaises(ValueError):
+            edit_document(document, 2, 4, '')
+
+        lexer = ('A', {'A': (('a', 'B'),), 'B': (('a', 'B'),)}, ('B',), {})
+        parser = ('A', {'A': (('B', 'A'),)}, ('A',))
+        document = new_document('aaa', lexer, parser)
+        with self.assertRaises(ValueError):
+            edit_document(document, 1, 1, 'b')
+        self.assertEqual(document['string'], 'aaa')
+        self.assertEqual(edit_document(document, 1, 2, '')['tokens'], [('B', 'aa')])
+
+class TestProduct(unittest.TestCase):
+
+    def setUp(self):
+        transitions, start, final_states, tokenize_events = compile_lexer([
+            ('DATE', r'\d\d?/\d\d?'),
+            ('NUMBER', r'\d+'),
+            ('OTHER', r'[^\d/]+'),
+            ('SLASH', '/'),
+        ], {'OTHER': tokenize_ignore})
+        self.lexers = [pa1.lexer, (start, transitions, final_states, tokenize_events)]
+
+    def test_same_tokens(self):
+        product = product_lexer(self.lexers)
+        strings = ['', '3/14 at 5pm', 'from 10:30 to 11am on 12/1/', '//9', 'Call at 7-8 p.m. 1/2 ' * 20]
+        for string in strings:
+            expected = tuple(lex(string, *lexer) for lexer in self.lexers)
+            self.assertEqual(lex_product(string, product), expected)
+
+    def test_lazy_states(self):
+        product = product_lexer(self.lexers)
+        self.assertEqual(len(product['states']), 1)
+        lex_product('5', product)
+        self.assertEqual(len(product['states']), 2)
+
+        state = product['index'][('INFORMAL_TIME_3_9', product['states'][1][1])]
+        self.assertEqual(product_tags(product, state), frozenset([(0, 'INFORMAL_TIME_3_9'), (1, 'NUMBER')]))
+        self.assertEqual(product_tags(product, 0), frozenset())
+
+    def test_start_state(self):
+        lexers = [pa1.lexer, ('A', {'A': (('a', 'B'),), 'B': (('a', 'B'),)}, ('B',), {})]
+        product = product_lexer(lexers)
+        self.assertEqual(lex_product('aa', product)[1], (('B', 'aa'),))
+        with self.assertRaises(ValueError) as raised:
+            lex_product('a b', product)
+        self.assertEqual(str(raised.exception), "No transition from start state A for ' '")
+
+class TestBytes(unittest.TestCase):
+
+    def setUp(self):
+        self.dfa = compile_byte_lexer(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+
+    def test_same_spans(self):
+        strings = [u'', u'Lunch at 12:15pm, call from 2 to 3:30 PM', u'caf\u00e9 at 5 \u4e2d\u6587 or 7-8 p.m.']
+        for string in strings:
+            spans = lex_spans(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            for data in (string.encode('utf-8'), bytearray(string.encode('utf-8')), memoryview(string.encode('utf-8'))):
+                byte_spans = lex_bytes(data, self.dfa, pa1.tokenize_events)
+                self.assertEqual([byte_spans['kinds'][kind] for kind in byte_spans['kind']],
+                    [spans['kinds'][kind] for kind in spans['kind']])
+                self.assertEqual([span_value(byte_spans, i).tobytes() for i in range(len(byte_spans['kind']))],
+                    [span_value(spans, i).encode('utf-8') for i in range(len(spans['kind']))])
+
+    def test_parse_mmap(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'meetings.log')
+            with open(path, 'wb') as output:
+                output.write(b'Lunch at 1200, call from 2 to 3:30 PM or 7-8 p.m.\n' * 10)
+            with open(path, 'rb') as source:
+                data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            spans = lex_bytes(data, self.dfa, pa1.tokenize_events)
+            stmts = parse_bytes(spans, pa1.parser)
+            expected = lex_parse(u'Lunch at 1200, call from 2 to 3:30 PM or 7-8 p.m.\n' * 10, pa1.lexer, pa1.parser)
+            self.assertEqual(tuple(stmt.decode('utf-8') for stmt in stmts), expected)
+            self.assertEqual(len(stmts), 30)
+            del spans
+            data.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_same_as_text(self):
+        strings = [pa1.string, u'caf\u00e9 at 5 \u4e2d\u6587 or from 7 to 8 p.m., \u00fcber 13:45']
+        for string in strings:
+            data = string.encode('utf-8')
+            spans = lex_bytes(data, self.dfa, pa1.tokenize_events)
+            self.assertEqual(tuple((name, value.decode('utf-8')) for name, value in byte_tokens(spans)),
+                lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events))
+            self.assertEqual(tuple(stmt.decode('utf-8') for stmt in parse_bytes(spans, pa1.parser)),
+                pa1.extract_times(string))
+        self.assertEqual(parse_bytes(lex_bytes(pa1.string.encode('utf-8'), self.dfa, pa1.tokenize_events), pa1.parser),
+            (b'1-2 PM', b'1800', b'5:30 PM'))
+
+    def test_accept(self):
+        dfa = compile_bytes({'A': (('[0-9]', 'A'),)}, 'A', ('A',))
+        self.assertTrue(fsm_bytes(b'0123', dfa))
+        self.assertTrue(fsm_bytes(bytearray(b''), dfa))
+        self.assertFalse(fsm_bytes(b'12a', dfa))
+        self.assertFalse(fsm_bytes(u'1\u00e9'.encode('utf-8'), dfa))
+        self.assertRaises(ValueError, lex_bytes, b'0123', dfa, {})
+
+class TestCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = new_cache()
+        string = 'Lunch at 12:15pm, call from 2 to 3:30 PM'
+        expected = lex_parse(string, pa1.lexer, pa1.parser)
+        self.assertEqual(cached_lex_parse(string, pa1.lexer, pa1.parser, cache), expected)
+        self.assertEqual(cached_lex_parse(string, pa1.lexer, pa1.parser, cache), expected)
+        self.assertEqual(cached_lex_parse(u'' + string + ' ', pa1.lexer, pa1.parser, cache), expected)
+
+        info = cache_info(cache)
+        self.assertEqual((info['hits'], info['misses'], info['entries']), (1, 2, 2))
+
+        # Other tables are other entries
+        parser = (pa1.parser_q0, dict(pa1.parser_transitions), pa1.parser_F)
+        cached_lex_parse(string, pa1.lexer, parser, cache)
+        self.assertEqual(cache_info(cache)['misses'], 3)
+
+        clear_cache(cache)
+        self.assertEqual(cache_info(cache)['entries'], 0)
+        self.assertEqual(cache_info(cache)['bytes'], 0)
+
+    def test_eviction(self):
+        cache = new_cache(max_entries=2)
+        for string in ('at 1200', 'at 1300', 'at 1200', 'at 1400'):
+            cached_lex_parse(string, pa1.lexer, pa1.parser, cache)
+        info = cache_info(cache)
+        self.assertEqual((info['hits'], info['misses'], info['evictions'], info['entries']), (1, 3, 1, 2))
+
+        # 'at 1300' was the least recently used
+        cached_lex_parse('at 1200', pa1.lexer, pa1.parser, cache)
+        cached_lex_parse('at 1300', pa1.lexer, pa1.parser, cache)
+        self.assertEqual(cache_info(cache)['hits'], 2)
+
+        cache = new_cache(max_bytes=1)
+        cached_lex_parse('at 1200', pa1.lexer, pa1.parser, cache)
+        self.assertEqual(cache_info(cache)['entries'], 0)
+
+        cache = new_cache()
+        size = cached_lex_parse('at 1200', pa1.lexer, pa1.parser, cache) and cache_info(cache)['bytes']
+        cache = new_cache(max_bytes=size * 2)
+        for string in ('at 1200', 'at 1300', 'at 1400'):
+            cached_lex_parse(string, pa1.lexer, pa1.parser, cache)
+        self.assertEqual(cache_info(cache)['entries'], 2)
+        self.assertLessEqual(cache_info(cache)['bytes'], size * 2)
+
+    def test_tables_released(self):
+        cache = new_cache(max_entries=2)
+        for i in range(10):
+            parser = (pa1.parser_q0, dict(pa1.parser_transitions), pa1.parser_F)
+            cached_lex_parse('at 1200', pa1.lexer, parser, cache)
+        self.assertEqual(cache_info(cache)['tables'], 2)
+
+        cached_lex_parse('at 1300', pa1.lexer, parser, cache)
+        cached_lex_parse('at 1400', pa1.lexer, parser, cache)
+        self.assertEqual(cache_info(cache)['tables'], 1)
+
+    def test_surrogates(self):
+        cache = new_cache()
+        string = u'\ud800 call at 5pm \udfff'
+        expected = lex_parse(string, pa1.lexer, pa1.parser)
+        self.assertEqual(cached_lex_parse(string, pa1.lexer, pa1.parser, cache), expected)
+        self.assertEqual(cached_lex_parse(string, pa1.lexer, pa1.parser, cache), expected)
+        self.assertEqual(cache_info(cache)['hits'], 1)
+
+    def test_threads(self):
+        cache = new_cache(max_entries=5)
+        strings = ['meet at %d:30 pm' % hour for hour in range(1, 10)]
+        expected = dict((string, lex_parse(string, pa1.lexer, pa1.parser)) for string in strings)
+        failures = []
+
+        def work():
+            for i in range(200):
+                string = strings[i % len(strings)]
+                if cached_lex_parse(string, pa1.lexer, pa1.parser, cache) != expected[string]:
+                    failures.append(string)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        info = cache_info(cache)
+        self.assertEqual(failures, [])
+        self.assertEqual(info['hits'] + info['misses'], 800)
+        self.assertLessEqual(info['entries'], 5)
+
+class TestMemo(unittest.TestCase):
+
+    def test_same_as_lex(self):
+        lexer = (pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        memo = new_memo(pa1.lexer_transitions)
+        for string in ('Lunch at 12:15pm, call from 2 to 3:30 PM',
+                u'Caf\u00e9 \u0432 3pm or at 1530, \u4f1a\u8bae 7-8am'):
+            self.assertEqual(lex_memo(string, *(lexer + (memo,))), lex(string, *lexer))
+            self.assertEqual(lex_memo(string, *lexer), lex(string, *lexer))
+
+        misses = memo['misses']
+        lex_memo('Lunch at 12:15pm, call from 2 to 3:30 PM', *(lexer + (memo,)))
+        self.assertEqual(memo['misses'], misses)
+
+    def test_bounded(self):
+        lexer = (pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        memo = new_memo(pa1.lexer_transitions, max_chars=4)
+        string = u''.join(unichr(code) for code in range(0x4e00, 0x4e00 + 500)) + u' at 5pm ' + \
+            u' '.join(unichr(code) for code in range(0x0400, 0x0400 + 200))
+        self.assertEqual(lex_memo(string, *(lexer + (memo,))), lex(string, *lexer))
+
+        info = memo_info(memo)
+        self.assertTrue(info['evictions'] > 0)
+        self.assertTrue(max(info['chars'].values()) <= 4)
+
+    def test_errors(self):
+        transitions = {'A': (('a', 'A'),)}
+        self.assertRaises(ValueError, lex_memo, 'ab', 'A', transitions, ('A',), {})
+        self.assertRaises(ValueError, new_memo, transitions, 0)
+        self.assertRaises(ValueError, lex_memo, 'a', 'A', {'A': (('a', 'A'),)}, ('A',), {},
+            new_memo(transitions))
+
+class TestMaster(unittest.TestCase):
+
+    def assertSameTokens(self, string, transitions, start, final_states, tokenize_events, master):
+        try:
+            expected = lex(string, start, transitions, final_states, tokenize_events)
+        except ValueError as error:
+            with self.assertRaises(ValueError) as raised:
+                lex_master(string, master, tokenize_events)
+            self.assertEqual(str(raised.exception), str(error))
+            return
+        self.assertEqual(lex_master(string, master, tokenize_events), expected)
+
+    def test_pa1_lexer(self):
+        master = compile_master(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+        self.assertIsNone(master['reason'])
+
+        strings = ['', '5pm', 'Meet at 10:30am, or 11 AM - 2 p.m.!', 'at 9:5', '12:30 to 1 pm', u'caf\u00e9 at 3']
+        strings.append('Lunch at 12:15pm then a call from 2 to 3:30 PM, dinner at 7 p.m. or 8pm. ' * 50)
+        strings.append('at 99:99 and 7:7pm or 13 a.m.?! ' * 20)
+        for string in strings:
+            self.assertSameTokens(string, pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F, pa1.tokenize_events, master)
+
+    def test_compiled_lexer(self):
+        rules = [('NUMBER', r'\d+'), ('FLOAT', r'\d+\.\d+'), ('NAME', r'[a-z]\w*'), ('SPACE', r' +')]
+        transitions, start, final_states, tokenize_events = compile_lexer(rules, {'SPACE': tokenize_ignore})
+        master = compile_master(transitions, start, final_states, cache_size=2)
+        self.assertIsNone(master['reason'])
+
+        for string in ('', 'x1 12 1.5', '1.', '1..2', 'a b c d e f', 'ab+', '+', u'\u00e9'):
+            self.assertSameTokens(string, transitions, start, final_states, tokenize_events, master)
+
+    def test_fallback(self):
+        transitions = {
+            'A': (('a', 'B'), ('b', 'A')),
+            'B': (('a', 'A'),),
+        }
+        master = compile_master(transitions, 'A', ('B',))
+        self.assertIsNone(master['regex'])
+        self.assertEqual(master['reason'], 'State A can be reached again through B')
+        self.assertEqual(lex_master('aaa', master, {}), lex('aaa', 'A', transitions, ('B',), {}))
+
+        master = compile_master({'A': (('$', 'A'),)}, 'A', ())
+        self.assertIn('not a single character pattern', master['reason'])
+
+        transitions = {
+            'A': (('a', 'B'), ('b', 'C')),
+            'B': (('[ab]', 'D'),),
+            'C': (('[ab]', 'D'),),
+            'D': (),
+        }
+        self.assertIsNone(compile_master(transitions, 'A', ('D',))['reason'])
+        self.assertIn('more than 4 states', compile_master(transitions, 'A', ('D',), max_states=4)['reason'])
+
+    def test_start_state(self):
+        transitions = {
+            'A': ((' ', 'A'), ('a', 'B')),
+            'B': (('a', 'B'),),
+        }
+        master = compile_master(transitions, 'A', ('B',))
+        for string in ('aa aa', 'a  ', '  ', 'a b', ' b', 'b'):
+            self.assertSameTokens(string, transitions, 'A', ('B',), {}, master)
+
+class TestMinimize(unittest.TestCase):
+
+    def test_merge_states(self):
+        transitions = {
+            'A': (
+                ('0', 'B'),
+                ('1', 'C'),
+            ),
+            'B': (
+                (r"[01]", 'D'),
+            ),
+            'C': (
+                (r"[01]", 'E'),
+            ),
+            'D': (),
+            'E': (),
+        }
+        new_transitions, start, final_states = minimize(transitions, 'A', ('D', 'E'),
+            first_match=False, merge_final_states=True)
+        self.assertEqual(len(new_transitions), 3)
+        self.assertEqual(start, 'A')
+        self.assertEqual(final_states, ('D',))
+
+        for string in ('', '0', '1', '00', '01', '10', '11', '000', '2'):
+            self.assertEqual(fsm(string, start, new_transitions, final_states),
+                fsm(string, 'A', transitions, ('D', 'E')))
+
+    def test_lexer_labels(self):
+        transitions, start, final_states = minimize(pa1.lexer_transitions, pa1.lexer_q0, pa1.lexer_F)
+        self.assertEqual(set(final_states), set(pa1.lexer_F))
+
+        string = pa1.string + ' 11:00 12:00am 0000 at 2400 1. to - 24. 13; 11'
+        tokens = lex(string, start, transitions, final_states, pa1.tokenize_events)
+        self.assertEqual(tokens, lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events))
+
+    def test_parser_sink_states(self):
+        names = ('AT', 'INFORMAL_TIME', '12HOUR_TIME', '24HOUR_TIME', 'NOT_TOKEN', 'TO', 'DASH', 'AM_PM')
+        self.assertEqual(len(pa1.parser_transitions), 12)
+
+        # The equivalent accepting states have different names, so only merge_final_states merges them
+        transitions, start, final_states = minimize(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F,
+            alphabet=names)
+        self.assertEqual(len(transitions), 12)
+
+        transitions, start, final_states = minimize(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F,
+            alphabet=names, merge_final_states=True)
+        self.assertEqual(len(transitions), 10)
+
+        tokens = lex(pa1.string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        self.assertEqual(parse(tokens, start, transitions, final_states), ('1-2 PM', '1800', '5:30 PM'))
+
+class TestNFA(unittest.TestCase):
+
+    def setUp(self):
+        self.transitions = {
+            'A': (
+                (r"[01]", 'A'),
+                ('1', 'B'),
+            ),
+            'B': (
+                (r"[01]", 'C'),
+            ),
+            'C': (
+                (r"[01]", 'D'),
+            ),
+            'D': (),
+        }
+
+    def check_third_from_last(self, dfa):
+        for length in range(9):
+            for number in range(2 ** length):
+                string = format(number, 'b').zfill(length) if length else ''
+                expected = len(string) >= 3 and string[-3] == '1'
+                self.assertEqual(fsm_lazy(string, dfa), expected)
+
+    def test_multiple_targets(self):
+        dfa = lazy_dfa(self.transitions, 'A', ('D'))
+        self.check_third_from_last(dfa)
+        self.assertEqual(dfa['flushes'], 0)
+        self.assertTrue(len(dfa['sets']) <= 9)
+
+    def test_cache_flush(self):
+        dfa = lazy_dfa(self.transitions, 'A', ('D'), cache_size=3)
+        self.check_third_from_last(dfa)
+        self.assertTrue(dfa['flushes'] > 0)
+        self.assertTrue(len(dfa['sets']) <= 3)
+
+    def test_row_size(self):
+        # Strings that end in x, over all of Unicode
+        transitions = {
+            'A': (
+                (r'[^x]', 'A'),
+                ('x', ('A', 'B')),
+            ),
+            'B': (),
+        }
+        dfa = lazy_dfa(transitions, 'A', ('B',), row_size=8)
+        string = u''.join(unichr(code) for code in range(0x4e00, 0x4e00 + 300))
+        self.assertFalse(fsm_lazy(string, dfa))
+        self.assertTrue(fsm_lazy(string + u'x', dfa))
+        self.assertTrue(fsm_lazy(u'x' + string[:20] + u'x', dfa))
+        self.assertTrue(dfa['evictions'] > 0)
+        self.assertTrue(max(len(row) for row in dfa['rows']) <= 8)
+
+    def test_epsilon(self):
+        transitions = {
+            'A': (
+                ('a', 'B'),
+                (None, 'C'),
+            ),
+            'B': (
+                ('b', ('A', 'C')),
+            ),
+            'C': (
+                ('c', 'C'),
+            ),
+        }
+        dfa = lazy_dfa(transitions, 'A', ('C'))
+        self.assertTrue(fsm_lazy('', dfa))
+        self.assertTrue(fsm_lazy('abab', dfa))
+        self.assertTrue(fsm_lazy('ababcc', dfa))
+        self.assertTrue(fsm_lazy('abc', dfa))
+        self.assertFalse(fsm_lazy('aba', dfa))
+        self.assertFalse(fsm_lazy('ca', dfa))
+
+class TestRegexLexer(unittest.TestCase):
+
+    def test_keywords(self):
+        rules = (
+            ('SPACE', r'\s+'),
+            ('IF', r'if'),
+            ('NAME', r'[a-z_]\w*'),
+            ('NUMBER', r'\d+(\.\d+)?'),
+        )
+        transitions, start, final_states, tokenize_events = compile_lexer(rules, {'SPACE': tokenize_ignore})
+        tokens = lex('if iffy 3.25 x1  if_', start, transitions, final_states, tokenize_events)
+        result = (
+            ('IF', 'if'),
+            ('NAME', 'iffy'),
+            ('NUMBER', '3.25'),
+            ('NAME', 'x1'),
+            ('NAME', 'if_'),
+        )
+        self.assertEqual(tokens, result)
+
+    def test_time_rules(self):
+        rules = (
+            ('SPACE', r' +'),
+            ('PUNCTUATION', r'[.?!,;]'),
+            ('DASH', r'-'),
+            ('AT', r'at'),
+            ('TO', r'to'),
+            ('AM_PM', r'[AP]M'),
+            ('INFORMAL_TIME', r'[1-9]|1[0-2]'),
+            ('24HOUR_TIME', r'([01][0-9]|2[0-3])[0-5][0-9]'),
+            ('12HOUR_TIME', r'(0[1-9]|1[0-2]|[1-9]):[0-5][0-9]'),
+            ('NOT_TOKEN', r'[^\-.?!,; ]+'),
+        )
+        events = dict(pa1.tokenize_events)
+        events['INFORMAL_TIME'] = pa1.tokenize_informal_time
+        transitions, start, final_states, tokenize_events = compile_lexer(rules, events)
+
+        for string in (pa1.string, '11:00 12:00am 12:00 AM 24:00 08:22 PM.', '0000 at 2400 1233 1260', '1. to - 24. 13; 11'):
+            tokens = lex(string, start, transitions, final_states, tokenize_events)
+            self.assertEqual(tokens, lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events))
+
+        dfa = compile_dfa(transitions, start, final_states, first_match=True)
+        self.assertTrue(fsm_compiled('12:45', dfa))
+        self.assertFalse(fsm_compiled('--', dfa))
+
+    def test_longest_match_backtrack(self):
+        rules = (
+            ('SPACE', r' +'),
+            ('NUMBER', r'\d+'),
+            ('FLOAT', r'\d+\.\d+'),
+            ('DOT', r'\.'),
+        )
+        transitions, start, final_states, tokenize_events = compile_lexer(rules, {'SPACE': tokenize_ignore})
+        tokens = lex('1. 2.5', start, transitions, final_states, tokenize_events, backtrack=True)
+        self.assertEqual(tokens, (('NUMBER', '1'), ('DOT', '.'), ('FLOAT', '2.5')))
+
+        # Without backtracking the lexer cannot step back from the dot
+        tokens = lex('1. 2.5', start, transitions, final_states, tokenize_events)
+        self.assertEqual(tokens, (('ERROR', '1.'), ('FLOAT', '2.5')))
+
+    def test_invalid_rules(self):
+        self.assertRaises(ValueError, compile_lexer, (('A', r'a*'),))
+        self.assertRaises(ValueError, compile_lexer, (('A', r'^a'),))
+        self.assertRaises(ValueError, compile_lexer, (('A', r'(?i)a'),))
+        self.assertRaises(ValueError, compile_lexer, (('A', r'(?L)a'),))
+        if sys.version_info[0] >= 3:
+            self.assertRaises(ValueError, compile_lexer, (('A', r'(?a)\d'),))
+            self.assertRaises(ValueError, compile_lexer, (('A', r'(?a:\d)'),))
+        if sys.version_info >= (3, 6):
+            self.assertRaises(ValueError, compile_lexer, (('A', r'(?i:a)'),))
+            self.assertRaises(ValueError, compile_lexer, (('A', r'b(?-i:a)'),))
+
 class TestFSMLexer(unittest.TestCase):
 
     def test_basic(self):
@@ -312,6 +1310,71 @@ class TestFSMLexer(unittest.TestCase):
         tokens = lex(string, start_state, transitions, final_states, tokenize_events)
         self.assertEqual(tokens, result)
 
+    def test_long_string(self):
+        string = 'test 111 ' * 20000
+        start_state = 'A'
+        transitions = {
+            'A': (
+                (r'[^1 ]', 'H'),
+                (' ', 'B'),
+                ('1', 'E'),
+            ),
+            'B': (
+                (' ', 'B'),
+            ),
+            'E': (
+                ('1', 'E'),
+            ),
+            'H': (
+                (r'[^ ]', 'H'),
+            ),
+        }
+        tokens = lex(string, start_state, transitions, ('B', 'E'), {'B': tokenize_ignore})
+        self.assertEqual(tokens, (('ERROR', 'test'), ('E', '111')) * 20000)
+
+    def test_backtrack(self):
+        transitions = {
+            'A': (
+                ('a', 'X'),
+                (' ', 'S'),
+            ),
+            'X': (
+                ('a', 'Y'),
+            ),
+            'Y': (
+                ('a', 'Y'),
+                ('b', 'Z'),
+            ),
+            'Z': (),
+            'S': (),
+        }
+        final_states = ('X', 'Z', 'S')
+
+        tokens = lex('aaab aa', 'A', transitions, final_states, {}, backtrack=True)
+        self.assertEqual(tokens, (('Z', 'aaab'), ('S', ' '), ('X', 'a'), ('X', 'a')))
+
+        tokens = lex('aa', 'A', transitions, final_states, {})
+        self.assertEqual(tokens, (('ERROR', 'aa'),))
+
+    def test_backtrack_linear(self):
+        transitions = {
+            'A': (('a', 'X'),),
+            'X': (('a', 'Y'),),
+            'Y': (
+                ('a', 'Y'),
+                ('b', 'Z'),
+            ),
+            'Z': (),
+        }
+        tokens = lex('a' * 20000, 'A', transitions, ('X', 'Z'), {}, backtrack=True)
+        self.assertEqual(tokens, (('X', 'a'),) * 20000)
+
+    def test_start_state_missing_transition(self):
+        transitions = {
+            'A': (('a', 'A'),),
+        }
+        self.assertRaises(ValueError, lex, 'ab', 'A', transitions, ('A'), {})
+
 
 class TestFSMParser(unittest.TestCase):
     
@@ -342,6 +1405,97 @@ class TestFSMParser(unittest.TestCase):
         result = parse(tokens, start_state, transitions, final_states)
         self.assertEqual(result, ('(3)',))
 
+    def test_long_tokens(self):
+        tokens = (
+            ('OPEN_PAREN', '('),
+            ('INT', '3'),
+            ('CLOSE_PAREN', ')'),
+        ) * 20000
+
+        transitions = {
+            'A': (
+                ('OPEN_PAREN', 'B'),
+            ),
+            'B': (
+                ('INT', 'C'),
+            ),
+            'C': (
+                ('CLOSE_PAREN', 'D'),
+            ),
+            'D': (),
+        }
+
+        result = parse(tokens, 'A', transitions, ('D'))
+        self.assertEqual(result, ('(3)',) * 20000)
+
+    def test_compiled_parser(self):
+        parser = compile_parser(pa1.parser_transitions, pa1.parser_q0, pa1.parser_F)
+        self.assertIn('DASH', parser['kinds']['kind_ids'])
+        self.assertIn('AM_PM', parser['kinds']['kind_ids'])
+
+        string = 'Lunch at 12:15pm, call from 2 to 3:30 PM or 7-8 p.m. and at 99:99 or 4 to x'
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        meta = {
+            'stmts': [],
+            'current_stmt': [],
+            'accepted_stmt': None,
+            'start_state': pa1.parser_q0
+        }
+        expected = tuple(fsm_parser(tokens, 0, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F, meta)['stmts'])
+        self.assertTrue(expected)
+        self.assertEqual(parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F), expected)
+        self.assertEqual(tuple(iter_parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)), expected)
+
+        kind_tokens = lex_kinds(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events,
+            parser['kinds'])
+        self.assertEqual([(parser['kinds']['kinds'][kind], value) for kind, value in kind_tokens], list(tokens))
+        self.assertEqual(parse_kinds(kind_tokens, parser), expected)
+
+    def test_compiled_parser_patterns(self):
+        # Patterns are matched at the start of names only, and new names get columns when first seen
+        transitions = {
+            'A': (
+                ('TO', 'B'),
+                (r'[A-Z]+_X', 'C'),
+            ),
+            'B': (),
+            'C': (),
+        }
+        tokens = (('TOKEN', 'a'), ('NEW_X', 'b'), ('TO', 'c'))
+        self.assertEqual(parse(tokens, 'A', transitions, ('B', 'C')), ('a', 'b', 'c'))
+        with self.assertRaises(ValueError) as raised:
+            parse((('OTHER', 'd'),), 'A', transitions, ('B', 'C'))
+        self.assertEqual(str(raised.exception), "No transition from start state A for 'OTHER'")
+
+        # Replacing a state after first use compiles the table again
+        transitions['A'] = (('TO', 'B'), ('OTHER', 'C'))
+        self.assertEqual(parse((('OTHER', 'd'), ('TO', 'c')), 'A', transitions, ('B', 'C')), ('d', 'c'))
+        transitions['A'] = (('OTHER', 'C'),)
+        self.assertRaises(ValueError, parse, (('TO', 'c'),), 'A', transitions, ('B', 'C'))
+
+    def test_compiled_parser_threads(self):
+        # Threads that see new names at the same time extend the shared table without losing columns
+        transitions = {
+            'A': ((r'N\d+_[XY]', 'B'), ('TO', 'C')),
+            'B': (('TO', 'C'),),
+            'C': (),
+        }
+        streams = [tuple(('N%d_%s' % (i, 'X' if i % 2 else 'Y'), str(i)) for i in range(thread, 400, 4)) + (('TO', 't'),)
+            for thread in range(4)]
+        expected = [fsm_parser(stream, 0, 'A', transitions, ('B', 'C'),
+            {'stmts': [], 'current_stmt': [], 'accepted_stmt': None, 'start_state': 'A'})['stmts'] for stream in streams]
+        results = [None] * len(streams)
+
+        def work(thread):
+            results[thread] = list(parse(streams[thread], 'A', transitions, ('B', 'C')))
+
+        threads = [threading.Thread(target=work, args=(thread,)) for thread in range(len(streams))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, expected)
+
 class TestTimeParserAutomaton(unittest.TestCase):
 
     def test_lexer_not_token(self):
@@ -388,6 +1542,51 @@ class TestTimeParserAutomaton(unittest.TestCase):
         )
         self.assertEqual(tokens, result)
 
+    def test_lexer_backtrack(self):
+        string = 'test 12:00am at 5'
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, backtrack=True)
+        result = (
+            ('NOT_TOKEN', 'test'),
+            ('12HOUR_TIME', '12:00'),
+            ('NOT_TOKEN', 'am'),
+            ('AT', ''),
+            ('INFORMAL_TIME', '5'),
+        )
+        self.assertEqual(tokens, result)
+
+    def test_lex_spans(self):
+        string = '11:00 12:00am at 1-2 PM.'
+        spans = lex_spans(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        self.assertEqual(len(spans['kind']), 7)
+        self.assertEqual(spans['kinds'][spans['kind'][0]], '12HOUR_TIME')
+        self.assertEqual((spans['start'][0], spans['end'][0]), (0, 5))
+        self.assertEqual(span_value(spans, 1), '12:00am')
+        self.assertEqual(span_value(spans, 2), 'at')
+
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        self.assertEqual(tuple(span_tokens(spans)), tokens)
+
+    def test_iter_lex_chunks(self):
+        string = pa1.string * 3
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        for size in (1, 2, 7, 64, len(string)):
+            chunks = [string[i:i + size] for i in range(0, len(string), size)]
+            result = iter_lex(iter(chunks), pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            self.assertEqual(tuple(result), tokens)
+
+    def test_iter_lex_file(self):
+        string = u'11:00 12:00am 12:00 AM 24:00 08:22 PM.'
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        source = io.StringIO(string)
+        result = iter_lex(source, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events, chunk_size=4)
+        self.assertEqual(tuple(result), tokens)
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'bytes are text on Python 2')
+    def test_iter_lex_binary_file(self):
+        for data in (b'', b'11:00 PM'):
+            result = iter_lex(io.BytesIO(data), pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+            self.assertRaises(TypeError, tuple, result)
+
     def test_parser_empty(self):
         tokens = (
             ('NOT_TOKEN', 'dsfsf'),
@@ -457,6 +1656,30 @@ class TestTimeParserAutomaton(unittest.TestCase):
         stmts = parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
         self.assertEqual(stmts, result)
 
+    def test_iter_parse(self):
+        tokens = (
+            ('24HOUR_TIME', '2322'),
+            ('TO', ' to '),
+            ('12HOUR_TIME', '11:00'),
+            ('AT', ''),
+            ('12HOUR_TIME', '11:00'),
+            ('INFORMAL_TIME', '8'),
+            ('TO', ' to '),
+            ('INFORMAL_TIME', '11'),
+            ('AM_PM', ' PM'),
+        )
+        stmts = iter_parse(iter(tokens), pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+        self.assertEqual(tuple(stmts), parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F))
+
+    def test_extract_times(self):
+        self.assertEqual(pa1.extract_times(pa1.string), ('1-2 PM', '1800', '5:30 PM'))
+
+        string = '11:00 12:00am 12:00 AM 24:00 08:22 PM. 0000 at 2400 1233 1260 1. to - 24. 13; 11 8 to 9 PM'
+        tokens = lex(string, pa1.lexer_q0, pa1.lexer_transitions, pa1.lexer_F, pa1.tokenize_events)
+        result = parse(tokens, pa1.parser_q0, pa1.parser_transitions, pa1.parser_F)
+        self.assertEqual(pa1.extract_times(string), result)
+        self.assertEqual(pa1.extract_times(io.StringIO(u'' + string)), result)
+
     def test_parser_backtracking(self):
         tokens = (
             ('24HOUR_TIME', '2322'),